@@ -1,39 +1,91 @@
-import subprocess
+import atexit
 import os
+import subprocess
 import time
 
+# Offscreen backends: "xvfb" starts one virtual X server for the process,
+# "osmesa" and "egl" select the VTK render window of a VTK build with
+# software (OSMesa) or headless GPU (EGL) rendering, which needs no X server.
+backends = ("xvfb", "osmesa", "egl")
+_render_windows = {"osmesa": "vtkOSMesaRenderWindow", "egl": "vtkEGLRenderWindow"}
+
+_xvfb = None
+
 
-def launch_display():
+def _socket(display_num):
+    return f"/tmp/.X11-unix/X{display_num}"
+
+
+def _wait_for_socket(display_num, process, timeout):
     """
-    Launch the display module for ENIGMA.
-    This function is a placeholder for the actual implementation.
+    Wait until the X server listens on its socket, instead of sleeping for a
+    fixed time.
     """
-    print("Launching ENIGMA display module...")
-    # Kill any existing Xvfb processes
-
-    subprocess.run(["pkill", "Xvfb"], stderr=subprocess.DEVNULL)
-    time.sleep(1)
-
-    # Start Xvfb with proper configuration
-    display_num = 99
-    subprocess.Popen(
-        [
-            "Xvfb",
-            f":{display_num}",
-            "-screen",
-            "0",
-            "1024x768x24",
-            "-ac",
-            "+extension",
-            "GLX",
-            "+render",
-            "-noreset",
-        ],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
-
-    time.sleep(2)  # Wait for Xvfb to start
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(_socket(display_num)):
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"Xvfb :{display_num} exited with code {process.returncode}"
+            )
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise TimeoutError(f"Xvfb :{display_num} not ready after {timeout} s")
+        time.sleep(0.05)
+
+
+def _stop_xvfb():
+    global _xvfb
+    if _xvfb is not None and _xvfb.poll() is None:
+        _xvfb.terminate()
+        _xvfb.wait()
+    _xvfb = None
+
+
+def launch_display(display_num=99, backend="xvfb", timeout=10.0):
+    """
+    Set up the offscreen context of the process, once.
+
+    Parameters:
+    - display_num: X display of the Xvfb backend.
+    - backend: one of `backends`.
+    - timeout: Seconds to wait for Xvfb to accept connections.
+
+    Later calls return immediately. An X server already listening on the
+    display (e.g. started by the container entry point) is reused; otherwise
+    Xvfb is started and stopped when the process exits.
+    """
+    global _xvfb
+    if backend not in backends:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {backends}")
+    if backend != "xvfb":
+        os.environ["VTK_DEFAULT_OPENGL_WINDOW"] = _render_windows[backend]
+        return
+    if _xvfb is not None and _xvfb.poll() is None:
+        return
+
+    if not os.path.exists(_socket(display_num)):
+        print(f"Launching Xvfb on :{display_num}...")
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [
+                "Xvfb",
+                f":{display_num}",
+                "-screen",
+                "0",
+                "1024x768x24",
+                "-ac",
+                "+extension",
+                "GLX",
+                "+render",
+                "-noreset",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        _wait_for_socket(display_num, process, timeout)
+        _xvfb = process
+        atexit.register(_stop_xvfb)
+        print(f"Xvfb ready in {time.perf_counter() - start:.2f} s")
 
     # Set display environment
     os.environ["DISPLAY"] = f":{display_num}"
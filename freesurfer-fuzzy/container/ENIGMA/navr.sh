@@ -2,6 +2,15 @@
 
 set -e
 
+# All the maps are rendered in one container run from a job manifest
+manifest="navr_manifest.json"
+jobs=()
+
+add_job() {
+  local csv="$1" metric="$2" output_dir="$3"
+  jobs+=("{\"disorder_filename\": \"${csv}\", \"livingpark_input\": \"${csv}\", \"metric\": \"${metric}\", \"output_dir\": \"${output_dir}\"}")
+}
+
 # Cross-sectional NAVR figures
 for group in "hc" "pd"; do
   for study in "baseline" "followup"; do
@@ -17,18 +26,7 @@ for group in "hc" "pd"; do
         arg=""
       fi
       python3 ./container/ENIGMA/add_hemi_region.py navr_${group}_${metric}_${study}.csv --overwrite ${arg}
-      ./container/ENIGMA/threshold_cohen_d.sh \
-      --disorder_filename navr_${group}_${metric}_${study}.csv \
-      --cohen_d_name NAVR \
-      --vmin 0 \
-      --vmax 1 \
-      --livingpark_input navr_${group}_${metric}_${study}.csv \
-      --disorder NAVR \
-      --do-not-threshold \
-      --threshold_name NAVR \
-      --metric $metric \
-      --cmap jet \
-      --output_dir $output_dir
+      add_job navr_${group}_${metric}_${study}.csv $metric $output_dir
     done
   done
 done
@@ -47,17 +45,22 @@ for group in "hc" "pd" ; do
       arg=""
     fi
     python3 ./container/ENIGMA/add_hemi_region.py navr_${group}_${metric}_longitudinal.csv --overwrite ${arg}
-    ./container/ENIGMA/threshold_cohen_d.sh \
-    --disorder_filename navr_${group}_${metric}_longitudinal.csv \
-    --cohen_d_name NAVR \
-    --vmin 0 \
-    --vmax 1 \
-    --livingpark_input navr_${group}_${metric}_longitudinal.csv \
-    --disorder NAVR \
-    --do-not-threshold \
-    --threshold_name NAVR \
-    --metric $metric \
-    --cmap jet \
-    --output_dir $output_dir
+    add_job navr_${group}_${metric}_longitudinal.csv $metric $output_dir
   done
 done
+
+{
+  echo '{"defaults": {"disorder": "NAVR", "cohen_d_name": "NAVR", "threshold_name": "NAVR",'
+  echo '              "threshold": false, "cmap": "jet", "vmin": 0, "vmax": 1},'
+  echo ' "jobs": ['
+  for i in "${!jobs[@]}"; do
+    if [ "$i" -lt $((${#jobs[@]} - 1)) ]; then
+      echo "  ${jobs[$i]},"
+    else
+      echo "  ${jobs[$i]}"
+    fi
+  done
+  echo ']}'
+} > $manifest
+
+./container/ENIGMA/threshold_cohen_d.sh --manifest $manifest
@@ -0,0 +1,140 @@
+"""
+Parity of the persistent renderer with the enigmatoolbox plots.
+
+`plot_summary_stats` renders a map with `MapRenderer` and falls back to
+`plot_cortical` / `plot_subcortical`; both must give the same picture
+(camera, colormap, colour limits, NaN colour, layout). This script renders the
+same maps both ways through `plot_summary_stats` and compares the PNGs: the
+image sizes must match and the root mean square difference of the RGB values
+(in [0, 1]) must stay under `--tolerance`. A difference image is saved next to
+each pair of screenshots.
+
+The maps are the ENIGMA-Epilepsy Cohen's d of cortical thickness and
+subcortical volume, as is and with a third of the regions set to NaN (as a
+thresholded map).
+
+Usage (in the ENIGMA container):
+    python3 /opt/ENIGMA/parity.py --output_dir /output/parity
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import matplotlib.image as mpimg
+from enigmatoolbox.datasets import load_summary_stats
+
+from display import backends
+from renderer import MapRenderer
+from plot import plot_summary_stats
+
+
+def parity_maps():
+    """Cortical and subcortical test maps, by name."""
+    sum_stats = load_summary_stats("epilepsy")
+    ct = sum_stats["CortThick_case_vs_controls_ltle"]["d_icv"].to_numpy()
+    sv = sum_stats["SubVol_case_vs_controls_ltle"]["d_icv"].to_numpy()
+    maps = {}
+    for name, values, subcortical in (("ct", ct, False), ("sv", sv, True)):
+        thresholded = values.astype(np.float64)
+        thresholded[::3] = np.nan
+        maps[name] = (values, subcortical)
+        maps[f"{name}_thresholded"] = (thresholded, subcortical)
+    return maps
+
+
+def compare_images(filename_a, filename_b, filename_diff=None):
+    """
+    Compare two screenshots.
+
+    Parameters:
+    - filename_a, filename_b: PNG files.
+    - filename_diff: PNG file of the absolute RGB difference, if given.
+
+    Returns:
+    - Root mean square RGB difference, or None if the sizes differ.
+    """
+    a = mpimg.imread(str(filename_a))[..., :3]
+    b = mpimg.imread(str(filename_b))[..., :3]
+    if a.shape != b.shape:
+        print(f"{filename_a} is {a.shape}, {filename_b} is {b.shape}")
+        return None
+    diff = np.abs(a - b)
+    if filename_diff is not None:
+        mpimg.imsave(str(filename_diff), diff.max(axis=-1), cmap="gray", vmin=0, vmax=1)
+    return float(np.sqrt(np.mean(diff**2)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare MapRenderer screenshots with the enigmatoolbox plots."
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="parity",
+        help="Directory of the screenshots and difference images.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.01,
+        help="Maximum root mean square RGB difference (default: 0.01).",
+    )
+    parser.add_argument(
+        "--cmap", type=str, default="RdBu_r", help="Colormap of the maps."
+    )
+    parser.add_argument("--vmin", type=float, default=-0.5, help="Colour minimum.")
+    parser.add_argument("--vmax", type=float, default=0.5, help="Colour maximum.")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="xvfb",
+        choices=backends,
+        help="Offscreen rendering backend.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    renderer = MapRenderer(size=(800, 400), scale=(4, 4), backend=args.backend)
+
+    failed = []
+    for name, (values, subcortical) in parity_maps().items():
+        data = pd.DataFrame({"d": values})
+        filenames = {
+            engine: output_dir / f"{name}_{engine}.png"
+            for engine in ("renderer", "enigmatoolbox")
+        }
+        for engine, filename in filenames.items():
+            plot_summary_stats(
+                data,
+                "d",
+                str(filename),
+                cmap=args.cmap,
+                vmin=args.vmin,
+                vmax=args.vmax,
+                subcortical=subcortical,
+                renderer=renderer if engine == "renderer" else None,
+            )
+        rmse = compare_images(
+            filenames["renderer"],
+            filenames["enigmatoolbox"],
+            output_dir / f"{name}_diff.png",
+        )
+        ok = rmse is not None and rmse <= args.tolerance
+        print(f"{name:<20} rmse={rmse} {'ok' if ok else 'FAILED'}")
+        if not ok:
+            failed.append(name)
+    if failed:
+        print(f"Renderer differs from enigmatoolbox for {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
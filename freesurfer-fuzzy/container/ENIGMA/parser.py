@@ -1,3 +1,9 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
 import pandas as pd
 from pandas.api import types as ptypes
 
@@ -177,6 +183,24 @@ enigma_cortical_regions = [
 ]
 
 
+# Normalized ENIGMA summary statistics, kept next to the scripts (the mounted
+# /opt/ENIGMA directory of the container) so that they outlive a run
+summary_stats_cache_dir = Path(
+    os.environ.get(
+        "ENIGMA_SUMMARY_STATS_CACHE", Path(__file__).parent / "cache" / "summary_stats"
+    )
+)
+
+
+@lru_cache(maxsize=None)
+def load_disorder_summary_stats(disorder):
+    """
+    All the summary statistics tables of a disorder, read once per process
+    (the parsers correct copies of the tables).
+    """
+    return load_summary_stats(disorder)
+
+
 class ENIGMAParser:
 
     _disorders = {
@@ -340,10 +364,14 @@ class ENIGMAParser:
             )
         return metric
 
-    def __init__(self, disorder, metric, cohen_d_name):
+    def __init__(
+        self, disorder, metric, cohen_d_name, cache_dir=summary_stats_cache_dir
+    ):
         self.disorder = self._assert_disorder(disorder)
         self.metric = self._assert_metric(metric)
         self.cohen_d_name = cohen_d_name
+        # None parses the enigmatoolbox tables on every call
+        self.cache_dir = cache_dir
 
     def get_subgroup_from_column_name(self, column_name):
         fields = column_name.split("case_vs_controls")[-1].split("_")[1:]
@@ -422,7 +450,7 @@ class ENIGMAParser:
                     f"Number of controls for {self.disorder} and {self.metric} is not defined."
                 )
 
-    def correct_population_size(self, stats, subgroup, summary_stats):
+    def normalize_population_size(self, summary_stats):
         for stats, subgroup in zip(
             summary_stats["statistics"], summary_stats["subgroup"]
         ):
@@ -437,6 +465,9 @@ class ENIGMAParser:
                     stats["n_controls"].str.replace(",", "").replace("_", "")
                 )
             stats["population_size"] = stats["n_patients"] + stats["n_controls"]
+
+    def check_population_size(self, summary_stats):
+        for stats in summary_stats["statistics"]:
             # assert population_size is not null or population_size is null and cohen_d is not null
             if (
                 stats[
@@ -450,6 +481,33 @@ class ENIGMAParser:
                     f"Population size for {self.disorder} and {self.metric} is not defined."
                 )
 
+    def parse_summary_stats(self):
+        """
+        Parse the enigmatoolbox tables of the disorder and metric: one table
+        per subgroup, in ENIGMA region order, with corrected `n_patients`,
+        `n_controls` and `population_size`.
+        """
+        summary_stats = {
+            "disorder": self.disorder,
+            "metric": self.metric,
+            "subgroup": [],
+            "statistics": [],
+        }
+        data = load_disorder_summary_stats(self.disorder)
+        column_names = self._metric_to_column_mapping[self.disorder][self.metric]
+        if not isinstance(column_names, list):
+            column_names = [column_names]
+        for col in column_names:
+            if col not in data:
+                continue
+            subgroup = self.get_subgroup_from_column_name(col)
+            summary_stats["subgroup"].append(subgroup)
+            summary_stats["statistics"].append(
+                to_enigma_order(data[col].copy(), self.metric == "subcortical_volume")
+            )
+        self.normalize_population_size(summary_stats)
+        return summary_stats
+
     def load_summary_stats(self):
         """
         Load ENIGMA summary statistics.
@@ -463,29 +521,125 @@ class ENIGMAParser:
         if self.metric not in self._metric_to_column_mapping[self.disorder]:
             return None
 
-        summary_stats = {
-            "disorder": self.disorder,
-            "metric": self.metric,
-            "subgroup": [],
-            "statistics": [],
-        }
-        data = load_summary_stats(self.disorder)
-        column_names = self._metric_to_column_mapping[self.disorder][self.metric]
-        if not isinstance(column_names, list):
-            column_names = [column_names]
-        if isinstance(column_names, list):
-            for col in column_names:
-                if col not in data:
-                    continue
-                subgroup = self.get_subgroup_from_column_name(col)
-                summary_stats["subgroup"].append(subgroup)
-                summary_stats["statistics"].append(data[col])
-        self.correct_population_size(
-            summary_stats["statistics"], summary_stats["subgroup"], summary_stats
-        )
+        if self.cache_dir is None:
+            summary_stats = self.parse_summary_stats()
+        else:
+            summary_stats = read_cached_summary_stats(
+                self.disorder, self.metric, self.cache_dir
+            )
+        self.check_population_size(summary_stats)
         return summary_stats
 
 
+def to_enigma_order(stats, subcortical=False):
+    """Sort the regions of an ENIGMA table in the plotting order."""
+    regions = enigma_subcortical_regions if subcortical else enigma_cortical_regions
+    if "Structure" not in stats or set(stats["Structure"]) != set(regions):
+        # left for assert_ordered_regions to report
+        return stats
+    return stats.set_index("Structure").reindex(regions).reset_index()
+
+
+def summary_stats_cache_key():
+    """
+    Version of the normalized tables: enigmatoolbox version and the parser
+    corrections.
+    """
+    import enigmatoolbox
+
+    corrections = json.dumps(
+        [
+            ENIGMAParser._metric_to_column_mapping,
+            ENIGMAParser._number_of_patients,
+            ENIGMAParser._number_of_controls,
+        ],
+        sort_keys=True,
+    )
+    version = getattr(enigmatoolbox, "__version__", "unknown")
+    return f"{version}-{hashlib.sha1(corrections.encode()).hexdigest()[:12]}"
+
+
+def build_summary_stats_cache(cache_dir=summary_stats_cache_dir):
+    """
+    Normalize the summary statistics of every disorder, metric and subgroup
+    into `<cache_dir>/<disorder>/<metric>/<subgroup>.parquet`.
+
+    The tables are those of `ENIGMAParser.parse_summary_stats`. A disorder
+    and metric whose population size cannot be corrected is recorded with its
+    error in `index.json`, which is written last.
+
+    Returns:
+    - The index: cache key and, per "<disorder>/<metric>", the subgroups and
+      their files (relative to `cache_dir`) or the error.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    gitignore = cache_dir / ".gitignore"
+    if not gitignore.exists():
+        gitignore.write_text("*\n")
+    index = {"key": summary_stats_cache_key(), "tables": {}}
+    for disorder in sorted(ENIGMAParser._disorders):
+        for metric in ENIGMAParser._metric_to_column_mapping[disorder]:
+            parser = ENIGMAParser(disorder, metric, cohen_d_name=None, cache_dir=None)
+            try:
+                summary_stats = parser.parse_summary_stats()
+            except ValueError as error:
+                index["tables"][f"{disorder}/{metric}"] = {"error": str(error)}
+                continue
+            files = []
+            for subgroup, stats in zip(
+                summary_stats["subgroup"], summary_stats["statistics"]
+            ):
+                filename = Path(disorder) / metric / f"{subgroup}.parquet"
+                (cache_dir / filename).parent.mkdir(parents=True, exist_ok=True)
+                stats.to_parquet(cache_dir / filename, index=False)
+                files.append([subgroup, str(filename)])
+            index["tables"][f"{disorder}/{metric}"] = {"subgroups": files}
+    # write then rename, for concurrent runs sharing the cache
+    tmp = cache_dir / f"index.{os.getpid()}.tmp"
+    tmp.write_text(json.dumps(index, indent=1))
+    os.replace(tmp, cache_dir / "index.json")
+    print(f"Saved normalized ENIGMA summary statistics to {cache_dir}")
+    return index
+
+
+@lru_cache(maxsize=None)
+def load_summary_stats_index(cache_dir=summary_stats_cache_dir):
+    """
+    Index of the normalized summary statistics, (re)built on first use or
+    when the enigmatoolbox version or the parser corrections change.
+    """
+    filename = Path(cache_dir) / "index.json"
+    if filename.exists():
+        index = json.loads(filename.read_text())
+        if index.get("key") == summary_stats_cache_key():
+            return index
+    return build_summary_stats_cache(cache_dir)
+
+
+def read_cached_summary_stats(disorder, metric, cache_dir=summary_stats_cache_dir):
+    """
+    Normalized summary statistics of a disorder and metric, memory-mapped
+    from the cache (as `ENIGMAParser.parse_summary_stats`).
+    """
+    cache_dir = Path(cache_dir)
+    entry = load_summary_stats_index(cache_dir)["tables"][f"{disorder}/{metric}"]
+    if "error" in entry:
+        raise ValueError(entry["error"])
+    summary_stats = {
+        "disorder": disorder,
+        "metric": metric,
+        "subgroup": [],
+        "statistics": [],
+    }
+    for subgroup, filename in entry["subgroups"]:
+        summary_stats["subgroup"].append(subgroup)
+        summary_stats["statistics"].append(
+            pd.read_parquet(cache_dir / filename, memory_map=True)
+        )
+    return summary_stats
+
+
 class GeneralParser:
     """
     General parser for ENIGMA summary statistics.
@@ -2,19 +2,24 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 import numpy as np
+import json
 import os
+import sys
+import time
+from functools import lru_cache
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 from matplotlib.colors import ListedColormap
 
 
 from enigmatoolbox.datasets import load_summary_stats
-from enigmatoolbox.utils.parcellation import parcel_to_surface
 from enigmatoolbox.plotting import plot_cortical
 from enigmatoolbox.plotting import plot_subcortical
 
-import display
 from parser import LivingParkParser, ENIGMAParser, GeneralParser, assert_ordered_regions
+from display import backends
+from renderer import MapRenderer
+from projection import project
 
 
 def threshold_summary_stats(enigma_data, livingpark_data, metric, cohen_d_name):
@@ -28,6 +33,8 @@ def threshold_summary_stats(enigma_data, livingpark_data, metric, cohen_d_name):
     Returns:
     - DataFrame with significant results.
     """
+    # the LivingPark table is shared by the jobs of a manifest
+    livingpark_data = livingpark_data.copy()
     livingpark_data["NAVR_corrected"] = (
         2 / np.sqrt(enigma_data["population_size"])
     ) * livingpark_data["NAVR"]
@@ -57,6 +64,8 @@ def plot_summary_stats(
     subcortical=False,
     title=None,
     threshold=None,
+    renderer=None,
+    surface=None,
 ):
     """
     Plot summary statistics.
@@ -65,10 +74,31 @@ def plot_summary_stats(
     - data: DataFrame containing the summary statistics.
     - metric: Metric to plot.
     - title: Title of the plot.
+    - renderer: Persistent `MapRenderer`; enigmatoolbox builds a new scene
+      per plot if None or if the renderer cannot find the meshes.
+    - surface: fsa5 vertex values of `data[metric]` (see `projection.project`),
+      projected here if None.
     """
     nan_color = (0.15, 0.15, 0.20, 1)
     scale = (4, 4)
     print(f"Plotting {metric} with vmin={vmin}, vmax={vmax}")
+    start = time.perf_counter()
+    if not subcortical and surface is None:
+        surface = project(data[metric], "aparc_fsa5")
+    if renderer is not None:
+        try:
+            if subcortical:
+                renderer.render_subcortical(
+                    data[metric], filename, cmap, vmin, vmax, nan_color
+                )
+            else:
+                renderer.render_cortical(surface, filename, cmap, vmin, vmax, nan_color)
+            print(f"Plot saved to {filename} ({time.perf_counter() - start:.2f} s)")
+            return
+        except FileNotFoundError as error:
+            # meshes not found; a mismatch of values and vertices (ValueError)
+            # is a bug and propagates
+            print(f"Persistent renderer unavailable ({error}), using enigmatoolbox")
     if subcortical:
         plot_subcortical(
             array_name=data[metric],
@@ -82,7 +112,6 @@ def plot_summary_stats(
             scale=scale,
         )
     else:
-        surface = parcel_to_surface(data[metric], "aparc_fsa5")
         plot_cortical(
             array_name=surface,
             surface_name="fsa5",
@@ -96,7 +125,7 @@ def plot_summary_stats(
             label_text={"top": ["", "", "", ""]},
             scale=scale,
         )
-    print(f"Plot saved to {filename}")
+    print(f"Plot saved to {filename} ({time.perf_counter() - start:.2f} s)")
 
 
 def save_thresholded_summary_stats(data, metric, filename, cohen_d_name):
@@ -132,8 +161,7 @@ def parse_args():
     parser.add_argument(
         "--disorder",
         type=str,
-        required=True,
-        help="Disorder to plot.",
+        help="Disorder to plot (required without --manifest).",
     )
     parser.add_argument(
         "--disorder_filename",
@@ -179,15 +207,13 @@ def parse_args():
     parser.add_argument(
         "--metric",
         type=str,
-        required=True,
         choices=["thickness", "area", "volume", "subcortical_volume"],
-        help="Metric to plot.",
+        help="Metric to plot (required without --manifest).",
     )
     parser.add_argument(
         "--livingpark_input",
         type=str,
-        required=True,
-        help="Path to LivingPark summary statistics CSV file.",
+        help="Path to LivingPark summary statistics CSV file (required without --manifest).",
     )
     parser.add_argument(
         "--output_filename",
@@ -201,99 +227,189 @@ def parse_args():
         help="Directory to save output plots and CSV files.",
     )
     parser.add_argument("--title", type=str, default=None, help="Title for the plot.")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="xvfb",
+        choices=backends,
+        help="Offscreen rendering backend.",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="JSON (or YAML) list of jobs, rendered in one process; see `load_manifest`.",
+    )
 
     return parse_and_check_args(parser)
 
 
 def parse_and_check_args(parser):
     args = parser.parse_args()
+    if not args.manifest:
+        missing = [f"--{key}" for key in required_job_keys if not getattr(args, key)]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
     return args
 
 
-def main():
-    args = parse_args()
-    disorder = args.disorder
-    disorder_filename = args.disorder_filename
-    metric = args.metric
-    cohen_d_name = args.cohen_d_name
-    subcortical = args.metric == "subcortical_volume"
-    livingpark_input = args.livingpark_input
-    title = args.title
-    output_dir = Path(args.output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
+# Keys of a job, with the defaults of the command line
+required_job_keys = ["disorder", "metric", "livingpark_input"]
+job_defaults = {
+    "disorder_filename": None,
+    "cohen_d_name": "d_icv",
+    "threshold_name": "Cohen_d",
+    "threshold": True,
+    "cmap": "RdBu_r",
+    "vmin": -0.5,
+    "vmax": 0.5,
+    "output_dir": str(Path.cwd() / "enigma_map"),
+    "title": None,
+}
+
+
+def job_from_args(args):
+    """Job of a single command line run."""
+    job = {key: getattr(args, key) for key in required_job_keys}
+    job.update({key: getattr(args, key) for key in job_defaults if hasattr(args, key)})
+    job["threshold"] = not args.do_not_threshold
+    return job
 
+
+def load_manifest(filename):
+    """
+    Load a job manifest.
+
+    The manifest is a list of jobs, or a dictionary with the `jobs` list and
+    `defaults` shared by the jobs. A job has the keys `disorder`, `metric`,
+    `livingpark_input` and optionally those of `job_defaults` (`threshold:
+    false` for `--do-not-threshold`). Relative paths are relative to the
+    working directory. YAML manifests (`.yml`, `.yaml`) need PyYAML.
+
+    Example:
+        {"defaults": {"cohen_d_name": "NAVR", "threshold": false},
+         "jobs": [{"disorder": "NAVR", "metric": "thickness",
+                   "disorder_filename": "navr.csv",
+                   "livingpark_input": "navr.csv", "output_dir": "figures"}]}
+    """
+    with open(filename) as f:
+        if Path(filename).suffix in (".yml", ".yaml"):
+            import yaml
+
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+    defaults = dict(job_defaults, **manifest.get("defaults", {}))
+    jobs = []
+    for i, job in enumerate(manifest["jobs"]):
+        job = dict(defaults, **job)
+        missing = [key for key in required_job_keys if not job.get(key)]
+        if missing:
+            raise ValueError(f"Job {i} of {filename} is missing {missing}")
+        unknown = set(job) - set(job_defaults) - set(required_job_keys)
+        if unknown:
+            raise ValueError(f"Job {i} of {filename} has unknown keys {unknown}")
+        jobs.append(job)
+    return jobs
+
+
+@lru_cache(maxsize=None)
+def load_enigma_data(
+    disorder, metric, cohen_d_name, disorder_filename=None, threshold_name=None
+):
+    """
+    Summary statistics of a disorder (from `disorder_filename` if given),
+    loaded once per process.
+    """
     if disorder_filename:
         # Load General summary statistics from the specified file
         general_parser = GeneralParser(
             disorder=disorder,
             metric=metric,
             filename=disorder_filename,
-            threshold_name=args.threshold_name,
+            threshold_name=threshold_name,
         )
         enigma_data = general_parser.load_summary_stats()
         print(f"Loaded data from {disorder_filename} with metric {metric}")
-    elif disorder:
-        # Load ENIGMA summary statistics for the specified disorder
-        enigma_parser = ENIGMAParser(
-            disorder=disorder,
-            metric=metric,
-            cohen_d_name=cohen_d_name,
-        )
-        enigma_data = enigma_parser.load_summary_stats()
-        if not enigma_data:
-            print(f"No data found for disorder {disorder} with metric {metric}.")
-            return
+        return enigma_data
+    # Load ENIGMA summary statistics for the specified disorder
+    enigma_parser = ENIGMAParser(
+        disorder=disorder,
+        metric=metric,
+        cohen_d_name=cohen_d_name,
+    )
+    enigma_data = enigma_parser.load_summary_stats()
+    if enigma_data:
         print(f"Loaded ENIGMA data for {disorder} with metric {metric}")
+    return enigma_data
 
-    # Load LivingPark summary statistics
+
+@lru_cache(maxsize=None)
+def load_livingpark_data(livingpark_input, subcortical):
+    """LivingPark summary statistics, loaded once per process."""
     livingpark_parser = LivingParkParser(
         filename=livingpark_input,
     )
     livingpark_data = livingpark_parser.load_summary_stats(subcortical=subcortical)
     print(f"Loaded LivingPark data from {livingpark_input}")
+    return livingpark_data
+
 
-    # Set up virtual display
-    display.launch_display()
+def run_job(job, renderer):
+    """
+    Plot the maps (and save the thresholded CSVs) of one job.
 
+    Parameters:
+    - job: Dictionary with the keys of `job_defaults` and `required_job_keys`.
+    - renderer: Persistent `MapRenderer` shared by the jobs.
+
+    Returns:
+    - Number of PNG files written.
+    """
+    disorder = job["disorder"]
+    metric = job["metric"]
+    cohen_d_name = job["cohen_d_name"]
+    subcortical = metric == "subcortical_volume"
+    output_dir = Path(job["output_dir"])
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    enigma_data = load_enigma_data(
+        disorder,
+        metric,
+        cohen_d_name,
+        job["disorder_filename"],
+        job["threshold_name"],
+    )
+    if not enigma_data:
+        print(f"No data found for disorder {disorder} with metric {metric}.")
+        return 0
+    livingpark_data = load_livingpark_data(job["livingpark_input"], subcortical)
+
+    # Maps of all the subgroups (thresholded or not), projected at once
+    maps = []
     for subgroup, data in zip(enigma_data["subgroup"], enigma_data["statistics"]):
         print(f"Processing subgroup: {subgroup}")
         png_dir = output_dir / disorder / "png"
         os.makedirs(png_dir, exist_ok=True)
 
-        # Plotting summary statistics
-        print(f"Plotting summary statistics for {disorder}, {metric}, {subgroup}")
         filename = png_dir / f"{disorder}_{metric}_{subgroup}.png"
         assert_ordered_regions(data, subcortical=subcortical)
-        plot_summary_stats(
-            data,
-            metric=f"{cohen_d_name}",
-            filename=str(filename.resolve()),
-            vmin=args.vmin,
-            vmax=args.vmax,
-            cmap=args.cmap,
-            subcortical=subcortical,
-            title=title,
-        )
-        if args.do_not_threshold is None or not args.do_not_threshold:
-            # Plotting thresholded summary statistics
-            print(
-                f"Plotting thresholded summary statistics for {disorder}, {metric}, {subgroup}"
-            )
+        maps.append((data, f"{cohen_d_name}", filename, None, subgroup))
+        if job["threshold"]:
             thresholded_data = threshold_summary_stats(
                 data, livingpark_data, metric, cohen_d_name
             )
             filename = png_dir / f"{disorder}_{metric}_{subgroup}_thresholded.png"
             assert_ordered_regions(thresholded_data, subcortical=subcortical)
-            plot_summary_stats(
-                thresholded_data,
-                metric=f"{cohen_d_name}_thresholded",
-                filename=str(filename.resolve()),
-                subcortical=subcortical,
-                vmin=args.vmin,
-                vmax=args.vmax,
-                cmap=args.cmap,
-                title=title,
-                threshold=True,
+            maps.append(
+                (
+                    thresholded_data,
+                    f"{cohen_d_name}_thresholded",
+                    filename,
+                    True,
+                    subgroup,
+                )
             )
 
             csv_dir = output_dir / disorder / "csv"
@@ -307,6 +423,74 @@ def main():
                 cohen_d_name=cohen_d_name,
             )
 
+    surfaces = [None] * len(maps)
+    if maps and not subcortical:
+        values = np.column_stack([data[column] for data, column, *_ in maps])
+        surfaces = project(values, "aparc_fsa5").T
+
+    n_png = 0
+    for (data, column, filename, threshold, subgroup), surface in zip(maps, surfaces):
+        kind = "thresholded summary statistics" if threshold else "summary statistics"
+        print(f"Plotting {kind} for {disorder}, {metric}, {subgroup}")
+        plot_summary_stats(
+            data,
+            metric=column,
+            filename=str(filename.resolve()),
+            vmin=job["vmin"],
+            vmax=job["vmax"],
+            cmap=job["cmap"],
+            subcortical=subcortical,
+            title=job["title"],
+            threshold=threshold,
+            renderer=renderer,
+            surface=surface,
+        )
+        n_png += 1
+    return n_png
+
+
+def print_timings(timings):
+    """Print the per-job timing summary."""
+    print("=" * 80)
+    print(f"{'job':<50} {'status':>8} {'maps':>5} {'time (s)':>10}")
+    for label, status, n_png, seconds in timings:
+        print(f"{label:<50} {status:>8} {n_png:>5} {seconds:>10.2f}")
+    total = sum(seconds for *_, seconds in timings)
+    n_maps = sum(n_png for _, _, n_png, _ in timings)
+    print(f"{'total':<50} {'':>8} {n_maps:>5} {total:>10.2f}")
+    print("=" * 80)
+
+
+def main():
+    args = parse_args()
+    if args.manifest:
+        jobs = load_manifest(args.manifest)
+        print(f"Loaded {len(jobs)} jobs from {args.manifest}")
+    else:
+        jobs = [job_from_args(args)]
+
+    # One offscreen context and render window for all the plots
+    renderer = MapRenderer(size=(800, 400), scale=(4, 4), backend=args.backend)
+
+    timings = []
+    for i, job in enumerate(jobs, start=1):
+        label = f"{job['disorder']}/{job['metric']} -> {job['output_dir']}"
+        print(f"[{i}/{len(jobs)}] {label}")
+        start = time.perf_counter()
+        try:
+            n_png = run_job(job, renderer)
+            status = "ok"
+        except Exception as error:
+            if len(jobs) == 1:
+                raise
+            # a failed job does not stop the batch; reported in the summary
+            print(f"Job failed: {error!r}")
+            n_png, status = 0, "failed"
+        timings.append((label, status, n_png, time.perf_counter() - start))
+    print_timings(timings)
+    if any(status != "ok" for _, status, _, _ in timings):
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
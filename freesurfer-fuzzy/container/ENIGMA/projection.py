@@ -0,0 +1,114 @@
+"""
+Sparse parcel-to-surface projection of ENIGMA region values.
+
+`enigmatoolbox.utils.parcellation.parcel_to_surface` reloads the parcellation
+labels and maps the region values onto the surface vertices for every map.
+The mapping is linear: each vertex takes the value of its region (or NaN
+outside the parcellation). `projection_matrix` builds it once per atlas and
+surface as a sparse vertex x region matrix, stored on disk, so that a batch of
+region vectors (subgroups, thresholded and unthresholded maps) is projected
+with one sparse matrix product.
+
+Usage:
+    surfaces = project(np.column_stack([d, d_thresholded]), "aparc_fsa5")
+    renderer.render_cortical(surfaces[:, 0], "d.png")
+"""
+
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+
+# Projection matrices are kept next to the scripts, i.e. in the mounted
+# /opt/ENIGMA directory of the container, so that they outlive a run
+default_cache_dir = Path(
+    os.environ.get("ENIGMA_PROJECTION_CACHE", Path(__file__).parent / "cache")
+)
+
+# Number of regions of the ENIGMA parcellations
+n_regions = {"aparc_fsa5": 68, "aparc_conte69": 68}
+
+
+def _cache_filename(target_lab, cache_dir):
+    import enigmatoolbox
+
+    version = getattr(enigmatoolbox, "__version__", "unknown")
+    return Path(cache_dir) / f"{target_lab}_enigmatoolbox-{version}.npz"
+
+
+def build_projection_matrix(target_lab="aparc_fsa5"):
+    """
+    Vertex x region matrix of `parcel_to_surface`.
+
+    The matrix is read off `parcel_to_surface` itself by projecting the region
+    indices: a vertex receives the index of its region, or NaN (an empty row)
+    outside the parcellation.
+
+    Parameters:
+    - target_lab: Parcellation and surface, as `parcel_to_surface`.
+
+    Returns:
+    - CSR matrix of shape (n_vertices, n_regions) with one 1 per labelled vertex.
+    """
+    from enigmatoolbox.utils.parcellation import parcel_to_surface
+
+    indices = np.arange(n_regions[target_lab], dtype=np.float64)
+    region = parcel_to_surface(indices, target_lab)
+    labelled = ~np.isnan(region)
+    if not np.array_equal(region[labelled], np.round(region[labelled])):
+        raise ValueError(f"parcel_to_surface({target_lab}) is not a region lookup")
+    rows = np.flatnonzero(labelled)
+    cols = region[labelled].astype(np.int64)
+    return sp.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)),
+        shape=(len(region), len(indices)),
+    )
+
+
+@lru_cache(maxsize=None)
+def projection_matrix(target_lab="aparc_fsa5", cache_dir=default_cache_dir):
+    """
+    Projection matrix of a parcellation, built on first use and then read
+    from `cache_dir` (once per process).
+    """
+    filename = _cache_filename(target_lab, cache_dir)
+    if filename.exists():
+        return sp.load_npz(filename).tocsr()
+    matrix = build_projection_matrix(target_lab)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    gitignore = filename.parent / ".gitignore"
+    if not gitignore.exists():
+        gitignore.write_text("*\n")
+    # write then rename, for concurrent runs sharing the cache
+    tmp = filename.with_name(f"{filename.stem}.{os.getpid()}.tmp.npz")
+    sp.save_npz(tmp, matrix)
+    os.replace(tmp, filename)
+    print(f"Saved {target_lab} projection matrix to {filename}")
+    return matrix
+
+
+def project(values, target_lab="aparc_fsa5", cache_dir=default_cache_dir):
+    """
+    Project region values onto the surface vertices.
+
+    Parameters:
+    - values: Region values (n_regions,) or a batch of maps (n_regions, n_maps),
+      in ENIGMA order. NaN values stay NaN on their region.
+    - target_lab: Parcellation and surface, as `parcel_to_surface`.
+
+    Returns:
+    - Vertex values (n_vertices,) or (n_vertices, n_maps), NaN outside the
+      parcellation.
+    """
+    matrix = projection_matrix(target_lab, Path(cache_dir))
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[0] != matrix.shape[1]:
+        raise ValueError(
+            f"{values.shape[0]} values for the {matrix.shape[1]} regions of {target_lab}"
+        )
+    # only the stored entries are multiplied: a NaN region stays on its vertices
+    surfaces = matrix @ values
+    surfaces[np.diff(matrix.indptr) == 0] = np.nan
+    return surfaces
@@ -0,0 +1,245 @@
+"""
+Persistent offscreen renderer of ENIGMA maps.
+
+`enigmatoolbox.plotting.plot_cortical` / `plot_subcortical` build a new VTK
+scene (surfaces, normals, mappers, render window) for every screenshot.
+`MapRenderer` builds one render window for the process with four viewports
+(left lateral, left medial, right lateral, right medial, the layout of the
+enigmatoolbox plots) and keeps the fsa5 and subcortical meshes loaded; a
+screenshot only swaps the point scalars and the lookup table of the actors.
+
+Usage:
+    renderer = MapRenderer(size=(800, 400), scale=(4, 4))
+    renderer.render_cortical(surface_values, "ct.png", cmap="RdBu_r")
+    renderer.render_subcortical(region_values, "sv.png", cmap="RdBu_r")
+"""
+
+import os
+import time
+
+import numpy as np
+import vtk
+import matplotlib.pyplot as plt
+from vtk.util.numpy_support import numpy_to_vtk
+
+import display
+
+# Camera direction (from the focal point) of each viewport
+_views = {
+    ("lh", "lateral"): (-1, 0, 0),
+    ("lh", "medial"): (1, 0, 0),
+    ("rh", "lateral"): (1, 0, 0),
+    ("rh", "medial"): (-1, 0, 0),
+}
+_layout = [("lh", "lateral"), ("lh", "medial"), ("rh", "lateral"), ("rh", "medial")]
+
+
+def _polydata(surface):
+    """vtkPolyData of an enigmatoolbox (BSPolyData) or VTK surface, with normals."""
+    polydata = getattr(surface, "VTKObject", surface)
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputData(polydata)
+    normals.SplittingOff()
+    normals.Update()
+    return normals.GetOutput()
+
+
+def load_cortical_meshes(surface_name="fsa5"):
+    """Left and right meshes of an enigmatoolbox cortical surface."""
+    from enigmatoolbox import datasets
+
+    loaders = {"fsa5": datasets.load_fsa5, "conte69": datasets.load_conte69}
+    lh, rh = loaders[surface_name]()
+    return _polydata(lh), _polydata(rh)
+
+
+def load_subcortical_meshes():
+    """
+    Left and right subcortical meshes shipped with enigmatoolbox (the
+    templates of `plot_subcortical`).
+    """
+    import enigmatoolbox
+    from enigmatoolbox.mesh.mesh_io import read_surface
+
+    surfaces_dir = os.path.join(
+        os.path.dirname(enigmatoolbox.__file__), "datasets", "surfaces"
+    )
+    # meshes with the ventricles, the 16 regions of the ENIGMA order
+    names = sorted(
+        f
+        for f in os.listdir(surfaces_dir)
+        if f.startswith("sctx") and "novent" not in f.lower()
+    )
+    lh = [f for f in names if "lh" in f]
+    rh = [f for f in names if "rh" in f]
+    if len(lh) != 1 or len(rh) != 1:
+        raise FileNotFoundError(
+            f"Subcortical meshes not found in {surfaces_dir}: {names}"
+        )
+    return tuple(
+        _polydata(read_surface(os.path.join(surfaces_dir, f))) for f in lh + rh
+    )
+
+
+def lookup_table(cmap, vmin, vmax, nan_color, n_colors=256):
+    """vtkLookupTable of a matplotlib colormap, with a NaN color."""
+    colors = plt.get_cmap(cmap, n_colors)(np.linspace(0, 1, n_colors))
+    table = vtk.vtkLookupTable()
+    table.SetNumberOfTableValues(n_colors)
+    for i, color in enumerate(colors):
+        table.SetTableValue(i, *color)
+    table.SetRange(vmin, vmax)
+    table.SetNanColor(*nan_color)
+    table.Build()
+    return table
+
+
+class MapRenderer:
+    """
+    One offscreen render window for all the maps of a process.
+
+    Parameters:
+    - size: Window size in pixels (as `size` of the enigmatoolbox plots).
+    - scale: Magnification of the screenshots (as `scale`).
+    - background: Background color.
+    - backend: Offscreen backend of `display.launch_display`.
+    """
+
+    def __init__(
+        self,
+        size=(800, 400),
+        scale=(4, 4),
+        background=(1, 1, 1),
+        backend="xvfb",
+    ):
+        display.launch_display(backend=backend)
+        self.size = size
+        self.scale = scale
+        self.window = vtk.vtkRenderWindow()
+        self.window.SetOffScreenRendering(1)
+        self.window.SetAlphaBitPlanes(1)
+        self.window.SetSize(*size)
+        self.renderers = []
+        for i in range(len(_layout)):
+            renderer = vtk.vtkRenderer()
+            renderer.SetViewport(i / len(_layout), 0, (i + 1) / len(_layout), 1)
+            renderer.SetBackground(*background)
+            self.window.AddRenderer(renderer)
+            self.renderers.append(renderer)
+        # meshes and actors of each scene ("cortical", "subcortical"),
+        # built on first use
+        self._scenes = {}
+        # scenes whose meshes could not be found, not looked up again
+        self._missing = {}
+        self._current = None
+
+    def _scene(self, name, load):
+        if name in self._missing:
+            raise self._missing[name]
+        if name not in self._scenes:
+            start = time.perf_counter()
+            try:
+                meshes = dict(zip(("lh", "rh"), load()))
+            except FileNotFoundError as error:
+                self._missing[name] = error
+                raise
+            actors = []
+            for hemi, _ in _layout:
+                mapper = vtk.vtkPolyDataMapper()
+                mapper.SetInputData(meshes[hemi])
+                mapper.SetScalarModeToUsePointData()
+                mapper.UseLookupTableScalarRangeOn()
+                mapper.ScalarVisibilityOn()
+                actor = vtk.vtkActor()
+                actor.SetMapper(mapper)
+                actors.append(actor)
+            self._scenes[name] = (meshes, actors)
+            print(f"Loaded {name} meshes in {time.perf_counter() - start:.2f} s")
+        return self._scenes[name]
+
+    def _show(self, name):
+        """Put the actors of a scene in the viewports and frame them."""
+        if self._current == name:
+            return
+        _, actors = self._scenes[name]
+        for renderer, actor, view in zip(self.renderers, actors, _layout):
+            renderer.RemoveAllViewProps()
+            renderer.AddActor(actor)
+            camera = renderer.GetActiveCamera()
+            camera.SetFocalPoint(0, 0, 0)
+            camera.SetPosition(*_views[view])
+            camera.SetViewUp(0, 0, 1)
+            renderer.ResetCamera()
+        self._current = name
+
+    def _render(self, name, values, filename, cmap, vmin, vmax, nan_color):
+        meshes, actors = self._scenes[name]
+        values = np.asarray(values, dtype=np.float64)
+        n_lh = meshes["lh"].GetNumberOfPoints()
+        n_rh = meshes["rh"].GetNumberOfPoints()
+        if len(values) != n_lh + n_rh:
+            raise ValueError(
+                f"{len(values)} values for {n_lh} + {n_rh} {name} vertices"
+            )
+        self._show(name)
+        table = lookup_table(cmap, vmin, vmax, nan_color)
+        for hemi, hemi_values in (("lh", values[:n_lh]), ("rh", values[n_lh:])):
+            scalars = numpy_to_vtk(np.ascontiguousarray(hemi_values), deep=True)
+            scalars.SetName("values")
+            meshes[hemi].GetPointData().SetScalars(scalars)
+            meshes[hemi].Modified()
+        for actor in actors:
+            actor.GetMapper().SetLookupTable(table)
+
+        start = time.perf_counter()
+        self.window.Render()
+        image = vtk.vtkWindowToImageFilter()
+        image.SetInput(self.window)
+        image.SetScale(*self.scale)
+        image.SetInputBufferTypeToRGBA()
+        image.ReadFrontBufferOff()
+        image.Update()
+        writer = vtk.vtkPNGWriter()
+        writer.SetFileName(str(filename))
+        writer.SetInputConnection(image.GetOutputPort())
+        writer.Write()
+        return time.perf_counter() - start
+
+    def render_cortical(
+        self,
+        values,
+        filename,
+        cmap="RdBu_r",
+        vmin=-0.5,
+        vmax=0.5,
+        nan_color=(0.15, 0.15, 0.20, 1),
+        surface_name="fsa5",
+    ):
+        """
+        Screenshot of vertex values (left then right hemisphere, e.g. the
+        output of `projection.project`); returns the render time in seconds.
+        """
+        name = f"cortical_{surface_name}"
+        self._scene(name, lambda: load_cortical_meshes(surface_name))
+        return self._render(name, values, filename, cmap, vmin, vmax, nan_color)
+
+    def render_subcortical(
+        self,
+        values,
+        filename,
+        cmap="RdBu_r",
+        vmin=-0.5,
+        vmax=0.5,
+        nan_color=(0.15, 0.15, 0.20, 1),
+    ):
+        """
+        Screenshot of the 16 subcortical values (ENIGMA order, with the
+        ventricles); returns the render time in seconds.
+        """
+        from enigmatoolbox.utils.parcellation import subcorticalvertices
+
+        self._scene("subcortical", load_subcortical_meshes)
+        vertices = subcorticalvertices(np.asarray(values, dtype=np.float64))
+        return self._render(
+            "subcortical", vertices, filename, cmap, vmin, vmax, nan_color
+        )
@@ -12,6 +12,7 @@ LIVINGPARK_INPUT=""
 OUTPUT_DIR="$(pwd)/cohen_d_map"
 ENIGMA_DIR="$(pwd)/container/ENIGMA"
 TITLE=""
+MANIFEST=""
 
 # Default arguments
 OUTPUT_DIR_ARG="--output_dir /output"
@@ -43,11 +44,15 @@ Optional arguments:
   --vmax VALUE                Maximum value for the color scale (default: 0.5)
   --output_dir DIR            Directory to save output plots and CSV files (default: ./enigma_map)
   --title TITLE               Title for the plot
+  --manifest PATH             JSON (or YAML) list of jobs rendered in one container run,
+                              instead of the arguments above (paths relative to the
+                              current directory)
   -h, --help                  Show this help message and exit
 
 Examples:
   $0 --disorder depression --metric thickness --livingpark_input data.csv
   $0 --disorder schizophrenia --metric area --livingpark_input data.csv --output_dir ./results
+  $0 --manifest jobs.json
 EOF
 }
 
@@ -215,6 +220,14 @@ parse_args() {
                 TITLE_ARG="--title $TITLE"
                 shift 2
                 ;;
+            --manifest)
+                if [[ -z "$2" || "$2" == --* ]]; then
+                    echo "Error: --manifest requires a value" >&2
+                    exit 1
+                fi
+                MANIFEST="$2"
+                shift 2
+                ;;
             -h|--help)
                 show_help
                 exit 0
@@ -232,6 +245,15 @@ parse_args() {
 validate_args() {
     local errors=0
 
+    # The jobs of a manifest are checked by plot.py
+    if [[ -n "$MANIFEST" ]]; then
+        if ! validate_file "$MANIFEST" "--manifest"; then
+            echo "Use --help for usage information." >&2
+            exit 1
+        fi
+        return 0
+    fi
+
     # Check required arguments
     if [[ -z "$DISORDER" ]]; then
         echo "Error: --disorder is required" >&2
@@ -286,6 +308,7 @@ show_parsed_args() {
     echo "  LIVINGPARK_INPUT: $LIVINGPARK_INPUT"
     echo "  OUTPUT_DIR: $OUTPUT_DIR"
     echo "  TITLE: $TITLE"
+    echo "  MANIFEST: $MANIFEST"
 }
 
 # Main function to parse and validate arguments
@@ -301,6 +324,19 @@ main() {
     # Uncomment to see parsed arguments
     # show_parsed_args
 
+    if [[ -n "$MANIFEST" ]]; then
+        # All the jobs in one container run: the manifest paths are relative
+        # to the current directory, mounted at the same path
+        echo "Running ENIGMA jobs of $MANIFEST"
+        docker run --rm -it \
+            -v ${ENIGMA_DIR}:/opt/ENIGMA \
+            -v "$PWD":"$PWD" \
+            -w "$PWD" \
+            enigma:latest \
+            python3 /opt/ENIGMA/plot.py --manifest "$MANIFEST"
+        return
+    fi
+
     # Your main script logic would go here
     echo "Running ENIGMA analysis with:"
     echo "  Disorder: $DISORDER"
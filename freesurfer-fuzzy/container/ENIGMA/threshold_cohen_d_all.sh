@@ -74,8 +74,13 @@ function get_livingpark_input() {
 #   done
 # done
 
-# Plot Cohen's d for Gurholt et al. 2020
+# Plot Cohen's d for Gurholt et al. 2020, all the maps in one container run
+# from a job manifest (as navr.sh)
 INPUT_DIR="$PWD/container/ENIGMA/data/Gurholt_2020"
+OUTPUT_DIR="$PWD/cohen_d_map/Gurholt_2020"
+manifest="cohen_d_manifest.json"
+mkdir -p "$OUTPUT_DIR"
+jobs=()
 disorders=("eop")
 metrics=("subcortical_volume")
 for disorder in "${disorders[@]}"; do
@@ -85,16 +90,23 @@ for disorder in "${disorders[@]}"; do
     DISORDER_FILENAMES="${INPUT_DIR}/${disorder}_${metric}_*.csv"
     for DISORDER_FILENAME in $DISORDER_FILENAMES; do
       echo "Using disorder filename: $DISORDER_FILENAME"
-      ./container/ENIGMA/threshold_cohen_d.sh \
-      --disorder "$disorder" \
-      --metric "$metric" \
-      --disorder_filename "$DISORDER_FILENAME" \
-      --livingpark_input "$PWD/cohen_d/csv/${LIVINGPARK_INPUT}" \
-      --cohen_d_name "Cohen_d" \
-      --vmin "-0.4" \
-      --vmax "0.4" \
-      --output_dir "$PWD/cohen_d_map/Gurholt_2020"
-      echo -e "\n"
+      jobs+=("{\"disorder\": \"${disorder}\", \"metric\": \"${metric}\", \"disorder_filename\": \"${DISORDER_FILENAME}\", \"livingpark_input\": \"$PWD/cohen_d/csv/${LIVINGPARK_INPUT}\"}")
     done
   done
 done
+
+{
+  echo "{\"defaults\": {\"cohen_d_name\": \"Cohen_d\", \"vmin\": -0.4, \"vmax\": 0.4,"
+  echo "              \"output_dir\": \"${OUTPUT_DIR}\"},"
+  echo ' "jobs": ['
+  for i in "${!jobs[@]}"; do
+    if [ "$i" -lt $((${#jobs[@]} - 1)) ]; then
+      echo "  ${jobs[$i]},"
+    else
+      echo "  ${jobs[$i]}"
+    fi
+  done
+  echo ']}'
+} > $manifest
+
+./container/ENIGMA/threshold_cohen_d.sh --manifest $manifest
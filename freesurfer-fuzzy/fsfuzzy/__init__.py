@@ -0,0 +1,6 @@
+"""
+Shared helpers for the FreeSurfer fuzzy (MCA) analyses.
+
+Notebooks are run from the `freesurfer-fuzzy` directory, so modules are
+imported as `from fsfuzzy.<module> import ...`.
+"""
@@ -0,0 +1,150 @@
+"""
+Batched one-way ANCOVA with covariates.
+
+Replaces one `pg.ancova(data, dv, between, covar)` call per
+(repetition, region[, hemisphere]) by a few least-squares solves: the
+long-form table is pivoted to a response matrix Y[unit, test], the design
+(intercept + group dummies + covariates) is built once per unit, and all
+tests sharing the same set of valid rows are solved together.
+
+The between-group effect is the type II sum of squares of pingouin (and
+statsmodels `anova_lm(typ=2)`) for a model without interaction:
+
+    SS_between = RSS(intercept + covariates) - RSS(full)
+    F = (SS_between / (k - 1)) / (RSS(full) / (n - rank(full)))
+    np2 = SS_between / (SS_between + RSS(full))
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from fsfuzzy.batching import has_constant, pivot_tests, unit_columns, valid_patterns
+
+result_columns = ["F", "p-val", "np2", "n"]
+
+
+def _rss(X: np.ndarray, Y: np.ndarray) -> tuple[np.ndarray, int]:
+    """Residual sum of squares of every column of Y regressed on X."""
+    beta, _, rank, _ = np.linalg.lstsq(X, Y, rcond=None)
+    residuals = Y - X @ beta
+    return np.einsum("ij,ij->j", residuals, residuals), rank
+
+
+def ancova_matrix(
+    Y: np.ndarray,
+    groups: np.ndarray,
+    covariates: np.ndarray,
+    min_n: int = 4,
+) -> pd.DataFrame:
+    """
+    ANCOVA of every column of Y on `groups` with `covariates`.
+
+    Parameters
+    ----------
+    Y : ndarray, shape (n_units, n_tests)
+        Responses; NaN marks a missing observation for that test only.
+    groups : ndarray, shape (n_units,)
+        Between-subject factor. Missing values exclude the unit.
+    covariates : ndarray, shape (n_units, n_covariates)
+        Numeric covariates. Missing values exclude the unit.
+    min_n : int
+        Tests with fewer valid units, a single group or a constant
+        covariate get NaN statistics.
+
+    Returns
+    -------
+    DataFrame
+        One row per column of Y with `F`, `p-val`, `np2` and `n`.
+    """
+    Y = np.asarray(Y, dtype=np.float64)
+    covariates = np.asarray(covariates, dtype=np.float64)
+    if covariates.ndim == 1:
+        covariates = covariates[:, None]
+    codes, _ = pd.factorize(pd.Series(groups), sort=True)
+    unit_valid = (codes >= 0) & ~np.isnan(covariates).any(axis=1)
+    valid = ~np.isnan(Y) & unit_valid[:, None]
+
+    n_tests = Y.shape[1]
+    F = np.full(n_tests, np.nan)
+    p = np.full(n_tests, np.nan)
+    np2 = np.full(n_tests, np.nan)
+    n = valid.sum(axis=0)
+
+    # Tests sharing the same valid rows share the same design
+    for rows, columns in valid_patterns(valid):
+        n_rows = int(rows.sum())
+        group_codes = codes[rows]
+        levels = np.unique(group_codes)
+        covar = covariates[rows]
+        if n_rows < min_n or len(levels) < 2 or has_constant(covar):
+            continue
+
+        dummies = (group_codes[:, None] == levels[None, 1:]).astype(np.float64)
+        reduced = np.column_stack([np.ones(n_rows), covar])
+        full = np.column_stack([np.ones(n_rows), dummies, covar])
+        y = Y[np.ix_(rows, columns)]
+
+        rss_full, rank_full = _rss(full, y)
+        rss_reduced, rank_reduced = _rss(reduced, y)
+        df_between = rank_full - rank_reduced
+        df_residual = n_rows - rank_full
+        if df_between < 1 or df_residual < 1:
+            continue
+
+        ss_between = rss_reduced - rss_full
+        with np.errstate(divide="ignore", invalid="ignore"):
+            F[columns] = (ss_between / df_between) / (rss_full / df_residual)
+            np2[columns] = ss_between / (ss_between + rss_full)
+        p[columns] = stats.f.sf(F[columns], df_between, df_residual)
+
+    return pd.DataFrame({"F": F, "p-val": p, "np2": np2, "n": n})
+
+
+def batched_ancova(
+    df: pd.DataFrame,
+    dv: str,
+    between: str,
+    covar: list[str],
+    by: list[str],
+    unit: str = "subject_visit",
+    min_n: int = 4,
+) -> pd.DataFrame:
+    """
+    One ANCOVA per `by` group of a long-form table, solved in batch.
+
+    Equivalent to::
+
+        df.groupby(by, sort=False).apply(
+            lambda g: pg.ancova(g.dropna(), dv=dv, between=between, covar=covar)
+        )
+
+    keeping the `between` row (F, p-val, np2) and the number of complete
+    rows n.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Long-form table with `unit`, `by`, `dv`, `between` and `covar`
+        columns. `between` and `covar` must be constant per unit.
+    unit : str
+        Column identifying the observational unit (subject-visit for the
+        baseline, PATNO for the longitudinal change).
+
+    Returns
+    -------
+    DataFrame
+        `by` columns (in order of first appearance) and `F`, `p-val`, `np2`, `n`.
+    """
+    missing = [c for c in [unit, dv, between] + covar + by if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
+
+    Y, tests, units = pivot_tests(df, dv, by, unit)
+    per_unit = unit_columns(df, unit, [between] + covar, units, numeric=covar)
+    groups = per_unit[between].astype(object).where(per_unit[between].notna())
+
+    results = ancova_matrix(
+        Y, groups.to_numpy(), per_unit[covar].to_numpy(np.float64), min_n=min_n
+    )
+    return pd.concat([tests, results], axis=1)
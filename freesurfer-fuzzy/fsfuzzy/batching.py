@@ -0,0 +1,94 @@
+"""
+Helpers shared by the batched statistics engines (`fsfuzzy.ancova`,
+`fsfuzzy.partial_correlation`).
+
+A long-form table with one row per (unit, test) is pivoted to a response
+matrix Y[unit, test]; per-unit columns (group, covariates, clinical score)
+are aligned on the same units. Tests whose valid rows are identical share
+one design matrix and are solved together.
+"""
+
+from collections.abc import Iterator
+
+import numpy as np
+import pandas as pd
+
+
+def pivot_tests(
+    df: pd.DataFrame, value: str, by: list[str], unit: str
+) -> tuple[np.ndarray, pd.DataFrame, pd.Index]:
+    """
+    Pivot `value` to a matrix indexed by [unit, test].
+
+    Returns
+    -------
+    Y : ndarray, shape (n_units, n_tests)
+        Values coerced to float; NaN where a (unit, test) row is missing.
+    tests : DataFrame
+        `by` columns of each test, in order of first appearance.
+    units : Index
+        Units, in order of first appearance.
+    """
+    unit_codes, units = pd.factorize(df[unit])
+    tests = df[by].drop_duplicates().reset_index(drop=True)
+    if len(by) > 1:
+        test_codes = pd.MultiIndex.from_frame(tests).get_indexer(
+            pd.MultiIndex.from_frame(df[by])
+        )
+    else:
+        test_codes = pd.Index(tests[by[0]]).get_indexer(df[by[0]])
+    if pd.Series(unit_codes * len(tests) + test_codes).duplicated().any():
+        raise ValueError(f"Several rows per ({unit}, {', '.join(by)})")
+
+    Y = np.full((len(units), len(tests)), np.nan)
+    Y[unit_codes, test_codes] = pd.to_numeric(df[value], errors="coerce").to_numpy(
+        np.float64
+    )
+    return Y, tests, pd.Index(units)
+
+
+def unit_columns(
+    df: pd.DataFrame,
+    unit: str,
+    columns: list[str],
+    units: pd.Index,
+    numeric: list[str] = (),
+) -> pd.DataFrame:
+    """
+    Per-unit `columns` aligned on `units`; `numeric` columns are coerced.
+
+    Raises if a column takes several values for the same unit.
+    """
+    per_unit = df[[unit] + columns].drop_duplicates()
+    per_unit = per_unit.assign(
+        **{c: pd.to_numeric(per_unit[c], errors="coerce") for c in numeric}
+    ).drop_duplicates()
+    if per_unit[unit].duplicated().any():
+        raise ValueError(f"{', '.join(columns)} must be constant per {unit}")
+    return per_unit.set_index(unit).loc[units]
+
+
+def valid_patterns(valid: np.ndarray) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Group the columns of a boolean [unit, test] mask by identical pattern.
+
+    Yields (rows, columns): the valid units and the tests sharing them.
+    """
+    if valid.shape[1] == 0:
+        return
+    if valid.all():
+        # common case (no missing value): skip the sort of the patterns
+        yield valid[:, 0], np.arange(valid.shape[1])
+        return
+    patterns, inverse = np.unique(
+        np.packbits(valid, axis=0), axis=1, return_inverse=True
+    )
+    inverse = inverse.reshape(-1)
+    for pattern in range(patterns.shape[1]):
+        columns = np.flatnonzero(inverse == pattern)
+        yield valid[:, columns[0]], columns
+
+
+def has_constant(values: np.ndarray) -> bool:
+    """True if a column of the 2D array takes a single value."""
+    return bool(values.shape[0] and (np.ptp(values, axis=0) == 0).any())
@@ -0,0 +1,215 @@
+"""
+Content-addressed cache of intermediate DataFrames.
+
+An entry is stored as `<root>/<name>-<key>.parquet`, where the key is the
+sha1 of everything the result depends on:
+- input files and directories (relative path, size and mtime of every
+  file, as in `fsfuzzy.manifest`);
+- parameters: DataFrames and Series by content
+  (`pd.util.hash_pandas_object` and column names), other values by `repr`;
+- code: the source of the functions computing the result and of the
+  `fsfuzzy` package, so that a change of the batched engines also
+  invalidates the entries.
+
+A change of input, parameter (covariates, alpha, cohort, ...) or code gives
+a new key, so a cached entry is never stale and there is no need to force
+recomputation. Entries are touched when read; `evict` removes entries not
+used for `max_age` seconds, then the least recently used ones until the
+cache fits in `max_bytes`; `save` never evicts the entry it writes (and
+warns when that entry alone exceeds `max_bytes`).
+"""
+
+import inspect
+import json
+import marshal
+import os
+import time
+import warnings
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from functools import cache
+from hashlib import sha1
+from pathlib import Path
+
+import pandas as pd
+
+
+def code_version(func: Callable) -> str:
+    """
+    Hash of the source of `func` (bytecode if the source is not available).
+    """
+    try:
+        source = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        source = marshal.dumps(func.__code__)
+    return sha1(source).hexdigest()
+
+
+@cache
+def package_version() -> str:
+    """
+    Hash of the sources of the `fsfuzzy` package.
+    """
+    digest = sha1()
+    for path in sorted(Path(__file__).parent.glob("*.py")):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def path_fingerprint(path: str | Path) -> list[tuple[str, int, int]]:
+    """
+    (relative path, size, mtime_ns) of a file or of every file of a directory.
+    """
+    path = Path(path)
+    if path.is_file():
+        stat = path.stat()
+        return [(path.name, stat.st_size, stat.st_mtime_ns)]
+    files = sorted(p for p in path.rglob("*") if p.is_file())
+    return [
+        (str(p.relative_to(path)), p.stat().st_size, p.stat().st_mtime_ns)
+        for p in files
+    ]
+
+
+def frame_hash(df: pd.DataFrame | pd.Series) -> str:
+    """
+    Hash of the values, index and column names of a DataFrame.
+
+    Dtypes are left out so that a frame read back from parquet (object
+    columns become strings) has the hash of the frame that was written.
+    """
+    digest = sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    names = list(df.columns) if isinstance(df, pd.DataFrame) else [df.name]
+    digest.update(repr(names).encode())
+    return digest.hexdigest()
+
+
+def _digest(value) -> str:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return frame_hash(value)
+    if isinstance(value, (list, tuple)):
+        return repr([_digest(v) for v in value])
+    if isinstance(value, dict):
+        return repr(sorted((str(k), _digest(v)) for k, v in value.items()))
+    return repr(value)
+
+
+@dataclass
+class ResultCache:
+    """
+    Parquet cache keyed by input files, parameters and code.
+
+    Parameters
+    ----------
+    root : Path
+        Cache directory.
+    max_bytes : int, optional
+        Size limit of the cache; least recently used entries are evicted
+        first.
+    max_age : float, optional
+        Entries not used for `max_age` seconds are evicted.
+    """
+
+    root: Path
+    max_bytes: int | None = None
+    max_age: float | None = None
+
+    def __post_init__(self):
+        self.root = Path(self.root)
+
+    def key(
+        self,
+        code: Iterable[Callable] = (),
+        files: Iterable[str | Path] = (),
+        **params,
+    ) -> str:
+        content = {
+            "code": [package_version()] + [code_version(func) for func in code],
+            "files": [path_fingerprint(path) for path in files],
+            "params": {name: _digest(value) for name, value in params.items()},
+        }
+        return sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def path(self, name: str, key: str) -> Path:
+        return self.root / f"{name}-{key}.parquet"
+
+    def load(self, name: str, key: str) -> pd.DataFrame | None:
+        path = self.path(name, key)
+        if not path.exists():
+            return None
+        os.utime(path)
+        return pd.read_parquet(path)
+
+    def save(self, name: str, key: str, df: pd.DataFrame) -> Path:
+        path = self.path(name, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # atomic: concurrent readers never see a partial file
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        df.to_parquet(tmp)
+        os.replace(tmp, path)
+        size = path.stat().st_size
+        if self.max_bytes is not None and size > self.max_bytes:
+            warnings.warn(
+                f"Cache entry {path.name} ({size} bytes) exceeds max_bytes "
+                f"({self.max_bytes}); it is kept and older entries are evicted"
+            )
+        # the entry just written is never evicted by its own save
+        self.evict(keep=[path])
+        return path
+
+    def cached(
+        self,
+        name: str,
+        compute: Callable[[], pd.DataFrame],
+        code: Iterable[Callable] = (),
+        files: Iterable[str | Path] = (),
+        force: bool = False,
+        **params,
+    ) -> pd.DataFrame:
+        """
+        Load the entry of (code, files, params), or compute and store it.
+
+        `force` recomputes and overwrites the entry.
+        """
+        key = self.key(code=code, files=files, **params)
+        df = None if force else self.load(name, key)
+        if df is None:
+            df = compute()
+            self.save(name, key, df)
+        return df
+
+    def entries(self) -> pd.DataFrame:
+        """
+        Cached entries with their size and last use, oldest first.
+        """
+        rows = []
+        for path in self.root.glob("*.parquet"):
+            stat = path.stat()
+            rows.append((path, stat.st_size, stat.st_mtime))
+        entries = pd.DataFrame(rows, columns=["path", "size", "mtime"])
+        return entries.sort_values("mtime", ignore_index=True)
+
+    def evict(self, keep: Iterable[Path] = ()) -> list[Path]:
+        """
+        Remove entries older than `max_age`, then the least recently used
+        ones until the cache fits in `max_bytes`. Entries of `keep` are
+        never removed; their size counts against `max_bytes` first.
+        """
+        if self.max_age is None and self.max_bytes is None:
+            return []
+        entries = self.entries()
+        protected = entries["path"].isin({Path(path) for path in keep})
+        evicted = pd.Series(False, index=entries.index)
+        if self.max_age is not None:
+            evicted |= entries["mtime"] < time.time() - self.max_age
+        evicted &= ~protected
+        if self.max_bytes is not None:
+            # total size of the entries kept from this one to the newest
+            kept = entries["size"].where(~evicted & ~protected, 0)
+            budget = self.max_bytes - entries.loc[protected, "size"].sum()
+            evicted |= (kept[::-1].cumsum()[::-1] > budget) & ~protected
+        removed = entries.loc[evicted, "path"].tolist()
+        for path in removed:
+            path.unlink(missing_ok=True)
+        return removed
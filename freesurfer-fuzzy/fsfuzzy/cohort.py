@@ -0,0 +1,181 @@
+"""
+Cohort annotation of the stats tables.
+
+The cohort CSV is indexed once by `subject_visit` (a hashed `pd.Index`);
+tables are then annotated with a single join on their unique subject-visits
+instead of a cohort scan per row:
+- cross-sectional cohorts (`cross-sectional_cohort_*.csv`) are keyed by
+  `PATNO_id`;
+- longitudinal cohorts (`longitudinal_cohort_*.csv`) are keyed by both
+  `first_visit` (timepoint T1) and `second_visit` (timepoint T2).
+
+Rows whose subject-visit is not in the cohort are dropped and reported.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+_report_columns = ["subject_visit", "rows", "repetitions"]
+
+
+@dataclass(frozen=True)
+class CohortIndex:
+    """Cohort columns aligned on a unique `subject_visit` index."""
+
+    index: pd.Index
+    dx_group: np.ndarray
+    timepoint: np.ndarray | None = None
+
+    @property
+    def longitudinal(self) -> bool:
+        return self.timepoint is not None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+def build_cohort_index(cohort: pd.DataFrame) -> CohortIndex:
+    """
+    Index a cross-sectional (`PATNO_id`) or longitudinal
+    (`first_visit`/`second_visit`) cohort by subject-visit.
+    """
+    if {"first_visit", "second_visit"} <= set(cohort.columns):
+        visits = pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "subject_visit": cohort[column],
+                        "dx_group": cohort["dx_group"],
+                        "timepoint": timepoint,
+                    }
+                )
+                for column, timepoint in (("first_visit", "T1"), ("second_visit", "T2"))
+            ],
+            ignore_index=True,
+        )
+    elif "PATNO_id" in cohort.columns:
+        visits = cohort[["PATNO_id", "dx_group"]].rename(
+            columns={"PATNO_id": "subject_visit"}
+        )
+    else:
+        raise ValueError(
+            "Cohort must have a 'PATNO_id' column (cross-sectional) or "
+            "'first_visit' and 'second_visit' columns (longitudinal)"
+        )
+
+    visits = visits.dropna(subset=["subject_visit"]).drop_duplicates("subject_visit")
+    return CohortIndex(
+        index=pd.Index(visits["subject_visit"].to_numpy()),
+        dx_group=visits["dx_group"].to_numpy(),
+        timepoint=(
+            visits["timepoint"].to_numpy() if "timepoint" in visits.columns else None
+        ),
+    )
+
+
+def load_cohort_index(path: str | Path) -> CohortIndex:
+    return build_cohort_index(pd.read_csv(path))
+
+
+def drop_report(df: pd.DataFrame, kept: np.ndarray) -> pd.DataFrame:
+    """
+    Subject-visits dropped from `df`, with their number of rows and repetitions.
+    """
+    dropped = df.loc[~kept]
+    if dropped.empty:
+        return pd.DataFrame(columns=_report_columns)
+    return (
+        dropped.groupby("subject_visit", sort=True)
+        .agg(rows=("subject_visit", "size"), repetitions=("repetition", "nunique"))
+        .reset_index()
+    )
+
+
+def annotate(
+    df: pd.DataFrame,
+    cohort: CohortIndex | pd.DataFrame,
+    timepoint: bool = False,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Keep the subject-visits of the cohort and add the cohort columns.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Table with `subject_visit` and `repetition` columns (and `hemi`).
+    cohort : CohortIndex or DataFrame
+        Cohort, indexed with `build_cohort_index` when a DataFrame is given.
+    timepoint : bool
+        Also add the `timepoint` column (T1/T2) of a longitudinal cohort.
+
+    Returns
+    -------
+    df : DataFrame
+        Kept rows with `subject`, `visit`, `repetition`, `dx_group`,
+        `PD_status`, `PATNO_id` (and `hemi`, `timepoint`) appended.
+    dropped : DataFrame
+        One row per dropped subject-visit (see `drop_report`).
+    """
+    if not isinstance(cohort, CohortIndex):
+        cohort = build_cohort_index(cohort)
+    if df.empty:
+        return df, pd.DataFrame(columns=_report_columns)
+
+    # One hash lookup per unique subject-visit, then integer takes per row
+    codes, uniques = pd.factorize(df["subject_visit"])
+    positions = cohort.index.get_indexer(uniques)[codes]
+    kept = positions >= 0
+    dropped = drop_report(df, kept)
+
+    df = df.loc[kept].reset_index(drop=True)
+    positions = positions[kept]
+    codes, uniques = pd.factorize(df["subject_visit"])
+    split = pd.Series(uniques).str.split("_", n=1, expand=True)
+    dx_group = cohort.dx_group[positions]
+
+    hemi = df.pop("hemi") if "hemi" in df else None
+    df["subject"] = split[0].to_numpy()[codes]
+    df["visit"] = split[1].to_numpy()[codes]
+    df["repetition"] = df.pop("repetition")
+    df["dx_group"] = dx_group
+    df["PD_status"] = np.where(
+        pd.Series(dx_group).str.contains("PD", na=False), "PD", "HC"
+    )
+    df["PATNO_id"] = df["subject_visit"]
+    if hemi is not None:
+        df["hemi"] = hemi
+    if timepoint and cohort.longitudinal:
+        df["timepoint"] = cohort.timepoint[positions]
+    return df, dropped
+
+
+def annotate_tables(
+    tables_df: dict,
+    cohort: CohortIndex | pd.DataFrame,
+    timepoint: bool = False,
+    verbose: bool = True,
+) -> tuple[dict, pd.DataFrame]:
+    """
+    Annotate several tables against the same cohort index.
+
+    Returns the annotated tables and the concatenated drop report with a
+    `table` column.
+    """
+    if not isinstance(cohort, CohortIndex):
+        cohort = build_cohort_index(cohort)
+    annotated = {}
+    reports = []
+    for name, df in tables_df.items():
+        annotated[name], dropped = annotate(df, cohort, timepoint=timepoint)
+        reports.append(dropped.assign(table=name))
+        if verbose and not dropped.empty:
+            print(
+                f"{name}: dropped {dropped['rows'].sum()} rows from "
+                f"{len(dropped)} subject-visits not in the cohort"
+            )
+    if not reports:
+        return annotated, pd.DataFrame(columns=_report_columns + ["table"])
+    return annotated, pd.concat(reports, ignore_index=True)
@@ -0,0 +1,350 @@
+"""
+Consistency of published results under numerical variability.
+
+The `notebooks/papers_data/<domain>/<paper>/consistency.ipynb` notebooks
+read the tables of a paper (`table_*.csv`), compute the spread of every
+reported p-value from the HC-PD NPV maps and the closed forms below, and
+write one row per reported test to `uncertainty.csv` (`p_value`, `alpha`,
+`std_p`, `std_p_low`, `std_p_high`, `proba_significant`, `test`, `metric`,
+`study`...). The reading of the tables is specific to each paper and stays
+in the notebooks; the formulas are shared from here:
+- spread of the statistic: `std_t`, `std_F`, `std_r`;
+- spread of the p-value: `std_p_t`, `std_p_F` (residual degrees of
+  freedom `df`), `std_p_r` (sample size `n`);
+- probability of significance: P(P <= alpha) with P ~ Beta(a, b) matched
+  to the mean p0 and variance std_p^2 (`flip_proba_beta`).
+
+The spread of the p-value is linear in the NPV, so the spread at another
+NPV level is `scale * std_p`. `sensitivity_surface` evaluates the
+probabilities of all the tests of a paper over a grid of alpha thresholds
+and NPV scales as one (alpha, scale, test) array of regularized incomplete
+beta functions, and `python -m fsfuzzy.consistency` does it for every
+paper of the corpus:
+
+    <paper>/decisions.csv       Paper, Region, Method, Mean_pval, Std_pval,
+                                P_cross (probability of a changed decision)
+    <paper>/sensitivity.csv     surface per study, metric and test
+    sensitivity.csv             surfaces of all papers
+
+The tracked tables of the papers (`uncertainty.csv`, `probabilities.csv`)
+are inputs and are never written. The `proba_significant` column of each
+`uncertainty.csv` is checked against `flip_proba_beta` (`check_paper`), and
+an existing output that differs from the regenerated one is kept unless
+`--overwrite` is given.
+
+Usage:
+    python -m fsfuzzy.consistency --papers-dir notebooks/papers_data \
+        --alphas 0.001 0.005 0.01 0.05 0.1 --npv-scales 0.5 1 2
+    python -m fsfuzzy.consistency --check
+"""
+
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.special
+import scipy.stats
+
+alphas = (0.001, 0.005, 0.01, 0.05, 0.1)
+npv_scales = (0.25, 0.5, 1.0, 2.0, 4.0)
+# columns naming the tested contrast, joined into the `Method` column
+label_columns = [
+    "analysis",
+    "comparison",
+    "groups",
+    "group",
+    "clinical_measure",
+    "score_name",
+    "version",
+]
+surface_keys = ["study", "metric", "test"]
+
+
+def std_t(npv):
+    return npv
+
+
+def std_F(F, npv):
+    return 2 * np.sqrt(F) * npv
+
+
+def std_r(r, n, npv):
+    return np.sqrt((1 - r**2) ** 3 / (n - 1)) * npv
+
+
+def std_p_t(t, df, npv):
+    return 2 * scipy.stats.t.pdf(np.abs(t), df) * npv
+
+
+def std_p_F(F, df, npv):
+    return 2 * np.sqrt(F) * scipy.stats.f.pdf(F, dfn=1, dfd=df) * npv
+
+
+def std_p_r(r, n, npv):
+    t = r * np.sqrt((n - 2) / (1 - r**2))
+    return 2 * scipy.stats.t.pdf(np.abs(t), n - 2) * np.sqrt((n - 2) / (n - 1)) * npv
+
+
+def beta_params_from_mean_var(mu, var, eps=1e-12):
+    """Return (a,b) for Beta by moment matching. Clamps var to < mu(1-mu)."""
+    max_var = mu * (1 - mu) - eps
+    var_clamped = np.minimum(var, max_var)
+    # a zero (or clamped to zero) variance gives a large k, i.e. a Beta
+    # concentrated on mu
+    denominator = np.where(var_clamped == 0, eps, var_clamped)
+    k = np.maximum(mu * (1 - mu) / denominator - 1.0, eps)
+    return mu * k, (1 - mu) * k
+
+
+def flip_proba_beta(p0, sigma_P, alpha=0.05):
+    """
+    Probability of significance P(P <= alpha) with P ~ Beta(a, b) of mean
+    `p0` and standard deviation `sigma_P`.
+
+    Arguments are broadcast together (arrays, Series or scalars). A p-value
+    of exactly 0 or 1 has no Beta of positive variance: its probability is
+    1 or 0.
+    """
+    p0 = np.asarray(p0, dtype=np.float64)
+    a, b = beta_params_from_mean_var(p0, np.square(np.asarray(sigma_P, np.float64)))
+    with np.errstate(invalid="ignore"):
+        proba = scipy.special.betainc(a, b, alpha)
+    degenerate = (p0 == 0) | (p0 == 1)
+    proba = np.where(degenerate, (p0 <= alpha).astype(np.float64), proba)
+    return np.clip(proba, 0.0, 1.0)
+
+
+def change_proba(p0, sigma_P, alpha=0.05):
+    """
+    Probability that the decision at `alpha` differs from the reported one
+    (p0 < alpha): 1 - P(P <= alpha) for a significant test, P(P <= alpha)
+    otherwise.
+    """
+    proba = flip_proba_beta(p0, sigma_P, alpha)
+    return np.where(np.asarray(p0) < alpha, 1.0 - proba, proba)
+
+
+def sensitivity_surface(
+    table: pd.DataFrame,
+    alphas=alphas,
+    npv_scales=npv_scales,
+    by: list[str] = surface_keys,
+) -> pd.DataFrame:
+    """
+    Decisions of the tests of an `uncertainty.csv` table over a grid of
+    alpha thresholds and NPV scales (std_p multiplied by the scale).
+
+    Returns
+    -------
+    DataFrame
+        One row per `by` group, alpha and scale with `n_tests`,
+        `n_significant` (p_value < alpha), `expected_significant` (sum of
+        the probabilities of significance), `expected_changes` and
+        `mean_change_proba` (probabilities of a changed decision).
+    """
+    alpha = np.asarray(alphas, dtype=np.float64)[:, None, None]
+    scale = np.asarray(npv_scales, dtype=np.float64)[None, :, None]
+    p0 = table["p_value"].to_numpy(np.float64)[None, None, :]
+    std_p = table["std_p"].to_numpy(np.float64)[None, None, :]
+
+    proba = flip_proba_beta(p0, scale * std_p, alpha)
+    significant = p0 < alpha
+    change = np.where(significant, 1.0 - proba, proba)
+
+    # (alpha, scale, test) -> rows of (alpha, scale, test), summed per group
+    shape = np.broadcast_shapes(proba.shape, significant.shape)
+    grid = pd.MultiIndex.from_product(
+        [np.asarray(alphas), np.asarray(npv_scales), np.arange(len(table))],
+        names=["alpha", "npv_scale", "row"],
+    ).to_frame(index=False)
+    keys = table[by].reset_index(drop=True).astype(object).fillna("")
+    long = pd.concat(
+        [
+            grid[["alpha", "npv_scale"]],
+            keys.iloc[grid["row"]].reset_index(drop=True),
+            pd.DataFrame(
+                {
+                    "significant": np.broadcast_to(significant, shape).reshape(-1),
+                    "proba": proba.reshape(-1),
+                    "change": np.broadcast_to(change, shape).reshape(-1),
+                }
+            ),
+        ],
+        axis=1,
+    )
+    surface = (
+        long.groupby(by + ["alpha", "npv_scale"], sort=False)
+        .agg(
+            n_tests=("proba", "size"),
+            n_significant=("significant", "sum"),
+            expected_significant=("proba", "sum"),
+            expected_changes=("change", "sum"),
+            mean_change_proba=("change", "mean"),
+        )
+        .reset_index()
+    )
+    return surface
+
+
+def read_corpus(papers_dir: Path) -> dict[Path, pd.DataFrame]:
+    """`uncertainty.csv` of every paper, by paper directory."""
+    # round-trip parsing, so that rewriting a table only changes its
+    # recomputed columns
+    return {
+        path.parent: pd.read_csv(path, float_precision="round_trip")
+        for path in sorted(Path(papers_dir).glob("*/*/uncertainty.csv"))
+    }
+
+
+def decisions_table(table: pd.DataFrame, paper: str) -> pd.DataFrame:
+    """
+    Rows of the tests of a paper, with the columns of the tracked
+    `probabilities.csv` tables.
+    """
+    labels = [c for c in label_columns if c in table.columns]
+    method = (
+        table[labels]
+        .astype(object)
+        .apply(lambda row: " / ".join(str(v) for v in row.dropna()), axis=1)
+        if labels
+        else pd.Series("", index=table.index)
+    )
+    return pd.DataFrame(
+        {
+            "Paper": paper,
+            "Region": table["region"],
+            "Method": method,
+            "Mean_pval": table["p_value"],
+            "Std_pval": table["std_p"],
+            "P_cross": change_proba(table["p_value"], table["std_p"], table["alpha"]),
+        }
+    )
+
+
+def check_paper(table: pd.DataFrame, rtol: float = 1e-9) -> pd.DataFrame:
+    """
+    Tests of an `uncertainty.csv` table whose `proba_significant` is not
+    reproduced by `flip_proba_beta`, with the recomputed value.
+    """
+    recomputed = np.asarray(
+        flip_proba_beta(table["p_value"], table["std_p"], table["alpha"])
+    )
+    same = np.isclose(
+        recomputed, table["proba_significant"], rtol=rtol, atol=1e-12, equal_nan=True
+    )
+    return table.loc[~same].assign(proba_significant_recomputed=recomputed[~same])
+
+
+def write_table(df: pd.DataFrame, path: Path, overwrite: bool = False) -> bool:
+    """
+    Write `df` to `path`, unless an existing file differs from it and
+    `overwrite` is False; returns whether the file now holds `df`.
+    """
+    path = Path(path)
+    if path.exists() and not overwrite:
+        existing = pd.read_csv(path, float_precision="round_trip")
+        # compare as read back, e.g. empty labels are read as NaN
+        regenerated = pd.read_csv(
+            io.StringIO(df.to_csv(index=False)), float_precision="round_trip"
+        )
+        try:
+            pd.testing.assert_frame_equal(
+                existing, regenerated, check_dtype=False, rtol=1e-9
+            )
+        except AssertionError:
+            print(f"{path} differs from the regenerated table, kept (--overwrite)")
+            return False
+    df.to_csv(path, index=False)
+    return True
+
+
+def update_paper(
+    paper_dir: Path,
+    table: pd.DataFrame,
+    alphas=alphas,
+    npv_scales=npv_scales,
+    overwrite: bool = False,
+) -> pd.DataFrame:
+    """
+    Write the decisions and sensitivity tables of a paper (see
+    `write_table`); returns its surface.
+    """
+    paper_dir = Path(paper_dir)
+    write_table(
+        decisions_table(table, paper_dir.name),
+        paper_dir / "decisions.csv",
+        overwrite,
+    )
+    by = [c for c in surface_keys if c in table.columns]
+    surface = sensitivity_surface(table, alphas, npv_scales, by)
+    write_table(surface, paper_dir / "sensitivity.csv", overwrite)
+    return surface
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Significance probabilities and sensitivity surfaces of the papers"
+    )
+    parser.add_argument(
+        "--papers-dir",
+        default="notebooks/papers_data",
+        help="Directory of <domain>/<paper>/uncertainty.csv",
+    )
+    parser.add_argument("--alphas", nargs="+", type=float, default=list(alphas))
+    parser.add_argument(
+        "--npv-scales",
+        nargs="+",
+        type=float,
+        default=list(npv_scales),
+        help="Multiples of the measured NPV",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only check the proba_significant of every uncertainty.csv",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Replace existing outputs that differ from the regenerated ones",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+    surfaces = []
+    n_papers = n_mismatches = 0
+    for paper_dir, table in read_corpus(args.papers_dir).items():
+        mismatches = check_paper(table)
+        n_papers += 1
+        n_mismatches += len(mismatches)
+        print(f"{paper_dir.name}: {len(table)} tests, {len(mismatches)} not reproduced")
+        if len(mismatches):
+            columns = ["p_value", "std_p", "alpha", "proba_significant"]
+            print(mismatches[columns + ["proba_significant_recomputed"]].to_string())
+        if args.check:
+            continue
+        surface = update_paper(
+            paper_dir, table, args.alphas, args.npv_scales, args.overwrite
+        )
+        surfaces.append(
+            surface.assign(domain=paper_dir.parent.name, paper=paper_dir.name)
+        )
+    if surfaces:
+        surface = pd.concat(surfaces, ignore_index=True)
+        first = ["domain", "paper"]
+        surface = surface[first + [c for c in surface.columns if c not in first]]
+        write_table(surface, Path(args.papers_dir) / "sensitivity.csv", args.overwrite)
+    print(f"{n_papers} papers: {time.perf_counter() - start:.1f} s")
+    if args.check and n_mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
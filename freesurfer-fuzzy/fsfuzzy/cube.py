@@ -0,0 +1,325 @@
+"""
+Dense on-disk "repetition cube" of a morphometric metric.
+
+Values are stored as one float64 array indexed by
+[repetition, subject_visit, hemisphere, region] and memory-mapped on load,
+with integer-coded index tables for subject-visits, subjects, visits and
+regions. Slicing a hemisphere, a region range or a repetition range is
+zero-copy; selecting arbitrary subject-visits is a single fancy-index.
+
+Layout of `<cube_dir>/<metric>/`:
+- `values.npy`: float64 (n_repetitions, n_subject_visits, n_hemispheres, n_regions)
+- `repetitions.npy`: int32 original repetition number (-1 when missing)
+- `subjects.parquet`: subject_visit, subject, visit (+ codes) and cohort columns
+- `regions.parquet`, `visits.parquet`: code -> name
+- `meta.json`: metric, hemispheres, shape and source table
+
+`fsfuzzy.navr.read_cube` memory-maps the cube of a table (`load_current`)
+instead of rebuilding it, as long as the cube is newer than the table.
+
+The repetition axis follows the notebooks convention: for each
+subject-visit (and hemisphere), repetitions are ranked by their original
+number, i.e. `groupby(...).cumcount()`.
+"""
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Columns of the raw/sampled tables that are not measurements
+meta_columns = {
+    "subject_visit",
+    "subject",
+    "visit",
+    "repetition",
+    "dx_group",
+    "PD_status",
+    "PATNO_id",
+    "hemi",
+    "hemisphere",
+    "image_name",
+    "path",
+    "rejected_images",
+    "input_dir",
+    "ID",
+}
+
+# Per subject-visit columns kept in the subjects index table
+_subject_columns = ["dx_group", "PD_status"]
+
+
+def region_columns(df: pd.DataFrame) -> list[str]:
+    """
+    Measurement columns of a wide table, in table order.
+    """
+    return [
+        column
+        for column in df.columns
+        if column not in meta_columns and pd.api.types.is_float_dtype(df[column])
+    ]
+
+
+def _region_name(column: str, metric: str) -> str:
+    return column.replace(f"_{metric}", "")
+
+
+@dataclass
+class RepetitionCube:
+    metric: str
+    values: np.ndarray
+    repetitions: np.ndarray
+    subjects: pd.DataFrame
+    regions: pd.DataFrame
+    visits: pd.DataFrame
+    hemispheres: list
+    source: str | None = None
+
+    @property
+    def hemisphere(self) -> bool:
+        return self.hemispheres != [None]
+
+    @property
+    def shape(self) -> tuple[int, int, int, int]:
+        return self.values.shape
+
+    # ------------------------------------------------------------------
+    # Index helpers
+    # ------------------------------------------------------------------
+
+    def subject_codes(self, subject_visits) -> np.ndarray:
+        codes = pd.Index(self.subjects["subject_visit"]).get_indexer(subject_visits)
+        if (codes < 0).any():
+            missing = np.asarray(subject_visits)[codes < 0]
+            raise KeyError(f"Unknown subject_visit: {list(missing[:5])}")
+        return codes
+
+    def region_codes(self, regions) -> np.ndarray:
+        codes = pd.Index(self.regions["region"]).get_indexer(regions)
+        if (codes < 0).any():
+            missing = np.asarray(regions)[codes < 0]
+            raise KeyError(f"Unknown region: {list(missing[:5])}")
+        return codes
+
+    def hemisphere_code(self, hemisphere: str | None) -> int:
+        return self.hemispheres.index(hemisphere)
+
+    def sel(
+        self,
+        subject_visits=None,
+        hemisphere: str | None = None,
+        regions=None,
+    ) -> np.ndarray:
+        """
+        Slice the cube.
+
+        `hemisphere` drops the hemisphere axis (view). `subject_visits` and
+        `regions` select along their axis, keeping it.
+        """
+        values = self.values
+        if hemisphere is not None:
+            values = values[:, :, self.hemisphere_code(hemisphere), :]
+        if regions is not None:
+            values = values[..., self.region_codes(regions)]
+        if subject_visits is not None:
+            values = values[:, self.subject_codes(subject_visits)]
+        return values
+
+    def to_long(self, subject_visits=None) -> pd.DataFrame:
+        """
+        Long-form DataFrame as built by the notebooks with `melt`:
+        ['repetition', 'subject_visit', 'PD_status', ('hemisphere',) 'region', metric]
+        with `repetition` starting at 1.
+        """
+        codes = (
+            np.arange(len(self.subjects))
+            if subject_visits is None
+            else self.subject_codes(subject_visits)
+        )
+        values = self.values[:, codes]
+        n_rep, n_sub, n_hemi, n_reg = values.shape
+        grid = np.indices((n_rep, n_sub, n_hemi, n_reg)).reshape(4, -1)
+        subjects = self.subjects.iloc[codes].reset_index(drop=True)
+        long = {
+            "repetition": grid[0] + 1,
+            "subject_visit": subjects["subject_visit"].to_numpy()[grid[1]],
+        }
+        if "PD_status" in subjects:
+            long["PD_status"] = subjects["PD_status"].to_numpy()[grid[1]]
+        if self.hemisphere:
+            long["hemisphere"] = np.asarray(self.hemispheres, dtype=object)[grid[2]]
+        long["region"] = self.regions["region"].to_numpy()[grid[3]]
+        long[self.metric] = values.reshape(-1)
+        df = pd.DataFrame(long)
+        return df[~np.isnan(df[self.metric])].reset_index(drop=True)
+
+    # ------------------------------------------------------------------
+    # I/O
+    # ------------------------------------------------------------------
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        if not (
+            isinstance(self.values, np.memmap)
+            and Path(self.values.filename) == (path / "values.npy").resolve()
+        ):
+            np.save(path / "values.npy", self.values)
+        np.save(path / "repetitions.npy", self.repetitions)
+        self.subjects.to_parquet(path / "subjects.parquet")
+        self.regions.to_parquet(path / "regions.parquet")
+        self.visits.to_parquet(path / "visits.parquet")
+        meta = {
+            "metric": self.metric,
+            "hemispheres": self.hemispheres,
+            "shape": list(self.values.shape),
+            "source": self.source,
+        }
+        with open(path / "meta.json", "w") as fo:
+            json.dump(meta, fo, indent=2)
+
+    @classmethod
+    def load(cls, path: Path, mmap_mode: str | None = "r") -> "RepetitionCube":
+        path = Path(path)
+        with open(path / "meta.json") as fi:
+            meta = json.load(fi)
+        return cls(
+            metric=meta["metric"],
+            values=np.load(path / "values.npy", mmap_mode=mmap_mode),
+            repetitions=np.load(path / "repetitions.npy"),
+            subjects=pd.read_parquet(path / "subjects.parquet"),
+            regions=pd.read_parquet(path / "regions.parquet"),
+            visits=pd.read_parquet(path / "visits.parquet"),
+            hemispheres=meta["hemispheres"],
+            source=meta.get("source"),
+        )
+
+
+def load_current(path: Path, source: Path) -> RepetitionCube | None:
+    """
+    Memory-map the cube saved in `path` if it was built from the `source`
+    table and is newer than it, else None.
+    """
+    meta = Path(path) / "meta.json"
+    source = Path(source)
+    if not meta.exists() or not source.exists():
+        return None
+    cube = RepetitionCube.load(path)
+    if cube.source != str(source.resolve()):
+        return None
+    if meta.stat().st_mtime_ns < source.stat().st_mtime_ns:
+        return None
+    return cube
+
+
+def build_cube(
+    df: pd.DataFrame,
+    metric: str,
+    path: Path | None = None,
+    source: Path | None = None,
+) -> RepetitionCube:
+    """
+    Build the cube of one metric from a raw/sampled wide table.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Wide table with `subject_visit`, `repetition`, optional `hemi` and one
+        column per region (e.g. `stats_QCed/sampled/<metric>.parquet`).
+    metric : str
+        Metric name, stripped from the region column names.
+    path : Path, optional
+        When given, values are written directly into `<path>/values.npy`
+        (memory-mapped) and the cube is saved there.
+    source : Path, optional
+        Table `df` was read from, recorded for `load_current`.
+    """
+    hemi_col = "hemi" if "hemi" in df.columns else None
+    columns = region_columns(df)
+
+    df = df.sort_values(
+        ["subject_visit"] + ([hemi_col] if hemi_col else []) + ["repetition"],
+        kind="stable",
+    )
+    sv_codes, sv_uniques = pd.factorize(df["subject_visit"], sort=True)
+    if hemi_col:
+        hemispheres = sorted(df[hemi_col].unique())
+        hemi_codes = pd.Index(hemispheres).get_indexer(df[hemi_col])
+    else:
+        hemispheres = [None]
+        hemi_codes = np.zeros(len(df), dtype=np.intp)
+    group = sv_codes * len(hemispheres) + hemi_codes
+    rep_codes = pd.Series(group).groupby(group).cumcount().to_numpy()
+
+    shape = (
+        int(rep_codes.max()) + 1,
+        len(sv_uniques),
+        len(hemispheres),
+        len(columns),
+    )
+    if path is not None:
+        Path(path).mkdir(parents=True, exist_ok=True)
+        values = np.lib.format.open_memmap(
+            Path(path) / "values.npy", mode="w+", dtype=np.float64, shape=shape
+        )
+        values[:] = np.nan
+    else:
+        values = np.full(shape, np.nan, dtype=np.float64)
+    values[rep_codes, sv_codes, hemi_codes, :] = df[columns].to_numpy(np.float64)
+
+    repetitions = np.full(shape[:3], -1, dtype=np.int32)
+    repetitions[rep_codes, sv_codes, hemi_codes] = df["repetition"].to_numpy()
+
+    # Index tables
+    first = df.drop_duplicates("subject_visit").set_index("subject_visit")
+    subjects = pd.DataFrame({"subject_visit": np.asarray(sv_uniques, dtype=object)})
+    split = subjects["subject_visit"].str.split("_", n=1, expand=True)
+    subjects["subject"] = split[0]
+    subjects["visit"] = split[1]
+    subjects["subject_code"] = pd.factorize(subjects["subject"], sort=True)[0]
+    visit_codes, visit_uniques = pd.factorize(subjects["visit"], sort=True)
+    subjects["visit_code"] = visit_codes
+    for column in _subject_columns:
+        if column in first:
+            subjects[column] = first.loc[sv_uniques, column].to_numpy()
+    regions = pd.DataFrame(
+        {
+            "region": [_region_name(column, metric) for column in columns],
+            "column": columns,
+        }
+    )
+    visits = pd.DataFrame({"visit": np.asarray(visit_uniques, dtype=object)})
+
+    cube = RepetitionCube(
+        metric=metric,
+        values=values,
+        repetitions=repetitions,
+        subjects=subjects,
+        regions=regions,
+        visits=visits,
+        hemispheres=hemispheres,
+        source=None if source is None else str(Path(source).resolve()),
+    )
+    if path is not None:
+        values.flush()
+        cube.save(path)
+    return cube
+
+
+def build_cubes(
+    stats_dir: Path,
+    cube_dir: Path,
+    metrics=("thickness", "area", "volume", "subcortical_volume"),
+) -> dict:
+    """
+    Build and save the cube of every metric table found in `stats_dir`.
+    """
+    cubes = {}
+    for metric in metrics:
+        source = Path(stats_dir) / f"{metric}.parquet"
+        cubes[metric] = build_cube(
+            pd.read_parquet(source), metric, path=Path(cube_dir) / metric, source=source
+        )
+    return cubes
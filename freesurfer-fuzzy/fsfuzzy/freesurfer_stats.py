@@ -0,0 +1,136 @@
+"""
+Reader for FreeSurfer `aseg.stats` and `?h.aparc.stats` files.
+
+The tables produced here follow the column naming of `asegstats2table` and
+`aparcstats2table` so that they can replace the TSV round-trip:
+- aparc: `<hemi>_<struct>_<meas>` plus `<hemi>_MeanThickness_thickness`,
+  `<hemi>_WhiteSurfArea_area`, `BrainSegVolNotVent` and `eTIV`.
+- aseg: one column per `StructName` plus the `# Measure` global volumes.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+# aparcstats2table --meas=<key> -> column of the aparc.stats table
+aparc_measure_columns = {
+    "area": "SurfArea",
+    "volume": "GrayVol",
+    "thickness": "ThickAvg",
+    "thicknessstd": "ThickStd",
+    "meancurv": "MeanCurv",
+    "gauscurv": "GausCurv",
+    "foldind": "FoldInd",
+    "curvind": "CurvInd",
+}
+
+# asegstats2table --meas=<key> -> column of the aseg.stats table
+aseg_measure_columns = {
+    "volume": "Volume_mm3",
+    "nvoxels": "NVoxels",
+    "mean": "normMean",
+    "std": "normStdDev",
+}
+
+# Global measures appended to each hemisphere table by aparcstats2table
+_aparc_global_measures = {
+    "thickness": ("MeanThickness",),
+    "area": ("WhiteSurfArea",),
+}
+_aparc_extra_measures = ("BrainSegVolNotVent", "eTIV")
+
+# asegstats2table names the eTIV global measure by its long name
+_aseg_global_renames = {"eTIV": "EstimatedTotalIntraCranialVol"}
+
+
+def parse_stats(path: str | Path) -> tuple[dict[str, float], dict[str, list]]:
+    """
+    Parse a FreeSurfer `.stats` file in a single pass.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to an `aseg.stats` or `?h.aparc.stats` file.
+
+    Returns
+    -------
+    measures : dict
+        Global measures from `# Measure` lines, keyed by their short name
+        (second field, e.g. `BrainSegVolNotVent`, `eTIV`, `MeanThickness`).
+    table : dict
+        Per-structure table keyed by the `# ColHeaders` names. Numeric
+        columns are float arrays, `StructName` is a list of strings.
+    """
+    measures = {}
+    headers = None
+    rows = []
+    with open(path, "r") as fi:
+        for line in fi:
+            if line.startswith("# Measure "):
+                fields = [
+                    field.strip() for field in line[len("# Measure ") :].split(",")
+                ]
+                measures[fields[1]] = float(fields[3])
+            elif line.startswith("# ColHeaders"):
+                headers = line.split()[2:]
+            elif line.startswith("#") or not line.strip():
+                continue
+            else:
+                rows.append(line.split())
+
+    if headers is None:
+        raise ValueError(f"No '# ColHeaders' line found in {path}")
+
+    table = {}
+    columns = list(zip(*rows)) if rows else [()] * len(headers)
+    for header, values in zip(headers, columns):
+        if header == "StructName":
+            table[header] = list(values)
+        else:
+            table[header] = np.asarray(values, dtype=np.float64)
+    return measures, table
+
+
+def aparc_row(path: str | Path, hemi: str, measures: list[str]) -> dict[str, dict]:
+    """
+    Read one `?h.aparc.stats` file into one row per measure.
+
+    Returns a mapping measure -> {column: value} with column names identical
+    to the ones written by `aparcstats2table --hemi=<hemi> --meas=<measure>`.
+    """
+    global_measures, table = parse_stats(path)
+    structures = table["StructName"]
+    rows = {}
+    for measure in measures:
+        values = table[aparc_measure_columns[measure]]
+        row = {
+            f"{hemi}_{structure}_{measure}": value
+            for structure, value in zip(structures, values)
+        }
+        for name in _aparc_global_measures.get(measure, ()):
+            row[f"{hemi}_{name}_{measure}"] = global_measures.get(name, np.nan)
+        for name in _aparc_extra_measures:
+            row[name] = global_measures.get(name, np.nan)
+        rows[measure] = row
+    return rows
+
+
+def aseg_row(path: str | Path, measures: list[str]) -> dict[str, dict]:
+    """
+    Read one `aseg.stats` file into one row per measure.
+
+    Returns a mapping measure -> {column: value} with column names identical
+    to the ones written by `asegstats2table --meas=<measure>`. Global volumes
+    are only appended for the `volume` measure.
+    """
+    global_measures, table = parse_stats(path)
+    structures = table["StructName"]
+    rows = {}
+    for measure in measures:
+        values = table[aseg_measure_columns[measure]]
+        row = dict(zip(structures, values))
+        if measure == "volume":
+            for name, value in global_measures.items():
+                row[_aseg_global_renames.get(name, name)] = value
+        rows[measure] = row
+    return rows
@@ -0,0 +1,402 @@
+"""
+Build the raw `stats_QCed/raw/*.parquet` tables directly from the
+`vip_outputs/rep*/sub-*/stats/*.stats` tree.
+
+Each subject directory is parsed once (aseg + both aparc hemispheres, all
+measures) on a process pool, so no `aparcstats2table`/`asegstats2table`
+call nor intermediate TSV file is needed.
+
+With `--incremental`, a manifest of the parsed files is kept next to the
+tables (see `fsfuzzy.manifest`) and only new or changed stats files are
+parsed and merged into the existing tables.
+
+Usage:
+    python -m fsfuzzy.ingest --input-dir vip_outputs \
+        --cohort cohort/cross-sectional_cohort_qced.csv \
+        --output-dir stats_QCed/raw [--incremental]
+"""
+
+import argparse
+import os
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from fsfuzzy.cohort import CohortIndex, annotate_tables, load_cohort_index
+from fsfuzzy.freesurfer_stats import aparc_row, aseg_row
+from fsfuzzy.manifest import (
+    changed_files,
+    fingerprint,
+    load_manifest,
+    save_manifest,
+    table_fingerprint,
+)
+from fsfuzzy.partitioned import dataset_dirname, write_metrics
+
+hemispheres = ("lh", "rh")
+
+# Stats file read for each table source
+stats_files = {
+    "aseg": "aseg.stats",
+    "lh": "lh.aparc.stats",
+    "rh": "rh.aparc.stats",
+}
+
+# Output table -> (stats source, measure)
+tables = {
+    "thickness": ("aparc", "thickness"),
+    "area": ("aparc", "area"),
+    "volume": ("aparc", "volume"),
+    "subcortical_volume": ("aseg", "volume"),
+}
+
+
+def _repetition_from_dirname(dirname: str) -> int:
+    return int(dirname.replace("rep", ""))
+
+
+def discover_subjects(
+    input_dir: Path, pairs: set[tuple[int, str]] | None = None
+) -> list[tuple[int, str, Path]]:
+    """
+    List the (repetition, subject_visit, subject_dir) of the `rep*/sub-*` tree.
+
+    Parameters
+    ----------
+    input_dir : Path
+        Directory containing one `rep<N>` directory per MCA repetition.
+    pairs : set of (int, str), optional
+        Only keep these (repetition, subject_visit) pairs, e.g. the QCed
+        executions dataset.
+    """
+    subjects = []
+    for rep_dir in sorted(Path(input_dir).glob("rep*")):
+        if not rep_dir.is_dir():
+            continue
+        repetition = _repetition_from_dirname(rep_dir.name)
+        for subject_dir in sorted(rep_dir.glob("sub-*")):
+            if pairs is not None and (repetition, subject_dir.name) not in pairs:
+                continue
+            subjects.append((repetition, subject_dir.name, subject_dir))
+    return subjects
+
+
+def list_stats_files(
+    subjects: list[tuple[int, str, Path]],
+) -> list[tuple[int, str, str, Path]]:
+    """
+    List the existing (repetition, subject_visit, stats_file, path) files.
+    """
+    files = []
+    for repetition, subject_visit, subject_dir in subjects:
+        for stats_file in stats_files.values():
+            path = Path(subject_dir) / "stats" / stats_file
+            if path.exists():
+                files.append((repetition, subject_visit, stats_file, path))
+    return files
+
+
+def read_subject(
+    repetition: int,
+    subject_visit: str,
+    subject_dir: Path,
+    aparc_measures: list[str],
+    aseg_measures: list[str],
+    sources: tuple[str, ...] = ("aseg",) + hemispheres,
+) -> dict:
+    """
+    Parse the aseg and aparc stats files of one subject directory.
+
+    Missing files are skipped, as `--skip` does for the FreeSurfer tools.
+    `sources` restricts parsing to some of 'aseg', 'lh' and 'rh'.
+    """
+    stats_dir = Path(subject_dir) / "stats"
+    rows = {"repetition": repetition, "subject_visit": subject_visit}
+    aseg = stats_dir / stats_files["aseg"]
+    if "aseg" in sources and aseg_measures and aseg.exists():
+        rows["aseg"] = aseg_row(aseg, aseg_measures)
+    for hemi in hemispheres:
+        aparc = stats_dir / stats_files[hemi]
+        if hemi in sources and aparc_measures and aparc.exists():
+            rows[hemi] = aparc_row(aparc, hemi, aparc_measures)
+    return rows
+
+
+def parse_tree(
+    subjects: list[tuple[int, str, Path]],
+    names: list[str] | None = None,
+    n_jobs: int = -1,
+    verbose: int = 0,
+    sources: dict[tuple[int, str], tuple[str, ...]] | None = None,
+) -> list[dict]:
+    """
+    Parse all subject directories on a process pool.
+
+    `sources` optionally maps (repetition, subject_visit) to the stats
+    sources to parse for that subject.
+    """
+    names = list(tables) if names is None else names
+    aparc_measures = sorted({tables[n][1] for n in names if tables[n][0] == "aparc"})
+    aseg_measures = sorted({tables[n][1] for n in names if tables[n][0] == "aseg"})
+    all_sources = ("aseg",) + hemispheres
+    return joblib.Parallel(n_jobs=n_jobs, verbose=verbose)(
+        joblib.delayed(read_subject)(
+            repetition,
+            subject_visit,
+            subject_dir,
+            aparc_measures,
+            aseg_measures,
+            all_sources if sources is None else sources[(repetition, subject_visit)],
+        )
+        for repetition, subject_visit, subject_dir in subjects
+    )
+
+
+def _to_frame(records: list[tuple[int, str, str | None, dict]]) -> pd.DataFrame:
+    """
+    Assemble rows into a wide DataFrame, filling column arrays in one go.
+    """
+    columns = {}
+    for _, _, _, row in records:
+        for column in row:
+            columns.setdefault(column, len(columns))
+
+    values = np.full((len(records), len(columns)), np.nan, dtype=np.float64)
+    for i, (_, _, _, row) in enumerate(records):
+        index = [columns[column] for column in row]
+        values[i, index] = list(row.values())
+
+    df = pd.DataFrame(values, columns=list(columns))
+    df.insert(0, "subject_visit", [subject_visit for _, subject_visit, _, _ in records])
+    df["repetition"] = np.asarray([rep for rep, _, _, _ in records], dtype=np.int64)
+    hemis = [hemi for _, _, hemi, _ in records]
+    if any(hemi is not None for hemi in hemis):
+        df["hemi"] = hemis
+    return df
+
+
+def build_tables(results: list[dict], names: list[str] | None = None) -> dict:
+    """
+    Turn parsed subjects into one wide DataFrame per output table.
+
+    Columns follow the TSV tables once the hemisphere prefix is removed:
+    ['subject_visit', <measures>..., 'repetition', ('hemi')].
+    """
+    names = list(tables) if names is None else names
+    out = {}
+    for name in names:
+        source, measure = tables[name]
+        records = []
+        if source == "aseg":
+            for res in results:
+                if "aseg" in res:
+                    row = res["aseg"][measure]
+                    records.append((res["repetition"], res["subject_visit"], None, row))
+        else:
+            for hemi in hemispheres:
+                for res in results:
+                    if hemi not in res:
+                        continue
+                    row = {
+                        column.removeprefix(f"{hemi}_"): value
+                        for column, value in res[hemi][measure].items()
+                    }
+                    records.append((res["repetition"], res["subject_visit"], hemi, row))
+        df = _to_frame(records)
+        sort_keys = (["hemi"] if "hemi" in df else []) + ["repetition", "subject_visit"]
+        out[name] = df.sort_values(sort_keys, kind="stable").reset_index(drop=True)
+    return out
+
+
+def write_tables(tables_df: dict, output_dir: Path) -> None:
+    """
+    Write `<name>.parquet` and the hive-partitioned copy in `partitioned/`.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in tables_df.items():
+        df.to_parquet(output_dir / f"{name}.parquet")
+    write_metrics(tables_df, output_dir / dataset_dirname)
+
+
+def merge_tables(existing: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replace the rows of `existing` re-parsed in `new` and append the others.
+    """
+    keys = ["repetition", "subject_visit"] + (["hemi"] if "hemi" in new else [])
+    replaced = existing.merge(
+        new[keys].drop_duplicates(), on=keys, how="left", indicator=True
+    )["_merge"].eq("both")
+    merged = pd.concat([existing[~replaced.to_numpy()], new], ignore_index=True)
+    sort_keys = (["hemi"] if "hemi" in merged else []) + ["repetition", "subject_visit"]
+    return merged.sort_values(sort_keys, kind="stable").reset_index(drop=True)
+
+
+def merge_drop_reports(existing: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replace the subject-visits of `existing` reported again in `new` (per
+    table) and append the others.
+    """
+    keys = ["table", "subject_visit"]
+    merged = pd.concat([existing, new], ignore_index=True)
+    merged = merged.drop_duplicates(keys, keep="last")
+    return merged.sort_values(keys, kind="stable").reset_index(drop=True)
+
+
+def ingest(
+    input_dir: Path,
+    output_dir: Path,
+    cohort: CohortIndex | pd.DataFrame | None = None,
+    dataset: pd.DataFrame | None = None,
+    names: list[str] | None = None,
+    n_jobs: int = -1,
+    verbose: int = 0,
+    incremental: bool = False,
+) -> dict:
+    """
+    Parse the stats tree and write one raw parquet table per metric.
+
+    Parameters
+    ----------
+    input_dir : Path
+        `vip_outputs` directory.
+    output_dir : Path
+        Directory receiving `<metric>.parquet` and the ingestion manifest.
+    cohort : CohortIndex or DataFrame, optional
+        Cohort used to annotate the tables (see `fsfuzzy.cohort`). Rows of
+        subject-visits outside the cohort are dropped and listed in
+        `<output_dir>/dropped.csv` (merged with the existing report when
+        `incremental`).
+    dataset : DataFrame, optional
+        Executions dataset with `repetition` and `subject_visit` columns;
+        restricts parsing to these pairs.
+    incremental : bool
+        Only parse stats files that are not in the manifest or whose content
+        changed, and merge them into the existing tables. Rows of subjects
+        removed from `input_dir` are kept.
+    """
+    output_dir = Path(output_dir)
+    names = list(tables) if names is None else names
+    pairs = None
+    if dataset is not None:
+        pairs = set(zip(dataset["repetition"].astype(int), dataset["subject_visit"]))
+    subjects = discover_subjects(input_dir, pairs=pairs)
+
+    table_files = {
+        name: (
+            [stats_files["aseg"]]
+            if tables[name][0] == "aseg"
+            else [stats_files[hemi] for hemi in hemispheres]
+        )
+        for name in names
+    }
+    current = table_fingerprint(fingerprint(list_stats_files(subjects)), table_files)
+    existing = {
+        name: output_dir / f"{name}.parquet"
+        for name in names
+        if incremental and (output_dir / f"{name}.parquet").exists()
+    }
+    incremental = incremental and len(existing) == len(names)
+    manifest = load_manifest(output_dir)
+    if not incremental:
+        # the requested tables are rebuilt; entries of the others are kept
+        manifest = manifest[~manifest["table"].isin(names)]
+    changed, manifest = changed_files(current, manifest)
+
+    source_of = {stats_file: source for source, stats_file in stats_files.items()}
+    sources = {}
+    for repetition, subject_visit, stats_file in (
+        changed[["repetition", "subject_visit", "stats_file"]]
+        .drop_duplicates()
+        .itertuples(index=False)
+    ):
+        sources.setdefault((repetition, subject_visit), set()).add(
+            source_of[stats_file]
+        )
+    subjects = [s for s in subjects if (s[0], s[1]) in sources]
+    if verbose:
+        n_files = len(
+            changed.drop_duplicates(["repetition", "subject_visit", "stats_file"])
+        )
+        print(f"Parsing {n_files} stats files from {len(subjects)} subjects")
+    if incremental and changed.empty:
+        save_manifest(manifest, output_dir)
+        tables_df = {name: pd.read_parquet(path) for name, path in existing.items()}
+        if not (output_dir / dataset_dirname).exists():
+            write_metrics(tables_df, output_dir / dataset_dirname)
+        return tables_df
+
+    results = parse_tree(
+        subjects,
+        names=names,
+        n_jobs=n_jobs,
+        verbose=verbose,
+        sources={key: tuple(sorted(value)) for key, value in sources.items()},
+    )
+    tables_df = build_tables(results, names=names)
+    if cohort is not None:
+        tables_df, dropped = annotate_tables(tables_df, cohort, verbose=verbose > 0)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        if incremental and (output_dir / "dropped.csv").exists():
+            # rows dropped by earlier runs are still missing from the tables
+            dropped = merge_drop_reports(
+                pd.read_csv(output_dir / "dropped.csv"), dropped
+            )
+        dropped.to_csv(output_dir / "dropped.csv", index=False)
+    if incremental:
+        tables_df = {
+            name: merge_tables(pd.read_parquet(existing[name]), df)
+            for name, df in tables_df.items()
+        }
+    write_tables(tables_df, output_dir)
+    save_manifest(manifest, output_dir)
+    return tables_df
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Parse aseg/aparc stats files into raw parquet tables"
+    )
+    parser.add_argument("--input-dir", required=True, help="vip_outputs directory")
+    parser.add_argument("--output-dir", required=True, help="Output directory")
+    parser.add_argument(
+        "--cohort",
+        help="Cross-sectional (PATNO_id) or longitudinal (first_visit, second_visit) "
+        "cohort CSV",
+    )
+    parser.add_argument("--dataset", help="Executions CSV (repetition, subject_visit)")
+    parser.add_argument(
+        "--tables", nargs="+", choices=list(tables), help="Tables to build"
+    )
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Number of processes")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only parse new or changed stats files (see manifest.parquet)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cohort = load_cohort_index(args.cohort) if args.cohort else None
+    dataset = pd.read_csv(args.dataset) if args.dataset else None
+    tables_df = ingest(
+        input_dir=Path(args.input_dir),
+        output_dir=Path(args.output_dir),
+        cohort=cohort,
+        dataset=dataset,
+        names=args.tables,
+        n_jobs=args.n_jobs,
+        verbose=10,
+        incremental=args.incremental,
+    )
+    for name, df in tables_df.items():
+        print(f"{name}: {df.shape[0]} rows, {df.shape[1]} columns")
+    print(f"Tables saved in {os.path.abspath(args.output_dir)}")
+
+
+if __name__ == "__main__":
+    main()
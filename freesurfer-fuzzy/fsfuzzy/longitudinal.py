@@ -0,0 +1,510 @@
+"""
+Longitudinal analyses (ANCOVA, partial correlation) of the fuzzy and IEEE
+tables, run as a matrix of independent jobs on a process pool.
+
+A job is one (test, timepoint, metric, flavor):
+- test: `ancova` (HC vs PD) or `partial_correlation` (UPDRS, PD-non-MCI
+  subjects only);
+- timepoint: `baseline` (first visit) or `longitudinal` (relative change
+  between the first and second visits);
+- flavor: `fuzzy` (MCA repetitions of `stats_QCed/sampled/partitioned`) or
+  `ieee` (`table_ieee/*.tsv`).
+
+Each input table is read once per (metric, flavor) in the parent process
+and shared by the jobs that use it. Outputs are those of the
+`notebooks/longitudinal` notebooks:
+
+    <data_dir>/<test>/<test>_<timepoint>_<metric>.parquet       fuzzy, per repetition
+    <results_dir>/<test>/<test>_<timepoint>_<metric>_stats.csv  fuzzy, per region
+    <results_dir>/<test>_ieee/<test>_<timepoint>_<metric>.csv   ieee, per region
+
+Fuzzy results can be computed over chunks of `--chunk-repetitions`
+repetitions: each chunk is tested, appended to the parquet file and fed to
+a `fsfuzzy.significance.SignificanceAccumulator`, so neither the long-form
+table nor the results of all repetitions are held in memory at once.
+
+The wall time of every load and job is printed at the end. With
+`--cache-dir`, test results are kept in a `fsfuzzy.cache.ResultCache`
+keyed by the job, its input table, the cohort and the code, so a rerun
+only recomputes the jobs whose inputs changed.
+
+Usage:
+    python -m fsfuzzy.longitudinal \
+        --cohort cohort/longitudinal_cohort_qced.csv \
+        --stats-dir stats_QCed/sampled --ieee-dir table_ieee \
+        --data-dir data --results-dir results/longitudinal [--n-jobs 8]
+"""
+
+import argparse
+import itertools
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import joblib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fsfuzzy.ancova import batched_ancova
+from fsfuzzy.cache import ResultCache
+from fsfuzzy.partial_correlation import batched_partial_corr
+from fsfuzzy.partitioned import dataset_dirname, read_measurements
+from fsfuzzy.significance import SignificanceAccumulator
+from fsfuzzy.visits import relative_change
+
+# metric -> cortical (one row per hemisphere)
+metrics = {
+    "volume": True,
+    "thickness": True,
+    "area": True,
+    "subcortical_volume": False,
+}
+tests = ("ancova", "partial_correlation")
+timepoints = ("baseline", "longitudinal")
+flavors = ("fuzzy", "ieee")
+
+_visit_columns = {"baseline": "first_visit", "longitudinal": "second_visit"}
+covariates = {
+    "baseline": ["AGE_AT_VISIT", "SEX"],
+    "longitudinal": ["AGE_AT_VISIT", "SEX", "durationT2_T1_y"],
+}
+# Group factor of the ANCOVA, clinical score of the partial correlation
+factors = {"baseline": "dx_group", "longitudinal": "PD_status"}
+scores = {"baseline": "UPDRS", "longitudinal": "UPDRS_change"}
+# Name of the test count column of the significance tables
+_count_columns = {"baseline": "n_correlations", "longitudinal": "n_tests"}
+_statistics = {"ancova": "F", "partial_correlation": "r"}
+
+
+@dataclass(frozen=True)
+class Job:
+    test: str
+    timepoint: str
+    metric: str
+    flavor: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.test}_{self.timepoint}_{self.metric}"
+
+    @property
+    def hemisphere(self) -> bool:
+        return metrics[self.metric]
+
+    @property
+    def statistic(self) -> str:
+        return _statistics[self.test]
+
+
+def job_matrix(
+    metric_names: list[str] | None = None,
+    test_names: list[str] | None = None,
+    timepoint_names: list[str] | None = None,
+    flavor_names: list[str] | None = None,
+) -> list[Job]:
+    """
+    All (test, timepoint, metric, flavor) jobs; fuzzy cortical jobs, the
+    longest, come first.
+    """
+    product = itertools.product(
+        flavor_names or flavors,
+        metric_names or list(metrics),
+        test_names or tests,
+        timepoint_names or timepoints,
+    )
+    return [
+        Job(test, timepoint, metric, flavor)
+        for flavor, metric, test, timepoint in product
+    ]
+
+
+def load_cohort(path: str | Path) -> pd.DataFrame:
+    """
+    Longitudinal cohort with `UPDRS`, `UPDRS_change` and `PD_status` columns.
+    """
+    cohort = pd.read_csv(path)
+    cohort = cohort.rename(columns={"NP3TOT": "UPDRS", "NP3TOT_change": "UPDRS_change"})
+    cohort["PD_status"] = cohort["dx_group"].replace({"PD-non-MCI": "PD", "HC": "HC"})
+    return cohort
+
+
+def _subject_visits(cohort: pd.DataFrame) -> list[str]:
+    return pd.unique(cohort[list(_visit_columns.values())].to_numpy().ravel()).tolist()
+
+
+def read_fuzzy(metric: str, stats_dir: Path, cohort: pd.DataFrame) -> pd.DataFrame:
+    """
+    Measurements of both visits of the cohort subjects, one row per
+    subject-visit (hemisphere) and repetition.
+
+    Returns
+    -------
+    DataFrame
+        ['subject_visit', ('hemisphere',) 'repetition', <regions>...]
+    """
+    hemisphere = metrics[metric]
+    wide = read_measurements(
+        Path(stats_dir) / dataset_dirname,
+        metric,
+        id_columns=["subject_visit"] + (["hemi"] if hemisphere else []),
+        subject_visits=_subject_visits(cohort),
+    )
+    wide = wide.rename(columns={"hemi": "hemisphere"})
+    wide.columns = [c.replace(f"_{metric}", "") for c in wide.columns]
+    group_cols = ["subject_visit"] + (["hemisphere"] if hemisphere else [])
+    wide.insert(len(group_cols), "repetition", wide.groupby(group_cols).cumcount() + 1)
+    return wide
+
+
+def _read_ieee_table(ieee_dir: Path, hemi: str, measure: str) -> pd.DataFrame:
+    df = pd.read_csv(Path(ieee_dir) / f"{hemi}.aparc.{measure}.tsv", sep="\t")
+    df.columns = [c.replace(f"{hemi}.", "") for c in df.columns]
+    df.columns = [c.replace(f"{hemi}_", "") for c in df.columns]
+    df.columns = [c.replace(f"_{measure}", "") for c in df.columns]
+    df = df.rename(columns={f"aparc.{measure}": "subject_visit"})
+    df.insert(1, "hemisphere", hemi)
+    return df
+
+
+def read_ieee(metric: str, ieee_dir: Path) -> pd.DataFrame:
+    """
+    IEEE measurements in the layout of `read_fuzzy`, with one repetition.
+    """
+    if metrics[metric]:
+        wide = pd.concat(
+            [_read_ieee_table(ieee_dir, hemi, metric) for hemi in ("lh", "rh")],
+            ignore_index=True,
+        )
+        group_cols = ["subject_visit", "hemisphere"]
+    else:
+        wide = pd.read_csv(Path(ieee_dir) / "aseg.volume.tsv", sep="\t")
+        wide = wide.rename(columns={"Measure:volume": "subject_visit"})
+        group_cols = ["subject_visit"]
+    wide.insert(len(group_cols), "repetition", 1)
+    return wide
+
+
+def _long(wide: pd.DataFrame, metric: str) -> pd.DataFrame:
+    id_vars = [c for c in ("subject_visit", "hemisphere", "repetition") if c in wide]
+    long = wide.melt(id_vars=id_vars, var_name="region", value_name=metric)
+    long[metric] = pd.to_numeric(long[metric], errors="coerce")
+    return long
+
+
+def _visit(long: pd.DataFrame, cohort: pd.DataFrame, timepoint: str, columns):
+    visit_col = _visit_columns[timepoint]
+    return long.merge(
+        cohort[[visit_col] + columns],
+        left_on="subject_visit",
+        right_on=visit_col,
+        how="inner",
+    ).drop(columns=[visit_col])
+
+
+def baseline_table(
+    wide: pd.DataFrame, cohort: pd.DataFrame, metric: str
+) -> pd.DataFrame:
+    """
+    Long-form first-visit table with the cohort covariates.
+    """
+    columns = ["PATNO", "dx_group", "PD_status", "UPDRS"] + covariates["baseline"]
+    columns = [c for c in columns if c in cohort]
+    base = _visit(_long(wide, metric), cohort, "baseline", columns)
+    for c in covariates["baseline"] + ["UPDRS"]:
+        if c in base:
+            base[c] = pd.to_numeric(base[c], errors="coerce")
+    return base
+
+
+def change_table(wide: pd.DataFrame, cohort: pd.DataFrame, metric: str) -> pd.DataFrame:
+    """
+    Relative change between the first and second visits,
+    `<metric>_change = (<metric>_T2 - <metric>_T1) / <metric>_T1`, with the
+    covariates of the cohort.
+    """
+    long = _long(wide, metric)
+    columns = ["PATNO", "PD_status", "UPDRS_change"] + covariates["longitudinal"]
+    columns = [c for c in columns if c in cohort]
+    v1 = _visit(long, cohort, "baseline", ["PATNO"])
+    v2 = _visit(long, cohort, "longitudinal", columns)
+    keys = ["PATNO", "region", "repetition"] + (
+        ["hemisphere"] if "hemisphere" in long else []
+    )
+    m = relative_change(v1, v2, metric, keys)
+    for c in covariates["longitudinal"] + ["UPDRS_change"]:
+        if c in m:
+            m[c] = pd.to_numeric(m[c], errors="coerce")
+    return m
+
+
+def run_test(table: pd.DataFrame, job: Job) -> pd.DataFrame:
+    """
+    ANCOVA or partial correlation of every (repetition, region[, hemisphere]).
+    """
+    baseline = job.timepoint == "baseline"
+    value = job.metric if baseline else f"{job.metric}_change"
+    unit = "subject_visit" if baseline else "PATNO"
+    hemi = ["hemisphere"] if job.hemisphere else []
+    by = ["repetition", "region"] + hemi if job.flavor == "fuzzy" else hemi + ["region"]
+    covar = covariates[job.timepoint]
+    if job.test == "ancova":
+        return batched_ancova(
+            table,
+            dv=value,
+            between=factors[job.timepoint],
+            covar=covar,
+            by=by,
+            unit=unit,
+        )
+    return batched_partial_corr(
+        table,
+        x=value,
+        y=scores[job.timepoint],
+        covar=covar,
+        by=by,
+        unit=unit,
+        min_n=4 if baseline else 3,
+    )
+
+
+def significance_accumulator(
+    job: Job, alpha: float = 0.05, median: bool = False
+) -> SignificanceAccumulator:
+    """
+    Accumulator of the per-region significance table of a fuzzy job.
+    """
+    return SignificanceAccumulator(
+        job.statistic,
+        by=["region"] + (["hemisphere"] if job.hemisphere else []),
+        alpha=alpha,
+        count_column=_count_columns[job.timepoint],
+        median=median,
+    )
+
+
+def compute_significance(
+    results: pd.DataFrame, job: Job, alpha: float = 0.05, median: bool = False
+) -> pd.DataFrame:
+    """
+    Aggregate the results of the repetitions per region (and hemisphere).
+    """
+    if results.empty:
+        return pd.DataFrame()
+    return significance_accumulator(job, alpha, median).update(results).summary()
+
+
+def _repetition_chunks(wide: pd.DataFrame, chunk_size: int | None):
+    """Rows of `wide` by chunks of `chunk_size` repetitions."""
+    repetitions = pd.unique(wide["repetition"])
+    if chunk_size is None or len(repetitions) <= chunk_size:
+        yield wide
+        return
+    for start in range(0, len(repetitions), chunk_size):
+        yield wide[wide["repetition"].isin(repetitions[start : start + chunk_size])]
+
+
+def _ieee_columns(results: pd.DataFrame, job: Job) -> pd.DataFrame:
+    """Per-region columns of the IEEE notebooks, lh regions first."""
+    hemi = ["hemisphere"] if job.hemisphere else []
+    results = results.sort_values(hemi, kind="stable") if hemi else results
+    if job.test == "ancova":
+        return results.rename(columns={"p-val": "pval"})[hemi + ["region", "F", "pval"]]
+    return results[["region"] + hemi + ["r", "p-val", "n"]]
+
+
+def run_job(
+    job: Job,
+    wide: pd.DataFrame,
+    cohort: pd.DataFrame,
+    data_dir: Path,
+    results_dir: Path,
+    alpha: float = 0.05,
+    cache_dir: Path | None = None,
+    chunk_size: int | None = None,
+    median: bool = False,
+) -> dict:
+    """
+    Run one job and write its outputs; returns its timing record.
+
+    Fuzzy jobs are run over chunks of `chunk_size` repetitions (all at once
+    by default).
+    """
+    start = time.perf_counter()
+    if job.test == "partial_correlation":
+        cohort = cohort[cohort["dx_group"] == "PD-non-MCI"]
+
+    def compute(wide: pd.DataFrame) -> pd.DataFrame:
+        if job.timepoint == "baseline":
+            table = baseline_table(wide, cohort, job.metric)
+        else:
+            table = change_table(wide, cohort, job.metric)
+        return run_test(table, job)
+
+    def results_of(wide: pd.DataFrame) -> pd.DataFrame:
+        if cache_dir is None:
+            return compute(wide)
+        return ResultCache(cache_dir).cached(
+            f"{job.flavor}_{job.name}",
+            lambda: compute(wide),
+            job=job,
+            wide=wide,
+            cohort=cohort,
+        )
+
+    if job.flavor == "fuzzy":
+        parquet = Path(data_dir) / job.test / f"{job.name}.parquet"
+        parquet.parent.mkdir(parents=True, exist_ok=True)
+        significance = significance_accumulator(job, alpha, median)
+        rows = 0
+        writer = None
+        for chunk in _repetition_chunks(wide, chunk_size):
+            results = results_of(chunk)
+            table = pa.Table.from_pandas(results, preserve_index=False)
+            writer = writer or pq.ParquetWriter(parquet, table.schema)
+            writer.write_table(table)
+            significance.update(results)
+            rows += len(results)
+        writer.close()
+        output = Path(results_dir) / job.test / f"{job.name}_stats.csv"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        significance.summary().to_csv(output, index=False)
+    else:
+        results = results_of(wide)
+        rows = len(results)
+        output = Path(results_dir) / f"{job.test}_ieee" / f"{job.name}.csv"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        _ieee_columns(results, job).to_csv(output, index=False)
+
+    return {
+        "step": "run",
+        "flavor": job.flavor,
+        "job": job.name,
+        "rows": rows,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_jobs(
+    jobs: list[Job],
+    cohort: pd.DataFrame,
+    stats_dir: Path,
+    ieee_dir: Path,
+    data_dir: Path,
+    results_dir: Path,
+    alpha: float = 0.05,
+    n_jobs: int = -1,
+    verbose: int = 0,
+    cache_dir: Path | None = None,
+    chunk_size: int | None = None,
+    median: bool = False,
+) -> pd.DataFrame:
+    """
+    Load the inputs of `jobs` once and run the jobs on a process pool.
+
+    Returns
+    -------
+    DataFrame
+        Wall time of every load and job:
+        ['step', 'flavor', 'job', 'rows', 'seconds'].
+    """
+    inputs = {}
+    timings = []
+    for flavor, metric in dict.fromkeys((job.flavor, job.metric) for job in jobs):
+        start = time.perf_counter()
+        if flavor == "fuzzy":
+            inputs[(flavor, metric)] = read_fuzzy(metric, stats_dir, cohort)
+        else:
+            inputs[(flavor, metric)] = read_ieee(metric, ieee_dir)
+        timings.append(
+            {
+                "step": "load",
+                "flavor": flavor,
+                "job": metric,
+                "rows": len(inputs[(flavor, metric)]),
+                "seconds": time.perf_counter() - start,
+            }
+        )
+
+    timings += joblib.Parallel(n_jobs=n_jobs, verbose=verbose)(
+        joblib.delayed(run_job)(
+            job,
+            inputs[(job.flavor, job.metric)],
+            cohort,
+            data_dir,
+            results_dir,
+            alpha,
+            cache_dir,
+            chunk_size,
+            median,
+        )
+        for job in jobs
+    )
+    return pd.DataFrame(timings)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run the longitudinal ANCOVA and partial correlations"
+    )
+    parser.add_argument(
+        "--cohort",
+        default="cohort/longitudinal_cohort_qced.csv",
+        help="Longitudinal cohort CSV",
+    )
+    parser.add_argument(
+        "--stats-dir", default="stats_QCed/sampled", help="Sampled fuzzy tables"
+    )
+    parser.add_argument("--ieee-dir", default="table_ieee", help="IEEE TSV tables")
+    parser.add_argument(
+        "--data-dir", default="data", help="Output directory of the fuzzy results"
+    )
+    parser.add_argument(
+        "--results-dir",
+        default="results/longitudinal",
+        help="Output directory of the significance and IEEE tables",
+    )
+    parser.add_argument("--metrics", nargs="+", choices=list(metrics))
+    parser.add_argument("--tests", nargs="+", choices=tests)
+    parser.add_argument("--timepoints", nargs="+", choices=timepoints)
+    parser.add_argument("--flavors", nargs="+", choices=flavors)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--cache-dir", help="Cache of the test results")
+    parser.add_argument(
+        "--chunk-repetitions",
+        type=int,
+        help="Number of fuzzy repetitions tested at once (default: all)",
+    )
+    parser.add_argument(
+        "--median",
+        action="store_true",
+        help="Add the median statistic and p-value to the significance tables",
+    )
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Number of processes")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    jobs = job_matrix(args.metrics, args.tests, args.timepoints, args.flavors)
+    start = time.perf_counter()
+    timings = run_jobs(
+        jobs,
+        cohort=load_cohort(args.cohort),
+        stats_dir=Path(args.stats_dir),
+        ieee_dir=Path(args.ieee_dir),
+        data_dir=Path(args.data_dir),
+        results_dir=Path(args.results_dir),
+        alpha=args.alpha,
+        n_jobs=args.n_jobs,
+        verbose=10,
+        cache_dir=Path(args.cache_dir) if args.cache_dir else None,
+        chunk_size=args.chunk_repetitions,
+        median=args.median,
+    )
+    print(timings.sort_values("seconds", ascending=False).to_string(index=False))
+    print(f"{len(jobs)} jobs in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Ingestion manifest of the stats files already parsed into the raw tables.
+
+One row per (table, repetition, subject_visit, stats_file) with the file
+mtime, size and sha1, so that a run rebuilding some of the tables only
+records the stats files of these tables. A file is re-parsed for a table
+only when it is new to the table, or when its mtime/size changed *and* its
+content hash differs from the recorded one.
+"""
+
+from hashlib import sha1
+from pathlib import Path
+
+import pandas as pd
+
+manifest_filename = "manifest.parquet"
+
+_keys = ["table", "repetition", "subject_visit", "stats_file"]
+_file_keys = _keys[1:]
+_columns = _keys + ["mtime_ns", "size", "sha1"]
+
+
+def file_hash(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    digest = sha1()
+    with open(path, "rb") as fi:
+        for chunk in iter(lambda: fi.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(files: list[tuple[int, str, str, Path]]) -> pd.DataFrame:
+    """
+    Stat the (repetition, subject_visit, stats_file, path) files.
+
+    Hashes are not computed here; see `changed_files`.
+    """
+    rows = []
+    for repetition, subject_visit, stats_file, path in files:
+        stat = Path(path).stat()
+        rows.append(
+            (
+                repetition,
+                subject_visit,
+                stats_file,
+                str(path),
+                stat.st_mtime_ns,
+                stat.st_size,
+            )
+        )
+    return pd.DataFrame(rows, columns=_file_keys + ["path", "mtime_ns", "size"])
+
+
+def table_fingerprint(
+    current: pd.DataFrame, table_files: dict[str, list[str]]
+) -> pd.DataFrame:
+    """
+    One row of the `fingerprint` of a file per table read from it, e.g.
+    `{"thickness": ["lh.aparc.stats", "rh.aparc.stats"]}`.
+    """
+    pairs = pd.DataFrame(
+        [(table, f) for table, files in table_files.items() for f in files],
+        columns=["table", "stats_file"],
+    )
+    return pairs.merge(current, on="stats_file")[_keys + ["path", "mtime_ns", "size"]]
+
+
+def empty_manifest() -> pd.DataFrame:
+    dtypes = {"repetition": "int64", "mtime_ns": "int64", "size": "int64"}
+    return pd.DataFrame({c: pd.Series(dtype=dtypes.get(c, object)) for c in _columns})
+
+
+def load_manifest(output_dir: Path) -> pd.DataFrame:
+    path = Path(output_dir) / manifest_filename
+    if not path.exists():
+        return empty_manifest()
+    manifest = pd.read_parquet(path)
+    if "table" not in manifest:
+        # manifest without tables: every file is parsed again
+        return empty_manifest()
+    return manifest
+
+
+def save_manifest(manifest: pd.DataFrame, output_dir: Path) -> None:
+    path = Path(output_dir) / manifest_filename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    manifest = manifest[_columns].sort_values(_keys).reset_index(drop=True)
+    manifest.to_parquet(path)
+
+
+def changed_files(
+    current: pd.DataFrame, manifest: pd.DataFrame
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Compare the current fingerprints (`table_fingerprint`) with the manifest.
+
+    Entries of the manifest that are not in `current` (other tables, files
+    no longer on disk) are kept.
+
+    Returns
+    -------
+    changed : DataFrame
+        Files to parse (new, or modified content), with their sha1.
+    manifest : DataFrame
+        Updated manifest including the changed files and refreshed
+        mtime/size for touched-but-identical files.
+    """
+    merged = current.merge(
+        manifest[_columns], on=_keys, how="left", suffixes=("", "_manifest")
+    )
+    is_new = merged["sha1"].isna()
+    is_touched = ~is_new & (
+        (merged["mtime_ns"] != merged["mtime_ns_manifest"])
+        | (merged["size"] != merged["size_manifest"])
+    )
+
+    to_hash = is_new | is_touched
+    merged["sha1_current"] = merged["sha1"]
+    # a file read by several tables is hashed once
+    hashes = {path: file_hash(path) for path in merged.loc[to_hash, "path"].unique()}
+    merged.loc[to_hash, "sha1_current"] = merged.loc[to_hash, "path"].map(hashes)
+    is_changed = is_new | (is_touched & (merged["sha1_current"] != merged["sha1"]))
+
+    merged["sha1"] = merged["sha1_current"]
+    changed = merged.loc[is_changed, _keys + ["path", "mtime_ns", "size", "sha1"]]
+
+    # Keep entries of files no longer on disk: their rows stay in the raw tables
+    seen = manifest.merge(current[_keys], on=_keys, how="left", indicator=True)
+    kept = seen.loc[seen["_merge"] == "left_only", _columns]
+    updated = pd.concat([kept, merged[_columns]], ignore_index=True)
+    return changed.reset_index(drop=True), updated
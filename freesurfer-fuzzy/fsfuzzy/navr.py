@@ -0,0 +1,647 @@
+"""
+Numerical-anatomical variability ratio (NAVR) of every metric, population
+and timepoint of the `notebooks/npv` notebooks, from
+[repetition, subject, (hemisphere,) region] arrays.
+
+For a population of subject-visits (or of subjects, for the relative change
+between visits) and per region[, hemisphere]:
+- numerical variance: variance over repetitions within a subject, averaged
+  over subjects;
+- anatomical variance: variance over subjects within a repetition, averaged
+  over repetitions;
+- NAVR = sqrt(numerical) / sqrt(anatomical), with the F-distribution CI of
+  `_add_navr_ci`:
+
+      df1 = n (k - 1),  df2 = k (n - 1)
+      CI = [NAVR / sqrt(F_{1 - alpha/2}), NAVR / sqrt(F_{alpha/2})]
+
+Each metric is loaded once as a `fsfuzzy.cube.RepetitionCube`. Both
+variances come from one pass over the values shifted by a per-region
+reference, using the count, sum and sum of squares along the repetition
+axis (numerical) and the subject axis (anatomical). The subject sums of a
+population (`VariabilitySums`) are additive, so the union of disjoint
+populations (HC + PD, baseline + follow-up) is the sum of their statistics
+instead of a new pass over the data.
+
+Usage:
+    python -m fsfuzzy.navr --cohort cohort/longitudinal_cohort_qced.csv \
+        --stats-dir stats_QCed/sampled --csv-dir navr/csv_all
+
+writes the `navr_*.csv` tables of the four npv notebooks.
+"""
+
+import argparse
+import time
+import warnings
+from dataclasses import dataclass, fields
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.stats import f
+
+from fsfuzzy.cube import RepetitionCube, build_cube, load_current
+from fsfuzzy.partitioned import read_measurements, read_schema
+
+metrics = ("thickness", "area", "volume", "subcortical_volume")
+groups = {"hc": "HC", "pd": "PD-non-MCI"}
+
+_bilateral_indicators = ["Left", "Right", "lh", "rh"]
+navr_columns = ["NAVR", "NAVR_CI_low", "NAVR_CI_high"]
+
+
+def is_bilateral_column(column: str) -> bool:
+    return any(indicator in column for indicator in _bilateral_indicators)
+
+
+def _bilateral_name(column: str) -> str:
+    for token in _bilateral_indicators + ["_", "-"]:
+        column = column.replace(token, "")
+    return column
+
+
+def read_cube(
+    dataset_dir: Path, metric: str, cube_dir: Path | None = None
+) -> RepetitionCube:
+    """
+    Cube of one metric of the partitioned dataset, with the repetition
+    ranks of the notebooks (`groupby(...).cumcount()`).
+
+    With `cube_dir`, the cube saved there by `fsfuzzy.cube.build_cubes` from
+    the `<metric>.parquet` table next to `dataset_dir` is memory-mapped
+    instead, unless it is missing or older than the table.
+    """
+    if cube_dir is not None:
+        source = Path(dataset_dir).parent / f"{metric}.parquet"
+        cube = load_current(Path(cube_dir) / metric, source)
+        if cube is not None:
+            return cube
+    hemi = ["hemi"] if "hemi" in read_schema(dataset_dir, metric).names else []
+    wide = read_measurements(
+        dataset_dir, metric, id_columns=["subject_visit", "repetition"] + hemi
+    )
+    return build_cube(wide, metric)
+
+
+def region_values(
+    cube: RepetitionCube, bilateral: bool = False
+) -> tuple[np.ndarray, list[str]]:
+    """
+    Values [repetition, subject_visit, hemisphere, region] and region names.
+
+    With `bilateral`, the columns naming a side (Left, Right, lh, rh) are
+    summed into one region named without the side, as in the notebooks.
+    """
+    columns = cube.regions["column"].tolist()
+    names = cube.regions["region"].tolist()
+    if not bilateral or not any(map(is_bilateral_column, columns)):
+        return cube.values, names
+
+    merged = {}
+    for index, (column, name) in enumerate(zip(columns, names)):
+        if is_bilateral_column(column):
+            name = _bilateral_name(column).replace(f"_{cube.metric}", "")
+        merged.setdefault(name, []).append(index)
+    values = np.stack(
+        [cube.values[..., indices].sum(axis=-1) for indices in merged.values()],
+        axis=-1,
+    )
+    return values, list(merged)
+
+
+def variance_from_sums(
+    count: np.ndarray, total: np.ndarray, squares: np.ndarray
+) -> np.ndarray:
+    """Sample variance from count, sum and sum of squares (NaN if count < 2)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (squares - total**2 / count) / (count - 1)
+    return np.where(count > 1, np.maximum(variance, 0.0), np.nan)
+
+
+@dataclass
+class VariabilitySums:
+    """
+    Additive statistics of one population, per [hemisphere, region].
+
+    Attributes
+    ----------
+    num_sum, num_count : ndarray, shape (n_hemispheres, n_regions)
+        Sum of the numerical variances of the subjects and number of
+        subjects with a variance (at least two repetitions).
+    count, total, squares : ndarray, shape (n_repetitions, n_hemispheres, n_regions)
+        Number of subjects with a value, sum and sum of squares of the
+        shifted values over the subjects.
+    n : int
+        Subject-visits of the population (degrees of freedom of the CI).
+    """
+
+    num_sum: np.ndarray
+    num_count: np.ndarray
+    count: np.ndarray
+    total: np.ndarray
+    squares: np.ndarray
+    n: int
+
+    def __add__(self, other: "VariabilitySums") -> "VariabilitySums":
+        return VariabilitySums(
+            **{
+                field.name: getattr(self, field.name) + getattr(other, field.name)
+                for field in fields(self)
+            }
+        )
+
+    def std(self, pool_hemispheres: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Numerical and anatomical standard deviations, i.e. the square root
+        of the mean variance, per [hemisphere, region] (per region when
+        `pool_hemispheres`).
+        """
+        anat = variance_from_sums(self.count, self.total, self.squares)
+        anat_valid = ~np.isnan(anat)
+        anat_sum = np.where(anat_valid, anat, 0.0).sum(axis=0)
+        anat_count = anat_valid.sum(axis=0)
+        num_sum, num_count = self.num_sum, self.num_count
+        if pool_hemispheres:
+            num_sum, num_count = num_sum.sum(axis=0), num_count.sum(axis=0)
+            anat_sum, anat_count = anat_sum.sum(axis=0), anat_count.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.sqrt(num_sum / num_count), np.sqrt(anat_sum / anat_count)
+
+
+def population_sums(values: np.ndarray, shift: np.ndarray, n: int) -> VariabilitySums:
+    """
+    Statistics of the subjects of `values` [repetition, subject, hemisphere,
+    region]; NaN values are skipped, as by `groupby().var()`.
+
+    `shift` [hemisphere, region] is subtracted before summing squares to
+    limit cancellation; it must be the same for populations that are added.
+    """
+    shifted = values - shift
+    valid = ~np.isnan(shifted)
+    shifted = np.where(valid, shifted, 0.0)
+    squared = shifted * shifted
+    num = variance_from_sums(
+        valid.sum(axis=0), shifted.sum(axis=0), squared.sum(axis=0)
+    )
+    num_valid = ~np.isnan(num)
+    return VariabilitySums(
+        num_sum=np.where(num_valid, num, 0.0).sum(axis=0),
+        num_count=num_valid.sum(axis=0),
+        count=valid.sum(axis=1),
+        total=shifted.sum(axis=1),
+        squares=squared.sum(axis=1),
+        n=n,
+    )
+
+
+def bootstrap_std(
+    values: np.ndarray,
+    shift: np.ndarray,
+    n_resamples: int,
+    rng: np.random.Generator,
+    pool_hemispheres: bool = False,
+    batch: int = 64,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Numerical and anatomical standard deviations of two-level resamples.
+
+    Each resample draws the subjects and the repetitions of `values`
+    [repetition, subject, hemisphere, region] with replacement, as
+    multinomial weights. The variances of the resample are weighted sums of
+    the per-(repetition, subject) values and squares:
+    - numerical: the repetition weights give the moments of every subject
+      (one matrix product), and the subject weights their mean;
+    - anatomical: the subject weights give the moments of every
+      repetition, and the repetition weights their mean.
+    With unit weights, the result is `population_sums(...).std()`. Draws do
+    not depend on `batch`, which only bounds memory.
+
+    Returns
+    -------
+    num, anat : ndarray, shape (n_resamples, [n_hemispheres,] n_regions)
+    """
+    n_repetitions, n_subjects = values.shape[:2]
+    shape = values.shape[2:]
+    shifted = (values - shift).reshape(n_repetitions, n_subjects, -1)
+    valid = ~np.isnan(shifted)
+    shifted = np.where(valid, shifted, 0.0)
+    moments = (valid.astype(np.float64), shifted, shifted * shifted)
+    by_subject = [m.transpose(1, 0, 2) for m in moments]
+
+    rep_weights = rng.multinomial(
+        n_repetitions, np.full(n_repetitions, 1 / n_repetitions), size=n_resamples
+    ).astype(np.float64)
+    subject_weights = rng.multinomial(
+        n_subjects, np.full(n_subjects, 1 / n_subjects), size=n_resamples
+    ).astype(np.float64)
+
+    num, anat = [], []
+    for start in range(0, n_resamples, batch):
+        v = rep_weights[start : start + batch]
+        w = subject_weights[start : start + batch]
+        # variance over the repetitions of each subject: (batch, subject, feature)
+        var = variance_from_sums(*(np.tensordot(v, m, axes=(1, 0)) for m in moments))
+        ok = ~np.isnan(var)
+        num_sum = np.einsum("bs,bsf->bf", w, np.where(ok, var, 0.0))
+        num_count = np.einsum("bs,bsf->bf", w, ok)
+        # variance over the subjects of each repetition: (batch, repetition, feature)
+        var = variance_from_sums(*(np.tensordot(w, m, axes=(1, 0)) for m in by_subject))
+        ok = ~np.isnan(var)
+        anat_sum = np.einsum("br,brf->bf", v, np.where(ok, var, 0.0))
+        anat_count = np.einsum("br,brf->bf", v, ok)
+
+        sums = [
+            x.reshape((len(v),) + shape)
+            for x in (num_sum, num_count, anat_sum, anat_count)
+        ]
+        if pool_hemispheres:
+            sums = [x.sum(axis=1) for x in sums]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            num.append(np.sqrt(sums[0] / sums[1]))
+            anat.append(np.sqrt(sums[2] / sums[3]))
+    return np.concatenate(num), np.concatenate(anat)
+
+
+def bootstrap_ci(
+    values: np.ndarray,
+    shift: np.ndarray,
+    n_resamples: int,
+    rng: np.random.Generator,
+    alpha: float = 0.05,
+    pool_hemispheres: bool = False,
+    method: str = "percentile",
+    batch: int = 64,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (1 - alpha) CI of NAVR over the resamples of `bootstrap_std`, per
+    [hemisphere, region] (per region when `pool_hemispheres`).
+
+    "percentile" gives the quantiles of the resampled NAVR; "basic"
+    reflects them around the estimate (2 NAVR - upper quantile,
+    2 NAVR - lower quantile), which compensates the bias of the resamples
+    when duplicated subjects and repetitions shrink their variances.
+    """
+    if method not in ("percentile", "basic"):
+        raise ValueError(f"Unknown method: {method}")
+    num, anat = bootstrap_std(
+        values, shift, n_resamples, rng, pool_hemispheres=pool_hemispheres, batch=batch
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        navr = num / anat
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low, high = np.nanquantile(navr, [alpha / 2.0, 1 - alpha / 2.0], axis=0)
+    if method == "percentile":
+        return low, high
+    sums = population_sums(values, shift, values.shape[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        estimate = np.divide(*sums.std(pool_hemispheres))
+    return 2 * estimate - high, 2 * estimate - low
+
+
+def reference_shift(values: np.ndarray) -> np.ndarray:
+    """Mean over subjects of the first repetition, 0 where missing."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        shift = np.nanmean(values[0], axis=0)
+    return np.nan_to_num(shift)
+
+
+def relative_change(
+    values: np.ndarray, cube: RepetitionCube, baseline, followup
+) -> np.ndarray:
+    """
+    (follow-up - baseline) / baseline of the subjects with both visits,
+    [repetition, subject, hemisphere, region].
+
+    Raises
+    ------
+    ValueError
+        If a subject has several visits in `baseline` or `followup`.
+    """
+    subjects = cube.subjects.set_index("subject_visit")["subject"]
+    visits = [
+        pd.DataFrame({"subject_visit": list(visits)}).assign(
+            subject=lambda df: subjects.loc[df["subject_visit"]].to_numpy()
+        )
+        for visits in (baseline, followup)
+    ]
+    for visit in visits:
+        if visit["subject"].duplicated().any():
+            raise ValueError("Several visits per subject")
+    pairs = visits[0].merge(visits[1], on="subject", suffixes=("_baseline", ""))
+    t1 = values[:, cube.subject_codes(pairs["subject_visit_baseline"])]
+    t2 = values[:, cube.subject_codes(pairs["subject_visit"])]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (t2 - t1) / t1
+
+
+def navr_table(
+    sums: VariabilitySums,
+    regions: list[str],
+    hemispheres: list,
+    timepoint: str,
+    pool_hemispheres: bool = False,
+    k: int = 26,
+    alpha: float = 0.05,
+    bootstrap: tuple[np.ndarray, np.ndarray] | None = None,
+) -> pd.DataFrame:
+    """
+    NAVR table of the notebooks: region[, hemisphere], NAVR, num, anat, n,
+    timepoint, NAVR_CI_low, NAVR_CI_high, sorted by region[, hemisphere].
+
+    Cortical tables pooled over hemispheres keep an empty hemisphere column.
+    `bootstrap` (`bootstrap_ci`) adds NAVR_boot_low and NAVR_boot_high.
+    """
+    num, anat = (std.reshape(-1) for std in sums.std(pool_hemispheres))
+    cortical = hemispheres != [None]
+    if pool_hemispheres or not cortical:
+        table = pd.DataFrame({"region": regions})
+    else:
+        table = pd.DataFrame(
+            {
+                "region": np.tile(np.asarray(regions, dtype=object), len(hemispheres)),
+                "hemisphere": np.repeat(
+                    np.asarray(hemispheres, dtype=object), len(regions)
+                ),
+            }
+        )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        table["NAVR"] = num / anat
+    table["num"] = num
+    table["anat"] = anat
+    table["n"] = sums.n
+    table["timepoint"] = timepoint
+    if cortical and pool_hemispheres:
+        table["hemisphere"] = np.nan
+
+    df1 = sums.n * (k - 1)
+    df2 = k * (sums.n - 1)
+    table["NAVR_CI_low"] = table["NAVR"] / np.sqrt(f.ppf(1 - alpha / 2.0, df1, df2))
+    table["NAVR_CI_high"] = table["NAVR"] / np.sqrt(f.ppf(alpha / 2.0, df1, df2))
+    if bootstrap is not None:
+        table["NAVR_boot_low"] = bootstrap[0].reshape(-1)
+        table["NAVR_boot_high"] = bootstrap[1].reshape(-1)
+    by = ["region"] + (["hemisphere"] if cortical and not pool_hemispheres else [])
+    return table.sort_values(by, ignore_index=True)
+
+
+def csv_filename(
+    metric: str, name: str, bilateral: bool, change: bool, timepoint: str
+) -> str:
+    """`navr_<name>[_<timepoint>]_<metric>[_bilateral][_longitudinal].csv`"""
+    parts = [f"navr_{name}"]
+    if timepoint:
+        parts.append(timepoint)
+    parts.append(metric)
+    if bilateral:
+        parts.append("bilateral")
+    if change:
+        parts.append("longitudinal")
+    return "_".join(parts) + ".csv"
+
+
+def read_navr(navr_dir: Path, metric: str, timepoint: str) -> pd.DataFrame:
+    """
+    HC-PD NAVR table of the notebooks at a timepoint ("longitudinal" for the
+    relative change between visits): region[, hemisphere] and `navr_columns`.
+    """
+    longitudinal = timepoint == "longitudinal"
+    filename = csv_filename(
+        metric,
+        "hc-pd",
+        bilateral=False,
+        change=longitudinal,
+        timepoint=None if longitudinal else timepoint,
+    )
+    navr = pd.read_csv(Path(navr_dir) / filename)
+    by = ["region"] + (["hemisphere"] if metric != "subcortical_volume" else [])
+    return navr[by + navr_columns]
+
+
+def load_cohort(path: str | Path) -> pd.DataFrame:
+    """Cohort of the npv notebooks: visit pairs with distinct visits."""
+    cohort = pd.read_csv(path)
+    return cohort[cohort["first_visit"] != cohort["second_visit"]]
+
+
+def populations(cube: RepetitionCube, cohort: pd.DataFrame) -> dict:
+    """
+    Subject-visits of the cube per (group, visit), e.g. ("hc", "first").
+    """
+    subject_visits = pd.Index(cube.subjects["subject_visit"])
+    out = {}
+    for name, dx_group in groups.items():
+        rows = cohort[cohort["dx_group"] == dx_group]
+        for visit in ("first", "second"):
+            visits = pd.Index(pd.unique(rows[f"{visit}_visit"]))
+            out[(name, visit)] = visits[visits.isin(subject_visits)].to_numpy()
+    return out
+
+
+def metric_navr(
+    cube: RepetitionCube,
+    cohort: pd.DataFrame,
+    k: int | None = None,
+    alpha: float = 0.05,
+    n_resamples: int = 0,
+    seed: int = 0,
+    method: str = "percentile",
+) -> dict[str, pd.DataFrame]:
+    """
+    All NAVR tables of one metric, keyed by their csv file name.
+
+    For the regional and bilateral layouts:
+    - HC and PD, baseline and follow-up visits and both visits together;
+    - HC, PD and HC + PD at the baseline, and at the follow-up;
+    - HC, PD and HC + PD for the relative change between the visits.
+
+    `k` (CI degrees of freedom) defaults to the number of repetitions.
+    With `n_resamples`, the tables get the bootstrap CI of `bootstrap_ci`,
+    each table from its own stream of `SeedSequence(seed)`.
+    """
+    k = cube.shape[0] if k is None else k
+    pops = populations(cube, cohort)
+    streams = np.random.SeedSequence(seed)
+    tables = {}
+    for bilateral in (False, True):
+        values, regions = region_values(cube, bilateral)
+        shift = reference_shift(values)
+        sums = {
+            key: population_sums(
+                values[:, cube.subject_codes(visits)], shift, len(visits)
+            )
+            for key, visits in pops.items()
+        }
+
+        def visit_values(*keys):
+            visits = pd.unique(np.concatenate([pops[key] for key in keys]))
+            return values[:, cube.subject_codes(visits)]
+
+        def union(a, b):
+            # sums of overlapping populations are recomputed on the distinct
+            # subject-visits; n still counts both, as in the notebooks
+            n = len(pops[a]) + len(pops[b])
+            if np.intersect1d(pops[a], pops[b]).size == 0:
+                return sums[a] + sums[b]
+            return population_sums(visit_values(a, b), shift, n)
+
+        def add(
+            name,
+            timepoint,
+            pop_sums,
+            pop_values,
+            change=False,
+            label=None,
+            pop_shift=shift,
+        ):
+            bootstrap = None
+            if n_resamples:
+                rng = np.random.default_rng(streams.spawn(1)[0])
+                bootstrap = bootstrap_ci(
+                    pop_values(),
+                    pop_shift,
+                    n_resamples,
+                    rng,
+                    alpha=alpha,
+                    pool_hemispheres=bilateral,
+                    method=method,
+                )
+            filename = csv_filename(cube.metric, name, bilateral, change, timepoint)
+            tables[filename] = navr_table(
+                pop_sums,
+                regions,
+                cube.hemispheres,
+                label or name,
+                pool_hemispheres=bilateral,
+                k=k,
+                alpha=alpha,
+                bootstrap=bootstrap,
+            )
+
+        # HC and PD: baseline, follow-up and both visits
+        for name in groups:
+            first, second = (name, "first"), (name, "second")
+            add(f"{name}_baseline", "", sums[first], lambda: visit_values(first))
+            add(f"{name}_followup", "", sums[second], lambda: visit_values(second))
+            add(
+                f"{name}_baseline-{name}_followup",
+                "",
+                union(first, second),
+                lambda: visit_values(first, second),
+                label=f"{name}_baseline & {name}_followup",
+            )
+        # HC, PD and HC + PD at each visit
+        for visit, timepoint in (("first", "baseline"), ("second", "followup")):
+            hc, pd_ = ("hc", visit), ("pd", visit)
+            add("hc", timepoint, sums[hc], lambda: visit_values(hc))
+            add("pd", timepoint, sums[pd_], lambda: visit_values(pd_))
+            add(
+                "hc-pd",
+                timepoint,
+                union(hc, pd_),
+                lambda: visit_values(hc, pd_),
+                label="hc & pd",
+            )
+
+        # Relative change between the visits
+        change = {
+            name: relative_change(
+                values, cube, pops[(name, "first")], pops[(name, "second")]
+            )
+            for name in groups
+        }
+        change_shift = reference_shift(np.concatenate(list(change.values()), axis=1))
+        change_sums = {
+            name: population_sums(
+                change[name],
+                change_shift,
+                len(pops[(name, "first")]) + len(pops[(name, "second")]),
+            )
+            for name in groups
+        }
+        for name in groups:
+            add(
+                name,
+                "",
+                change_sums[name],
+                lambda: change[name],
+                change=True,
+                pop_shift=change_shift,
+            )
+        add(
+            "hc-pd",
+            "",
+            change_sums["hc"] + change_sums["pd"],
+            lambda: np.concatenate([change["hc"], change["pd"]], axis=1),
+            change=True,
+            label="hc & pd",
+            pop_shift=change_shift,
+        )
+    return tables
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="NAVR tables of every metric, population and timepoint"
+    )
+    parser.add_argument(
+        "--cohort",
+        default="cohort/longitudinal_cohort_qced.csv",
+        help="Longitudinal cohort CSV",
+    )
+    parser.add_argument(
+        "--stats-dir", default="stats_QCed/sampled", help="Sampled fuzzy tables"
+    )
+    parser.add_argument("--csv-dir", default="navr/csv_all", help="Output directory")
+    parser.add_argument(
+        "--cube-dir",
+        default="stats_QCed/cube",
+        help="Cubes of fsfuzzy.cube.build_cubes, memory-mapped when built from "
+        "the --stats-dir tables (default: stats_QCed/cube)",
+    )
+    parser.add_argument("--metrics", nargs="+", choices=metrics, default=metrics)
+    parser.add_argument(
+        "--k", type=int, help="Repetitions of the CI (default: from the data)"
+    )
+    parser.add_argument("--alpha", type=float, default=0.05, help="CI level")
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        default=0,
+        help="Subject and repetition resamples of the bootstrap CI (default: none)",
+    )
+    parser.add_argument(
+        "--bootstrap-method", choices=["percentile", "basic"], default="percentile"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Bootstrap seed")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cohort = load_cohort(args.cohort)
+    csv_dir = Path(args.csv_dir)
+    csv_dir.mkdir(parents=True, exist_ok=True)
+    for metric in args.metrics:
+        start = time.perf_counter()
+        cube = read_cube(Path(args.stats_dir) / "partitioned", metric, args.cube_dir)
+        tables = metric_navr(
+            cube,
+            cohort,
+            k=args.k,
+            alpha=args.alpha,
+            n_resamples=args.bootstrap,
+            seed=args.seed,
+            method=args.bootstrap_method,
+        )
+        for filename, table in tables.items():
+            table.to_csv(csv_dir / filename, index=False)
+        print(
+            f"{metric}: {len(tables)} tables, cube {cube.shape}, "
+            f"{time.perf_counter() - start:.1f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Batched Pearson partial correlation.
+
+Replaces one `pg.partial_corr(data, x, y, covar)` call per
+(repetition, region[, hemisphere]) by one projection per set of valid
+units: the metric of every test and the shared clinical score (UPDRS or
+UPDRS_change) are residualized together against [1, covariates] with a
+single least-squares solve, then r is the column-wise correlation of the
+residuals:
+
+    r = <e_x, e_y> / (|e_x| |e_y|)
+    t = r * sqrt((n - 2 - k) / (1 - r^2)),  p = 2 * sf(|t|, n - 2 - k)
+
+which is the partial correlation and two-sided p-value of pingouin.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from fsfuzzy.batching import has_constant, pivot_tests, unit_columns, valid_patterns
+
+result_columns = ["r", "p-val", "n"]
+
+
+def partial_corr_matrix(
+    X: np.ndarray,
+    y: np.ndarray,
+    covariates: np.ndarray,
+    min_n: int = 3,
+) -> pd.DataFrame:
+    """
+    Partial correlation of every column of X with y given `covariates`.
+
+    Parameters
+    ----------
+    X : ndarray, shape (n_units, n_tests)
+        Metric per unit and test; NaN excludes the unit for that test only.
+    y : ndarray, shape (n_units,)
+        Score shared by all tests. NaN excludes the unit.
+    covariates : ndarray, shape (n_units, n_covariates)
+        NaN excludes the unit.
+    min_n : int
+        Tests with fewer valid units, or with a constant x, y or covariate,
+        get NaN r and p-val.
+
+    Returns
+    -------
+    DataFrame
+        One row per column of X with `r`, `p-val` and `n`.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    covariates = np.asarray(covariates, dtype=np.float64)
+    if covariates.ndim == 1:
+        covariates = covariates[:, None]
+    k = covariates.shape[1]
+    unit_valid = ~np.isnan(y) & ~np.isnan(covariates).any(axis=1)
+    valid = ~np.isnan(X) & unit_valid[:, None]
+
+    n_tests = X.shape[1]
+    r = np.full(n_tests, np.nan)
+    p = np.full(n_tests, np.nan)
+    n = valid.sum(axis=0)
+
+    for rows, columns in valid_patterns(valid):
+        n_rows = int(rows.sum())
+        dof = n_rows - 2 - k
+        if n_rows < min_n or dof < 1:
+            continue
+        covar = covariates[rows]
+        y_rows = y[rows]
+        if has_constant(np.column_stack([y_rows, covar])):
+            continue
+
+        x_rows = X[np.ix_(rows, columns)]
+        constant = np.ptp(x_rows, axis=0) == 0
+        # Residualize y and every x column with one solve
+        Z = np.column_stack([np.ones(n_rows), covar])
+        stacked = np.column_stack([y_rows, x_rows])
+        beta, *_ = np.linalg.lstsq(Z, stacked, rcond=None)
+        residuals = stacked - Z @ beta
+        e_y, e_x = residuals[:, 0], residuals[:, 1:]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_cols = (e_y @ e_x) / np.sqrt(
+                (e_y @ e_y) * np.einsum("ij,ij->j", e_x, e_x)
+            )
+            r_cols = np.clip(r_cols, -1, 1)
+            t = r_cols * np.sqrt(dof / (1 - r_cols**2))
+        p_cols = 2 * stats.t.sf(np.abs(t), dof)
+        r_cols[constant] = np.nan
+        p_cols[constant] = np.nan
+        r[columns] = r_cols
+        p[columns] = p_cols
+
+    return pd.DataFrame({"r": r, "p-val": p, "n": n})
+
+
+def batched_partial_corr(
+    df: pd.DataFrame,
+    x: str,
+    y: str,
+    covar: list[str],
+    by: list[str],
+    unit: str = "subject_visit",
+    min_n: int = 3,
+) -> pd.DataFrame:
+    """
+    One partial correlation per `by` group of a long-form table.
+
+    Equivalent to::
+
+        df.groupby(by, sort=False).apply(
+            lambda g: pg.partial_corr(g, x=x, y=y, covar=covar, method="pearson")
+        )
+
+    keeping r, p-val and n.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Long-form table with `unit`, `by`, `x`, `y` and `covar` columns.
+        `y` and `covar` must be constant per unit.
+    unit : str
+        Column identifying the observational unit (subject-visit for the
+        baseline, PATNO for the longitudinal change).
+
+    Returns
+    -------
+    DataFrame
+        `by` columns (in order of first appearance) and `r`, `p-val`, `n`.
+    """
+    missing = [c for c in [unit, x, y] + covar + by if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
+
+    X, tests, units = pivot_tests(df, x, by, unit)
+    per_unit = unit_columns(df, unit, [y] + covar, units, numeric=[y] + covar)
+    results = partial_corr_matrix(
+        X,
+        per_unit[y].to_numpy(np.float64),
+        per_unit[covar].to_numpy(np.float64),
+        min_n=min_n,
+    )
+    return pd.concat([tests, results], axis=1)
@@ -0,0 +1,178 @@
+"""
+Hive-partitioned copy of the `stats_QCed/{raw,sampled}` tables.
+
+Layout of `<stats_dir>/partitioned/`:
+
+    metric=<metric>/[hemi=<lh|rh>/]visit=<visit>/repetition=<n>/part-0.parquet
+    metric=<metric>/_common_metadata
+
+Each partition file is sorted by `subject_visit` and split in small row
+groups, so that the parquet min/max statistics prune row groups on
+subject-visit filters. `_common_metadata` keeps the schema of the full
+table (column order and types, including the partition columns).
+
+Readers select partitions and columns with pyarrow dataset filters, e.g.
+only the baseline visits of the left hemisphere, without loading the whole
+metric table.
+"""
+
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from fsfuzzy.cube import meta_columns
+
+dataset_dirname = "partitioned"
+
+_partition_columns = ["hemi", "visit", "repetition"]
+_sort_columns = ["subject_visit", "hemi", "repetition"]
+
+
+def metric_dir(dataset_dir: Path, metric: str) -> Path:
+    return Path(dataset_dir) / f"metric={metric}"
+
+
+def _partitioning(schema: pa.Schema) -> ds.Partitioning:
+    fields = [schema.field(name) for name in _partition_columns if name in schema.names]
+    return ds.partitioning(pa.schema(fields), flavor="hive")
+
+
+def write_metric(
+    df: pd.DataFrame,
+    dataset_dir: Path,
+    metric: str,
+    rows_per_group: int = 128,
+) -> Path:
+    """
+    Write one metric table as a hive-partitioned dataset.
+
+    Existing partitions of the metric are removed first.
+    """
+    root = metric_dir(dataset_dir, metric)
+    table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    keys = [name for name in _sort_columns if name in table.column_names]
+    table = table.sort_by([(name, "ascending") for name in keys])
+
+    if root.exists():
+        shutil.rmtree(root)
+    root.mkdir(parents=True)
+    ds.write_dataset(
+        table,
+        root,
+        format="parquet",
+        partitioning=_partitioning(table.schema),
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_rows_per_group=rows_per_group,
+        min_rows_per_group=rows_per_group,
+    )
+    pq.write_metadata(table.schema, root / "_common_metadata")
+    return root
+
+
+def write_metrics(tables_df: dict, dataset_dir: Path, rows_per_group: int = 128):
+    for metric, df in tables_df.items():
+        write_metric(df, dataset_dir, metric, rows_per_group=rows_per_group)
+
+
+def read_schema(dataset_dir: Path, metric: str) -> pa.Schema:
+    return pq.read_schema(metric_dir(dataset_dir, metric) / "_common_metadata")
+
+
+def measurement_columns(dataset_dir: Path, metric: str) -> list[str]:
+    """
+    Float columns of the metric table that are not metadata, in table order.
+    """
+    schema = read_schema(dataset_dir, metric)
+    return [
+        field.name
+        for field in schema
+        if field.name not in meta_columns and pa.types.is_floating(field.type)
+    ]
+
+
+def _isin(column: str, values) -> pc.Expression:
+    return pc.field(column).isin(pa.array(list(values)))
+
+
+def read_metric(
+    dataset_dir: Path,
+    metric: str,
+    hemi: str | list[str] | None = None,
+    visits: list[str] | None = None,
+    repetitions: list[int] | None = None,
+    subject_visits: list[str] | None = None,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Read a slice of one metric table.
+
+    Parameters
+    ----------
+    dataset_dir : Path
+        `<stats_dir>/partitioned`.
+    metric : str
+        Metric table (thickness, area, volume, subcortical_volume).
+    hemi, visits, repetitions : optional
+        Partitions to read; all when None.
+    subject_visits : list of str, optional
+        Subject-visits to keep; pruned with the row group statistics.
+    columns : list of str, optional
+        Columns to load, in this order; all when None.
+
+    Returns
+    -------
+    DataFrame
+        Rows ordered by subject_visit, hemi and repetition, i.e. the order of
+        the sampled tables, so `groupby(...).cumcount()` gives the same
+        repetition ranks as on the monolithic files.
+    """
+    schema = read_schema(dataset_dir, metric)
+    dataset = ds.dataset(
+        metric_dir(dataset_dir, metric),
+        schema=schema,
+        format="parquet",
+        partitioning=_partitioning(schema),
+    )
+
+    filters = []
+    if hemi is not None:
+        filters.append(_isin("hemi", [hemi] if isinstance(hemi, str) else hemi))
+    if visits is not None:
+        filters.append(_isin("visit", visits))
+    if repetitions is not None:
+        filters.append(_isin("repetition", repetitions))
+    if subject_visits is not None:
+        filters.append(_isin("subject_visit", subject_visits))
+    expression = None
+    for expr in filters:
+        expression = expr if expression is None else expression & expr
+
+    names = schema.names if columns is None else list(columns)
+    keys = [name for name in _sort_columns if name in schema.names]
+    read_columns = names + [name for name in keys if name not in names]
+    table = dataset.to_table(columns=read_columns, filter=expression)
+    table = table.sort_by([(name, "ascending") for name in keys])
+    return table.select(names).to_pandas()
+
+
+def read_measurements(
+    dataset_dir: Path,
+    metric: str,
+    id_columns: list[str],
+    **filters,
+) -> pd.DataFrame:
+    """
+    Read `id_columns` and the measurement columns of one metric table.
+
+    Other metadata columns (subject, visit, dx_group, ...) are not loaded, so
+    a `melt` on `id_columns` only yields region columns. `filters` are
+    passed to `read_metric`.
+    """
+    columns = list(id_columns) + measurement_columns(dataset_dir, metric)
+    return read_metric(dataset_dir, metric, columns=columns, **filters)
@@ -0,0 +1,180 @@
+"""
+Propagation of the numerical variability (NAVR) to test statistics and
+p-values.
+
+Closed forms of the numerical_validation notebooks, vectorized over
+regions and NAVR bounds:
+- spread of the statistic: `std_statistic` (F, t, r, Cohen's d);
+- first-order spread of the p-value: `std_p` (delta method).
+
+Exact spread of the p-value when the statistic is N(t0, sigma^2): the
+mean and standard deviation of p(T) are Gauss-Hermite quadratures,
+
+    E[p^j] = 1/sqrt(pi) sum_i w_i p(t0 + sqrt(2 sigma^2) x_i)^j,
+
+where the nodes x_i and weights w_i of an order are computed once
+(`hermite_nodes`) and all rows are evaluated at all nodes as one
+(rows, order) array through the survival functions of `scipy.special`.
+`adaptive_p_moments` doubles the order of the rows whose standard
+deviation has not converged and returns the error estimate
+|sd(2m) - sd(m)| of each row. p(T) is not smooth at T = 0 (kink of the
+two-sided tests, square root of the F survival function), so the
+convergence is only algebraic for the rows whose statistic is within a
+few sigma of 0; their error is reported rather than hidden.
+"""
+
+from functools import cache
+
+import numpy as np
+import scipy.special
+import scipy.stats
+
+tests = ("F", "t", "r")
+
+
+@cache
+def hermite_nodes(order: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Gauss-Hermite nodes and weights of `order`, weights divided by
+    sqrt(pi) so that they sum to 1 (read-only, shared between calls).
+
+    `scipy.special.roots_hermite` is stable at high orders, unlike
+    `np.polynomial.hermite.hermgauss`; nodes whose weight underflows to 0
+    are dropped.
+    """
+    x, w = scipy.special.roots_hermite(order)
+    x, w = x[w > 0], w[w > 0] / np.sqrt(np.pi)
+    x.flags.writeable = False
+    w.flags.writeable = False
+    return x, w
+
+
+def p_value(statistic, test: str, df) -> np.ndarray:
+    """
+    p-value of a statistic (array-like), with `df` residual degrees of
+    freedom:
+    - "F": F(1, df) survival function, 1 for F <= 0;
+    - "t": two-sided Student t;
+    - "r": two-sided test of a correlation, t = r sqrt(df / (1 - r^2)),
+      0 for |r| >= 1.
+    """
+    statistic = np.asarray(statistic, dtype=np.float64)
+    if test == "F":
+        return np.where(
+            statistic > 0, scipy.special.fdtrc(1, df, np.maximum(statistic, 0)), 1.0
+        )
+    if test == "t":
+        return 2.0 * scipy.special.stdtr(df, -np.abs(statistic))
+    if test == "r":
+        r2 = statistic * statistic
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.sqrt(df * r2 / (1.0 - r2))
+        return np.where(r2 < 1.0, 2.0 * scipy.special.stdtr(df, -t), 0.0)
+    raise ValueError(f"Unknown test: {test} (expected one of {tests})")
+
+
+def std_statistic(test: str, statistic, n, navr) -> np.ndarray:
+    """
+    Spread of the statistic for a NAVR (array-like):
+    - "F": 2 sqrt(F) NAVR;
+    - "t": NAVR;
+    - "r": ((1 - r^2) / (n - 1))^(3/2) NAVR;
+    - "cohen_d": 2 NAVR / sqrt(n).
+    """
+    navr = np.asarray(navr, dtype=np.float64)
+    if test == "F":
+        return 2.0 * np.sqrt(statistic) * navr
+    if test == "t":
+        return navr
+    if test == "r":
+        return np.sqrt(((1 - np.square(statistic)) / (n - 1)) ** 3) * navr
+    if test == "cohen_d":
+        return 2.0 * navr / np.sqrt(n)
+    raise ValueError(f"Unknown test: {test}")
+
+
+def std_p(test: str, statistic, n, navr) -> np.ndarray:
+    """
+    First-order spread of the p-value (df = n - 2, as in the notebooks);
+    NaN for Cohen's d, which has no p-value.
+    """
+    df = np.asarray(n) - 2
+    if test == "F":
+        return 2 * np.sqrt(statistic) * scipy.stats.f.pdf(statistic, 1, df) * navr
+    if test == "t":
+        return 2 * scipy.stats.t.pdf(np.abs(statistic), df) * navr
+    if test == "r":
+        t = statistic * np.sqrt(df / (1 - np.square(statistic)))
+        return 2 * scipy.stats.t.pdf(np.abs(t), df) * np.sqrt(df / (n - 1)) * navr
+    if test == "cohen_d":
+        return np.full(np.broadcast(statistic, n, navr).shape, np.nan)
+    raise ValueError(f"Unknown test: {test}")
+
+
+def p_moments(
+    t0, sigma2, test: str, df, order: int = 64
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Mean and standard deviation of p(T), T ~ N(t0, sigma2), by
+    Gauss-Hermite quadrature of `order`.
+
+    `t0`, `sigma2` and `df` are broadcast together; the nodes are a last
+    axis of the evaluation.
+    """
+    t0, sigma2, df = np.broadcast_arrays(
+        np.asarray(t0, dtype=np.float64),
+        np.asarray(sigma2, dtype=np.float64),
+        np.asarray(df, dtype=np.float64),
+    )
+    x, w = hermite_nodes(order)
+    nodes = t0[..., None] + np.sqrt(2.0 * sigma2)[..., None] * x
+    p = p_value(nodes, test, df[..., None])
+    m1 = p @ w
+    m2 = (p * p) @ w
+    return m1, np.sqrt(np.maximum(m2 - m1 * m1, 0.0))
+
+
+def adaptive_p_moments(
+    t0,
+    sigma2,
+    test: str,
+    df,
+    tol: float = 1e-4,
+    order: int = 16,
+    max_order: int = 1024,
+) -> dict[str, np.ndarray]:
+    """
+    `p_moments` with the order of each row doubled until the standard
+    deviation changes by less than `tol` (absolute), up to `max_order`.
+
+    Returns
+    -------
+    dict
+        mean, std (at the final order of each row), error
+        (|std(order) - std(order / 2)|) and order, broadcast shape of the
+        inputs.
+    """
+    arrays = np.broadcast_arrays(
+        np.asarray(t0, dtype=np.float64),
+        np.asarray(sigma2, dtype=np.float64),
+        np.asarray(df, dtype=np.float64),
+    )
+    shape = arrays[0].shape
+    t0, sigma2, df = (a.reshape(-1) for a in arrays)
+    mean, std = p_moments(t0, sigma2, test, df, order)
+    error = np.full(len(t0), np.inf)
+    orders = np.full(len(t0), order)
+    rows = np.arange(len(t0))
+    while len(rows) and order < max_order:
+        order *= 2
+        new_mean, new_std = p_moments(t0[rows], sigma2[rows], test, df[rows], order)
+        error[rows] = np.abs(new_std - std[rows])
+        mean[rows], std[rows], orders[rows] = new_mean, new_std, order
+        # rows with a NaN spread (e.g. missing NAVR) are not refined
+        rows = rows[error[rows] >= tol]
+    return {
+        "mean": mean.reshape(shape),
+        "std": std.reshape(shape),
+        "error": error.reshape(shape),
+        "order": orders.reshape(shape),
+    }
@@ -0,0 +1,310 @@
+"""
+Batched bootstrap and permutation tests of the HC vs PD NAVR difference.
+
+Same tests as `bootstrap_group_diff` of `notebooks/npv/statistics.ipynb`
+(`scipy.stats.bootstrap` and `scipy.stats.permutation_test` with
+`vectorized=False`), for all metric/study comparisons at once:
+- the regions of the HC and PD tables are paired on region[, hemisphere];
+- paired bootstrap of the mean difference (PD - HC): every resample is a
+  row of one (n_resamples, n_regions) index matrix, and the mean
+  difference of all resamples is one reduction of the paired differences;
+- percentile or BCa (jackknife acceleration, as in scipy) intervals and
+  the two-sided bootstrap p-value of the notebook;
+- permutation test of the independent samples: the permutations are the
+  argsort of one random matrix, and the null distribution is computed from
+  the sum of the first group, with the two-sided p-value of scipy
+  (always Monte Carlo: the number of distinct permutations of tens of
+  regions is far above `n_resamples`).
+
+Each comparison draws from its own stream of `SeedSequence(seed).spawn`,
+so results only depend on the seed and the order of the comparisons, not on
+`n_jobs`.
+
+Usage:
+    python -m fsfuzzy.resampling --input-dir npv/csv_all \
+        --output npv/statistics/bootstrap.csv
+"""
+
+import argparse
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+
+metrics = ("area", "thickness", "volume", "subcortical_volume")
+studies = ("cross-sectional", "longitudinal")
+
+
+def csv_filename(
+    group: str, metric: str, study: str, timepoint: str = "baseline", prefix="npv"
+) -> str:
+    """Table of one group, as written by the npv notebooks."""
+    if study == "longitudinal":
+        return f"{prefix}_{group}_{metric}_longitudinal.csv"
+    return f"{prefix}_{group}_{timepoint}_{metric}.csv"
+
+
+def paired_values(
+    df_hc: pd.DataFrame, df_pd: pd.DataFrame, value_col: str = "npv"
+) -> pd.DataFrame:
+    """
+    Regions with a value in both tables, joined on region[, hemisphere],
+    with `<value_col>_HC` and `<value_col>_PD` columns.
+    """
+    df_hc = df_hc[~df_hc[value_col].isna()]
+    df_pd = df_pd[~df_pd[value_col].isna()]
+    join_keys = ["region"]
+    if "hemisphere" in df_hc.columns and "hemisphere" in df_pd.columns:
+        join_keys.append("hemisphere")
+    merged = pd.merge(
+        df_hc[join_keys + [value_col]],
+        df_pd[join_keys + [value_col]],
+        on=join_keys,
+        suffixes=("_HC", "_PD"),
+        how="inner",
+    )
+    if merged.empty:
+        raise ValueError("No overlapping regions found between HC and PD datasets.")
+    return merged
+
+
+def _batches(n_resamples: int, batch: int | None):
+    batch = n_resamples if batch is None else batch
+    for start in range(0, n_resamples, batch):
+        yield min(batch, n_resamples - start)
+
+
+def bootstrap_distribution(
+    diff: np.ndarray, rng: np.random.Generator, n_resamples: int, batch=None
+) -> np.ndarray:
+    """Means of `diff` over paired resamples of its indices."""
+    n = len(diff)
+    return np.concatenate(
+        [
+            diff[rng.integers(0, n, size=(size, n))].mean(axis=1)
+            for size in _batches(n_resamples, batch)
+        ]
+    )
+
+
+def permutation_distribution(
+    x: np.ndarray, y: np.ndarray, rng: np.random.Generator, n_resamples: int, batch=None
+) -> np.ndarray:
+    """
+    mean(y) - mean(x) over random reassignments of the pooled values to
+    groups of the sizes of `x` and `y`.
+    """
+    pooled = np.concatenate([x, y])
+    total = pooled.sum()
+    nx, ny = len(x), len(y)
+    null = []
+    for size in _batches(n_resamples, batch):
+        order = np.argsort(rng.random((size, len(pooled))), axis=1)
+        sum_x = pooled[order[:, :nx]].sum(axis=1)
+        null.append((total - sum_x) / ny - sum_x / nx)
+    return np.concatenate(null)
+
+
+def _bca_levels(
+    diff: np.ndarray, observed: float, distribution: np.ndarray, alpha: float
+) -> tuple[float, float]:
+    """Quantile levels of the BCa interval (scipy's `_bca_interval`)."""
+    n = len(diff)
+    below = np.count_nonzero(distribution < observed)
+    below_or_equal = np.count_nonzero(distribution <= observed)
+    z0 = ndtri((below + below_or_equal) / (2 * len(distribution)))
+    # jackknife of the mean difference
+    theta = (diff.sum() - diff) / (n - 1)
+    u = (n - 1) * (theta.mean() - theta)
+    a = (np.sum(u**3) / n**3) / (6 * (np.sum(u**2) / n**2) ** 1.5)
+    z_alpha = ndtri(alpha)
+    levels = []
+    for z in (z_alpha, -z_alpha):
+        levels.append(ndtr(z0 + (z0 + z) / (1 - a * (z0 + z))))
+    return levels[0], levels[1]
+
+
+def compare_groups(
+    hc: np.ndarray,
+    pd_: np.ndarray,
+    rng: np.random.Generator | int | None = None,
+    n_resamples: int = 10000,
+    confidence_level: float = 0.95,
+    method: str = "percentile",
+    batch: int | None = None,
+) -> dict:
+    """
+    Mean difference (PD - HC) of paired values, with its bootstrap CI and
+    bootstrap and permutation two-sided p-values.
+
+    Parameters
+    ----------
+    hc, pd_ : ndarray
+        Values of the same regions in both groups.
+    rng : Generator, int or None
+        Random stream; the bootstrap and permutation draws follow each other
+        in it.
+    method : {"percentile", "bca"}
+        Bootstrap interval.
+    batch : int, optional
+        Resamples per index matrix, to bound memory.
+
+    Returns
+    -------
+    dict
+        n, observed, ci_low, ci_high, standard_error, p_bootstrap,
+        p_permutation.
+    """
+    if method not in ("percentile", "bca"):
+        raise ValueError(f"Unknown method: {method}")
+    rng = np.random.default_rng(rng)
+    hc = np.asarray(hc, dtype=np.float64)
+    pd_ = np.asarray(pd_, dtype=np.float64)
+    diff = pd_ - hc
+    observed = pd_.mean() - hc.mean()
+
+    distribution = bootstrap_distribution(diff, rng, n_resamples, batch)
+    alpha = (1 - confidence_level) / 2
+    levels = (alpha, 1 - alpha)
+    if method == "bca":
+        levels = _bca_levels(diff, observed, distribution, alpha)
+    ci_low, ci_high = np.quantile(distribution, levels)
+    p_bootstrap = (np.sum(np.abs(distribution) >= np.abs(observed)) + 1) / (
+        n_resamples + 1
+    )
+
+    null = permutation_distribution(hc, pd_, rng, n_resamples, batch)
+    gamma = np.abs(np.finfo(np.float64).eps * 100 * observed)
+    less = (np.count_nonzero(null <= observed + gamma) + 1) / (n_resamples + 1)
+    greater = (np.count_nonzero(null >= observed - gamma) + 1) / (n_resamples + 1)
+
+    return {
+        "n": len(diff),
+        "observed": observed,
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "standard_error": distribution.std(ddof=1),
+        "p_bootstrap": p_bootstrap,
+        "p_permutation": min(1.0, 2 * min(less, greater)),
+    }
+
+
+def compare_all(
+    pairs: dict,
+    n_resamples: int = 10000,
+    seed: int = 0,
+    confidence_level: float = 0.95,
+    method: str = "percentile",
+    batch: int | None = None,
+    n_jobs: int = 1,
+    value_col: str = "npv",
+) -> pd.DataFrame:
+    """
+    `compare_groups` for every comparison, in parallel.
+
+    Parameters
+    ----------
+    pairs : dict
+        (metric, study) -> table of `paired_values`.
+    seed : int
+        Root of the `SeedSequence` spawned into one stream per comparison.
+
+    Returns
+    -------
+    DataFrame
+        metric, study and the columns of `compare_groups`, one row per
+        comparison in the order of `pairs`.
+    """
+    streams = np.random.SeedSequence(seed).spawn(len(pairs))
+    results = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(compare_groups)(
+            merged[f"{value_col}_HC"].to_numpy(),
+            merged[f"{value_col}_PD"].to_numpy(),
+            rng=np.random.default_rng(stream),
+            n_resamples=n_resamples,
+            confidence_level=confidence_level,
+            method=method,
+            batch=batch,
+        )
+        for merged, stream in zip(pairs.values(), streams)
+    )
+    keys = pd.DataFrame(list(pairs), columns=["metric", "study"])
+    return pd.concat([keys, pd.DataFrame(results)], axis=1)
+
+
+def load_pairs(
+    input_dir: Path,
+    metrics: list[str] = metrics,
+    studies: list[str] = studies,
+    timepoint: str = "baseline",
+    value_col: str = "npv",
+    prefix: str = "npv",
+) -> dict:
+    """Paired HC and PD tables of every (metric, study), read once."""
+    input_dir = Path(input_dir)
+    pairs = {}
+    for metric in metrics:
+        for study in studies:
+            df_hc, df_pd = (
+                pd.read_csv(
+                    input_dir / csv_filename(group, metric, study, timepoint, prefix)
+                )
+                for group in ("hc", "pd")
+            )
+            pairs[(metric, study)] = paired_values(df_hc, df_pd, value_col)
+    return pairs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Bootstrap and permutation tests of the PD - HC NAVR difference"
+    )
+    parser.add_argument("--input-dir", default="npv/csv_all", help="NAVR tables")
+    parser.add_argument(
+        "--output", default="npv/statistics/bootstrap.csv", help="Output CSV"
+    )
+    parser.add_argument("--metrics", nargs="+", choices=metrics, default=metrics)
+    parser.add_argument("--studies", nargs="+", choices=studies, default=studies)
+    parser.add_argument(
+        "--timepoint", default="baseline", help="Cross-sectional timepoint"
+    )
+    parser.add_argument("--value-col", default="npv", help="NAVR column")
+    parser.add_argument("--prefix", default="npv", help="Table file name prefix")
+    parser.add_argument("--n-resamples", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--confidence-level", type=float, default=0.95)
+    parser.add_argument("--method", choices=["percentile", "bca"], default="percentile")
+    parser.add_argument("--batch", type=int, help="Resamples per index matrix")
+    parser.add_argument("--n-jobs", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pairs = load_pairs(
+        args.input_dir,
+        metrics=args.metrics,
+        studies=args.studies,
+        timepoint=args.timepoint,
+        value_col=args.value_col,
+        prefix=args.prefix,
+    )
+    results = compare_all(
+        pairs,
+        n_resamples=args.n_resamples,
+        seed=args.seed,
+        confidence_level=args.confidence_level,
+        method=args.method,
+        batch=args.batch,
+        n_jobs=args.n_jobs,
+        value_col=args.value_col,
+    )
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(args.output, index=False)
+    print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Deterministic selection of k MCA repetitions per subject-visit.
+
+Rows are merged once with the executions dataset and filtered for rejected
+images, then every row gets a rank within its group (subject-visit, and
+hemisphere for cortical tables) from a single sort:
+- `seed=None` ranks by repetition number, i.e. keeps the first k
+  repetitions (the historical `keep_first_rows` behaviour);
+- an integer seed ranks by a stable 64-bit hash of
+  (subject_visit, repetition, seed), which is reproducible across runs and
+  machines and independent of the row order.
+
+Since lh and rh rows of a subject-visit share the same hash, both
+hemispheres keep the same repetitions. Groups with fewer than k rows are
+dropped. Several (k, seed) samples are taken from the same ranks without
+another pass over the table.
+"""
+
+from hashlib import sha1
+
+import numpy as np
+import pandas as pd
+
+_merge_keys = ["subject_visit", "subject", "visit", "repetition"]
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer on uint64 arrays."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def repetition_hash(
+    subject_visit: np.ndarray, repetition: np.ndarray, seed: int
+) -> np.ndarray:
+    """
+    Stable uint64 hash of (subject_visit, repetition, seed).
+    """
+    subject_hash = pd.util.hash_array(np.asarray(subject_visit, dtype=object))
+    with np.errstate(over="ignore"):
+        key = _mix(
+            np.asarray(repetition, dtype=np.int64).astype(np.uint64)
+            + _mix(np.full(1, seed, dtype=np.uint64))
+        )
+        return _mix(subject_hash ^ key)
+
+
+def prepare(
+    df: pd.DataFrame,
+    dataset: pd.DataFrame | None = None,
+    reject_col: str = "rejected_images",
+    verbose: bool = True,
+) -> pd.DataFrame:
+    """
+    Merge with the executions dataset and remove rejected images.
+    """
+    merged = df if dataset is None else df.merge(dataset, on=_merge_keys, how="inner")
+    if verbose:
+        print(f"Rows before filtering: {merged.shape[0]}")
+    if reject_col in merged.columns:
+        rejected = merged[reject_col].astype(bool).to_numpy()
+        merged = merged[~rejected]
+        if verbose:
+            print(f"Removed rejected images: {rejected.sum()}")
+    elif verbose:
+        print(f"Warning: '{reject_col}' column not found; skipping rejection filter.")
+    return merged
+
+
+def group_ranks(
+    df: pd.DataFrame,
+    group_keys: list[str],
+    seeds: list[int | None],
+    repetition_col: str = "repetition",
+    subject_col: str = "subject_visit",
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Rank of each row within its group, for each seed.
+
+    Returns
+    -------
+    ranks : ndarray, shape (len(seeds), len(df))
+        0-based rank of the row in its group.
+    sizes : ndarray, shape (len(df),)
+        Size of the group of the row.
+    """
+    groups = df.groupby(group_keys, sort=True).ngroup().to_numpy()
+    counts = np.bincount(groups)
+    sizes = counts[groups]
+    starts = np.cumsum(counts) - counts
+
+    repetition = df[repetition_col].to_numpy()
+    ranks = np.empty((len(seeds), len(df)), dtype=np.int64)
+    for i, seed in enumerate(seeds):
+        if seed is None:
+            key = repetition
+        else:
+            key = repetition_hash(df[subject_col].to_numpy(), repetition, seed)
+        order = np.lexsort((repetition, key, groups))
+        ranks[i, order] = np.arange(len(df)) - starts[groups[order]]
+    return ranks, sizes
+
+
+def _report(df, sizes, k, subject_col):
+    dropped = df.loc[sizes < k, subject_col].unique()
+    if len(dropped):
+        encoded = [sha1(str(s).encode()).hexdigest()[:8] for s in dropped]
+        print(f"Groups with < {k} rows dropped: {len(dropped)} subjects")
+        print(f"Encoded subject ids (first 8 hex): {encoded}")
+
+
+def sample_grid(
+    df: pd.DataFrame,
+    dataset: pd.DataFrame | None = None,
+    ks: list[int] = (26,),
+    seeds: list[int | None] = (None,),
+    hemi: bool = False,
+    subject_col: str = "subject_visit",
+    repetition_col: str = "repetition",
+    hemi_col: str = "hemi",
+    reject_col: str = "rejected_images",
+    verbose: bool = True,
+) -> dict[tuple[int, int | None], pd.DataFrame]:
+    """
+    Sample k repetitions per group for every (k, seed) pair.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Measurement table (e.g. `stats_QCed/raw/thickness.parquet`).
+    dataset : DataFrame, optional
+        Executions dataset merged on subject_visit/subject/visit/repetition.
+    ks : list of int
+        Number of repetitions to keep per group.
+    seeds : list of int or None
+        Sampling seeds; None keeps the first k repetitions.
+    hemi : bool
+        Sample per (subject_visit, hemi) instead of per subject_visit.
+
+    Returns
+    -------
+    dict
+        (k, seed) -> sampled rows, ordered by group then repetition, with
+        exactly k rows per kept group.
+    """
+    if hemi and hemi_col not in df.columns:
+        raise KeyError(f"hemi=True but '{hemi_col}' column is missing.")
+    group_keys = [subject_col] + ([hemi_col] if hemi else [])
+
+    merged = prepare(df, dataset, reject_col=reject_col, verbose=verbose)
+    merged = merged.sort_values(group_keys + [repetition_col], kind="stable")
+    merged = merged.reset_index(drop=True)
+    seeds = list(seeds)
+    ranks, sizes = group_ranks(
+        merged,
+        group_keys,
+        seeds,
+        repetition_col=repetition_col,
+        subject_col=subject_col,
+    )
+
+    samples = {}
+    for k in ks:
+        complete = sizes >= k
+        if verbose:
+            print(f"Keeping {k} rows per {'subject×hemi' if hemi else 'subject'}")
+            _report(merged, sizes, k, subject_col)
+        for i, seed in enumerate(seeds):
+            index = np.flatnonzero(complete & (ranks[i] < k))
+            samples[(k, seed)] = merged.take(index).reset_index(drop=True)
+        if verbose:
+            n_groups = np.count_nonzero(complete & (ranks[0] == 0))
+            print(f"Total subjects: {merged.loc[complete, subject_col].nunique()}")
+            print(f"Final rows kept: {n_groups * k}")
+    return samples
+
+
+def sample_repetitions(
+    df: pd.DataFrame,
+    dataset: pd.DataFrame | None = None,
+    k: int = 26,
+    seed: int | None = None,
+    hemi: bool = False,
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    Keep exactly k repetitions per subject-visit (and hemisphere).
+
+    See `sample_grid` for the parameters.
+    """
+    return sample_grid(df, dataset, ks=[k], seeds=[seed], hemi=hemi, **kwargs)[
+        (k, seed)
+    ]
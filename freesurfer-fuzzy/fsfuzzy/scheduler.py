@@ -0,0 +1,316 @@
+"""
+Adaptive number of MCA repetitions per cohort.
+
+Instead of a fixed `--nb-runs 26` for every subject-visit, repetitions are
+launched in rounds. After each round, the NAVR of every population (HC and
+PD, baseline and follow-up) is computed from the repetitions that have
+landed (`fsfuzzy.navr`), and the F-distribution CI of `_add_navr_ci` is
+projected to more repetitions. The width of the CI is
+
+    NAVR * (1 / sqrt(F_{alpha/2}) - 1 / sqrt(F_{1 - alpha/2}))
+
+with df1 = n (k - 1), df2 = k (n - 1), i.e. the NAVR estimate times a
+factor that only depends on the number of subject-visits n and of
+repetitions k. The target k of a population is the smallest k for which the
+widest regional CI (largest NAVR) is below `target_width`, within
+[min_repetitions, max_repetitions]. Subject-visits with fewer repetitions
+than the target of their population are scheduled for the missing runs,
+at most `max_batch` per round, so that the estimate is refined before the
+next round.
+
+The runs are written as `run_pipeline.py` input settings, one file per
+number of runs (`--nb-runs` applies to every input of a launch):
+
+    python -m fsfuzzy.scheduler --cohort cohort/longitudinal_cohort_qced.csv \
+        --stats-dir stats_QCed/raw --input-settings input_settings.json \
+        --target-width 0.05 --output-dir schedule
+
+When no subject-visit needs more runs, the cohort has converged.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.stats import f
+
+from fsfuzzy.cube import RepetitionCube
+from fsfuzzy.navr import (
+    groups,
+    load_cohort,
+    metrics,
+    navr_table,
+    population_sums,
+    read_cube,
+    reference_shift,
+    region_values,
+)
+
+visit_names = {"first": "baseline", "second": "followup"}
+
+
+def ci_factor(n: int, k, alpha: float = 0.05) -> np.ndarray:
+    """
+    Width of the NAVR CI divided by NAVR, for n subject-visits and k
+    repetitions (array-like).
+    """
+    k = np.asarray(k, dtype=np.float64)
+    df1 = n * (k - 1)
+    df2 = k * (n - 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 1.0 / np.sqrt(f.ppf(alpha / 2.0, df1, df2)) - 1.0 / np.sqrt(
+            f.ppf(1 - alpha / 2.0, df1, df2)
+        )
+
+
+def required_repetitions(
+    navr: float,
+    n: int,
+    target_width: float,
+    alpha: float = 0.05,
+    min_repetitions: int = 5,
+    max_repetitions: int = 26,
+) -> int:
+    """
+    Smallest k in [min_repetitions, max_repetitions] with a CI narrower
+    than `target_width` for the given NAVR; `max_repetitions` if none is,
+    `min_repetitions` if NAVR is not known yet.
+    """
+    if not np.isfinite(navr) or n < 2:
+        return min_repetitions
+    ks = np.arange(max(min_repetitions, 2), max_repetitions + 1)
+    reached = np.flatnonzero(navr * ci_factor(n, ks, alpha) <= target_width)
+    return int(ks[reached[0]]) if len(reached) else max_repetitions
+
+
+def repetition_counts(cube: RepetitionCube) -> pd.Series:
+    """
+    Repetitions of each subject-visit (of its least complete hemisphere).
+    """
+    counts = (cube.repetitions >= 0).sum(axis=0).min(axis=1)
+    return pd.Series(counts, index=pd.Index(cube.subjects["subject_visit"]))
+
+
+def cohort_populations(cohort: pd.DataFrame) -> dict[str, np.ndarray]:
+    """
+    Subject-visits of the cohort per population, e.g. "hc_baseline".
+    """
+    return {
+        f"{name}_{visit_names[visit]}": pd.unique(
+            cohort.loc[cohort["dx_group"] == dx_group, f"{visit}_visit"]
+        )
+        for name, dx_group in groups.items()
+        for visit in visit_names
+    }
+
+
+def population_status(
+    cube: RepetitionCube,
+    populations: dict[str, np.ndarray],
+    target_width: float,
+    alpha: float = 0.05,
+    min_repetitions: int = 5,
+    max_repetitions: int = 26,
+) -> pd.DataFrame:
+    """
+    NAVR precision of each population with the repetitions of `cube`.
+
+    Returns
+    -------
+    DataFrame
+        One row per population: metric, population, n (subject-visits with
+        repetitions), k (fewest repetitions of a subject-visit of the
+        population, 0 if one has none), NAVR (largest regional NAVR),
+        width (its CI width at k) and target (repetitions to reach
+        `target_width`).
+    """
+    counts = repetition_counts(cube)
+    values, regions = region_values(cube)
+    rows = []
+    for population, subject_visits in populations.items():
+        landed = counts.reindex(subject_visits, fill_value=0)
+        present = landed.index[landed > 0]
+        k = int(landed.min()) if len(landed) else 0
+        navr = np.nan
+        if len(present) > 1 and k > 1:
+            selected = values[:, cube.subject_codes(present)]
+            sums = population_sums(selected, reference_shift(selected), len(present))
+            table = navr_table(sums, regions, cube.hemispheres, population, k=k)
+            navr = table["NAVR"].max()
+        rows.append(
+            {
+                "metric": cube.metric,
+                "population": population,
+                "n": len(present),
+                "k": k,
+                "NAVR": navr,
+                "width": navr * ci_factor(len(present), k, alpha),
+                "target": required_repetitions(
+                    navr,
+                    len(present),
+                    target_width,
+                    alpha=alpha,
+                    min_repetitions=min_repetitions,
+                    max_repetitions=max_repetitions,
+                ),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def schedule(
+    status: pd.DataFrame,
+    populations: dict[str, np.ndarray],
+    counts: pd.Series,
+    max_batch: int | None = None,
+) -> pd.DataFrame:
+    """
+    Runs to launch per subject-visit.
+
+    The target of a population is the largest over metrics (`status` of
+    several metrics); a subject-visit goes to the target of its population,
+    by at most `max_batch` runs.
+
+    Returns
+    -------
+    DataFrame
+        subject_visit, population, done, target, nb_runs; subject-visits
+        with nothing to run are left out.
+    """
+    targets = status.groupby("population")["target"].max()
+    plan = pd.concat(
+        [
+            pd.DataFrame({"subject_visit": visits, "population": population})
+            for population, visits in populations.items()
+        ],
+        ignore_index=True,
+    )
+    plan["done"] = counts.reindex(plan["subject_visit"], fill_value=0).to_numpy()
+    plan["target"] = targets.reindex(plan["population"]).to_numpy()
+    # a subject-visit in several populations follows the most demanding one
+    plan = plan.sort_values("target", ascending=False, kind="stable")
+    plan = plan.drop_duplicates("subject_visit").sort_index(ignore_index=True)
+    plan["nb_runs"] = (plan["target"] - plan["done"]).clip(lower=0)
+    if max_batch is not None:
+        plan["nb_runs"] = plan["nb_runs"].clip(upper=max_batch)
+    return plan[plan["nb_runs"] > 0].reset_index(drop=True)
+
+
+def write_batches(
+    plan: pd.DataFrame, input_settings: dict, output_dir: Path
+) -> dict[int, Path]:
+    """
+    Write the input settings of each launch, i.e. of the subject-visits
+    with the same number of runs, as `batch-<nb_runs>runs.json`.
+
+    `input_settings` is a `run_pipeline.py` settings file
+    (`generate_input_settings.py`) with one `nifti` per `subjid`.
+
+    Raises
+    ------
+    KeyError
+        If a scheduled subject-visit is not in `input_settings`.
+    """
+    inputs = pd.Series(input_settings["nifti"], index=input_settings["subjid"])
+    missing = plan.loc[~plan["subject_visit"].isin(inputs.index), "subject_visit"]
+    if len(missing):
+        raise KeyError(f"Subject-visits without input: {list(missing[:5])}")
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    batches = {}
+    for nb_runs, rows in plan.groupby("nb_runs"):
+        settings = dict(input_settings)
+        settings["subjid"] = rows["subject_visit"].tolist()
+        settings["nifti"] = inputs.loc[settings["subjid"]].tolist()
+        path = output_dir / f"batch-{nb_runs}runs.json"
+        with open(path, "w") as fo:
+            json.dump(settings, fo, indent=2)
+        batches[int(nb_runs)] = path
+    return batches
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Schedule the next MCA repetitions from the NAVR CI"
+    )
+    parser.add_argument(
+        "--cohort",
+        default="cohort/longitudinal_cohort_qced.csv",
+        help="Longitudinal cohort CSV",
+    )
+    parser.add_argument(
+        "--stats-dir", default="stats_QCed/raw", help="Tables of the landed runs"
+    )
+    parser.add_argument(
+        "--cube-dir",
+        default="stats_QCed/cube",
+        help="Cubes of fsfuzzy.cube.build_cubes, memory-mapped when built from "
+        "the --stats-dir tables (default: stats_QCed/cube)",
+    )
+    parser.add_argument("--metrics", nargs="+", choices=metrics, default=metrics)
+    parser.add_argument(
+        "--target-width",
+        type=float,
+        required=True,
+        help="Target width of the NAVR CI (largest NAVR of each population)",
+    )
+    parser.add_argument("--alpha", type=float, default=0.05, help="CI level")
+    parser.add_argument("--min-repetitions", type=int, default=5)
+    parser.add_argument("--max-repetitions", type=int, default=26)
+    parser.add_argument(
+        "--max-batch", type=int, help="Maximum runs per subject-visit and round"
+    )
+    parser.add_argument(
+        "--input-settings", help="run_pipeline.py input settings of the cohort"
+    )
+    parser.add_argument("--output-dir", default="schedule", help="Output directory")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cohort = load_cohort(args.cohort)
+    populations = cohort_populations(cohort)
+    status, counts = [], []
+    for metric in args.metrics:
+        cube = read_cube(Path(args.stats_dir) / "partitioned", metric, args.cube_dir)
+        status.append(
+            population_status(
+                cube,
+                populations,
+                args.target_width,
+                alpha=args.alpha,
+                min_repetitions=args.min_repetitions,
+                max_repetitions=args.max_repetitions,
+            )
+        )
+        counts.append(repetition_counts(cube))
+    status = pd.concat(status, ignore_index=True)
+    # a repetition has landed when its tables of every metric have
+    counts = pd.concat(counts, axis=1).fillna(0).min(axis=1).astype(int)
+    plan = schedule(status, populations, counts, max_batch=args.max_batch)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    status.to_csv(output_dir / "status.csv", index=False)
+    plan.to_csv(output_dir / "schedule.csv", index=False)
+    print(status.to_string(index=False))
+    if plan.empty:
+        print("No more repetitions to launch: target width or maximum reached")
+        return
+    print(f"{plan['nb_runs'].sum()} runs for {len(plan)} subject-visits")
+    if args.input_settings:
+        with open(args.input_settings) as fi:
+            input_settings = json.load(fi)
+        for nb_runs, path in write_batches(plan, input_settings, output_dir).items():
+            print(
+                "python scripts/run_pipeline.py --api-key $VIP_API_TOKEN "
+                f"--session <session> --input-settings {path} --nb-runs {nb_runs}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Streaming aggregation of per-repetition test results.
+
+`SignificanceAccumulator` consumes the results of the batched engines
+(`fsfuzzy.ancova`, `fsfuzzy.partial_correlation`) chunk by chunk, e.g. one
+repetition at a time, and keeps per region (and hemisphere):
+- count, mean and sum of squared deviations of the statistic, the p-value
+  and n, combined across chunks with the parallel form of Welford's
+  algorithm (Chan et al.):
+
+      n = n_a + n_b,  delta = mean_b - mean_a
+      mean = mean_a + delta * n_b / n
+      M2 = M2_a + M2_b + delta^2 * n_a * n_b / n
+
+- min and max;
+- the number of tests and of significant tests (p < alpha);
+- optionally a `QuantileSketch` of the statistic and of the p-value for
+  the median.
+
+`summary()` returns the significance table of `compute_significance` in
+the longitudinal notebooks (same columns, rows and order; moments equal to
+rounding) without holding the repetitions in memory. Accumulators of
+disjoint chunks, e.g. from parallel workers, are combined with `merge`.
+"""
+
+from collections.abc import Iterable
+
+import numpy as np
+import pandas as pd
+
+_moment_names = ("mean", "std", "min", "max")
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative accuracy, one per group.
+
+    Values are counted in logarithmic buckets (as in DDSketch): a value x
+    with gamma^(i-1) < |x| <= gamma^i, gamma = (1 + a) / (1 - a), falls in
+    bucket i and is estimated by 2 gamma^i / (gamma + 1), within a relative
+    error `a` of x. Values smaller than `min_value` in magnitude count as 0.
+    Buckets are stored in a dense window of the keys seen so far; sketches
+    are merged by adding counts.
+
+    Parameters
+    ----------
+    relative_accuracy : float
+        Relative error `a` of the quantiles.
+    min_value : float
+        Smallest magnitude told apart from 0.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-300):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self._log_gamma = np.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self._offset = int(np.ceil(np.log(min_value) / self._log_gamma)) - 1
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        self.lo = 0
+
+    def _keys(self, values: np.ndarray) -> np.ndarray:
+        magnitude = np.abs(values)
+        keys = np.zeros(len(values), dtype=np.int64)
+        large = magnitude >= self.min_value
+        keys[large] = (
+            np.ceil(np.log(magnitude[large]) / self._log_gamma).astype(np.int64)
+            - self._offset
+        )
+        return np.where(values < 0, -keys, keys)
+
+    def _values(self, keys: np.ndarray) -> np.ndarray:
+        gamma = np.exp(self._log_gamma)
+        magnitude = 2 * gamma ** (np.abs(keys) + self._offset) / (gamma + 1)
+        return np.where(keys == 0, 0.0, np.sign(keys) * magnitude)
+
+    def _reshape(self, n_groups: int, lo: int, hi: int):
+        """Grow the counts to `n_groups` rows and keys [lo, hi)."""
+        n_rows, width = self.counts.shape
+        if width == 0:
+            self.lo = lo
+        lo, hi = min(lo, self.lo), max(hi, self.lo + width)
+        if (n_groups, hi - lo) == self.counts.shape:
+            return
+        counts = np.zeros((n_groups, hi - lo), dtype=np.int64)
+        start = self.lo - lo
+        counts[:n_rows, start : start + width] = self.counts
+        self.counts, self.lo = counts, lo
+
+    def update(self, groups: np.ndarray, values: np.ndarray, n_groups: int):
+        """Count `values` in the sketch of their group."""
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        groups, keys = groups[valid], self._keys(values[valid])
+        if len(keys) == 0:
+            self._reshape(n_groups, self.lo, self.lo)
+            return
+        self._reshape(n_groups, int(keys.min()), int(keys.max()) + 1)
+        np.add.at(self.counts, (groups, keys - self.lo), 1)
+
+    def merge(self, other: "QuantileSketch", groups: np.ndarray, n_groups: int):
+        """Add the counts of `other`, whose row j is group `groups[j]`."""
+        if other.counts.shape[1] == 0:
+            self._reshape(n_groups, self.lo, self.lo)
+            return
+        self._reshape(n_groups, other.lo, other.lo + other.counts.shape[1])
+        start = other.lo - self.lo
+        self.counts[groups, start : start + other.counts.shape[1]] += other.counts
+
+    def quantile(self, q: float) -> np.ndarray:
+        """
+        Estimate of the q-quantile of every group (NaN if empty): the value
+        of rank floor(q (n - 1)), i.e. the lower median for q = 0.5.
+        """
+        total = self.counts.sum(axis=1)
+        if self.counts.shape[1] == 0:
+            return np.full(len(total), np.nan)
+        rank = np.floor(q * (total - 1))
+        index = np.argmax(self.counts.cumsum(axis=1) > rank[:, None], axis=1)
+        return np.where(total > 0, self._values(index + self.lo), np.nan)
+
+
+class _Moments:
+    """Count, mean, M2, min and max of one column, per group."""
+
+    def __init__(self):
+        self.count = np.zeros(0, dtype=np.int64)
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self.min = np.zeros(0)
+        self.max = np.zeros(0)
+
+    def grow(self, n_groups: int):
+        extra = n_groups - len(self.count)
+        if extra <= 0:
+            return
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.mean = np.concatenate([self.mean, np.zeros(extra)])
+        self.m2 = np.concatenate([self.m2, np.zeros(extra)])
+        self.min = np.concatenate([self.min, np.full(extra, np.nan)])
+        self.max = np.concatenate([self.max, np.full(extra, np.nan)])
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0.0)
+            self.m2 = (
+                self.m2
+                + m2
+                + np.where(total > 0, delta**2 * self.count * count / total, 0.0)
+            )
+        self.count = total
+
+    def update(self, groups: np.ndarray, values: np.ndarray):
+        valid = ~np.isnan(values)
+        groups, values = groups[valid], values[valid]
+        n_groups = len(self.count)
+        count = np.bincount(groups, minlength=n_groups)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(
+                count > 0,
+                np.bincount(groups, weights=values, minlength=n_groups) / count,
+                0.0,
+            )
+        m2 = np.bincount(
+            groups, weights=(values - mean[groups]) ** 2, minlength=n_groups
+        )
+        self._combine(count, mean, m2)
+        np.fmin.at(self.min, groups, values)
+        np.fmax.at(self.max, groups, values)
+
+    def merge(self, other: "_Moments", groups: np.ndarray):
+        n_groups = len(self.count)
+        count = np.zeros(n_groups, dtype=np.int64)
+        mean, m2 = np.zeros(n_groups), np.zeros(n_groups)
+        count[groups], mean[groups], m2[groups] = other.count, other.mean, other.m2
+        self._combine(count, mean, m2)
+        np.fmin.at(self.min, groups, other.min)
+        np.fmax.at(self.max, groups, other.max)
+
+    def summary(self) -> dict[str, np.ndarray]:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {
+                "mean": np.where(self.count > 0, self.mean, np.nan),
+                "std": np.where(
+                    self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan
+                ),
+                "min": self.min,
+                "max": self.max,
+            }
+
+
+class SignificanceAccumulator:
+    """
+    Per-region significance summary of test results, fed chunk by chunk.
+
+    Parameters
+    ----------
+    stat : str
+        Statistic column of the results (`F` for the ANCOVA, `r` for the
+        partial correlation).
+    by : list of str
+        Grouping columns, `['region']` or `['region', 'hemisphere']`.
+    alpha : float
+        Significance threshold of the p-values.
+    count_column : str
+        Name of the column counting the non-missing statistics
+        (`n_correlations` for the baseline tables, `n_tests` for the
+        longitudinal ones).
+    median : bool
+        Keep a `QuantileSketch` of the statistic and of the p-value and add
+        `median_<stat>` and `median_p` to the summary.
+    relative_accuracy : float
+        Relative error of the medians.
+
+    Examples
+    --------
+    >>> acc = SignificanceAccumulator("F", by=["region", "hemisphere"])
+    >>> for _, rep in results.groupby("repetition"):
+    ...     acc.update(rep)
+    >>> acc.summary()
+    """
+
+    def __init__(
+        self,
+        stat: str,
+        by: Iterable[str] = ("region",),
+        alpha: float = 0.05,
+        count_column: str = "n_tests",
+        median: bool = False,
+        relative_accuracy: float = 0.01,
+    ):
+        self.stat = stat
+        self.by = list(by)
+        self.alpha = alpha
+        self.count_column = count_column
+        self.median = median
+        self.relative_accuracy = relative_accuracy
+        self.keys = pd.MultiIndex.from_arrays([[]] * len(self.by), names=self.by)
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.significant = np.zeros(0, dtype=np.int64)
+        self.columns = {c: _Moments() for c in (stat, "p-val", "n")}
+        self.dtypes = {}
+        self.sketches = (
+            {c: QuantileSketch(relative_accuracy) for c in (stat, "p-val")}
+            if median
+            else {}
+        )
+
+    def _groups(self, keys: pd.MultiIndex) -> np.ndarray:
+        """Position of `keys`, adding the new ones."""
+        codes, uniques = pd.factorize(keys)
+        new = uniques[self.keys.get_indexer(uniques) < 0]
+        if len(new):
+            self.keys = self.keys.append(new)
+            self.keys.names = self.by
+            n_groups = len(self.keys)
+            extra = n_groups - len(self.rows)
+            self.rows = np.concatenate([self.rows, np.zeros(extra, dtype=np.int64)])
+            self.significant = np.concatenate(
+                [self.significant, np.zeros(extra, dtype=np.int64)]
+            )
+            for moments in self.columns.values():
+                moments.grow(n_groups)
+        return self.keys.get_indexer(uniques)[codes]
+
+    def update(self, results: pd.DataFrame) -> "SignificanceAccumulator":
+        """Add a chunk of results (any subset of repetitions and regions)."""
+        if results.empty:
+            return self
+        groups = self._groups(pd.MultiIndex.from_frame(results[self.by]))
+        n_groups = len(self.keys)
+        p = results["p-val"].to_numpy(np.float64)
+        self.rows += np.bincount(groups, minlength=n_groups)
+        self.significant += np.bincount(groups[p < self.alpha], minlength=n_groups)
+        for column, moments in self.columns.items():
+            self.dtypes.setdefault(column, results[column].dtype)
+            moments.update(groups, results[column].to_numpy(np.float64))
+        for column, sketch in self.sketches.items():
+            sketch.update(groups, results[column].to_numpy(np.float64), n_groups)
+        return self
+
+    def merge(self, other: "SignificanceAccumulator") -> "SignificanceAccumulator":
+        """Add the results accumulated by `other` (on disjoint chunks)."""
+        if len(other.keys) == 0:
+            return self
+        groups = self._groups(other.keys)
+        self.rows[groups] += other.rows
+        self.significant[groups] += other.significant
+        for column, moments in self.columns.items():
+            moments.merge(other.columns[column], groups)
+        for column, dtype in other.dtypes.items():
+            self.dtypes.setdefault(column, dtype)
+        for column, sketch in self.sketches.items():
+            sketch.merge(other.sketches[column], groups, len(self.keys))
+        return self
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Significance table, sorted by decreasing proportion of significant
+        tests.
+        """
+        if len(self.keys) == 0:
+            return pd.DataFrame()
+
+        stat = self.stat
+        moments = {c: m.summary() for c, m in self.columns.items()}
+        agg = self.keys.to_frame(index=False)
+        agg[self.count_column] = self.columns[stat].count
+        agg["n_significant"] = self.significant
+        agg["proportion_significant"] = self.significant / self.rows
+        for name in _moment_names:
+            agg[f"{name}_{stat}"] = moments[stat][name]
+        for name in _moment_names:
+            agg[f"{name}_p"] = moments["p-val"][name]
+        for name in ("mean", "min", "max"):
+            agg[f"{name}_n"] = moments["n"][name]
+        # min and max keep the dtype of integer columns (n)
+        for column, suffix in ((stat, stat), ("n", "n")):
+            dtype = self.dtypes.get(column)
+            for name in ("min", "max"):
+                values = agg[f"{name}_{suffix}"]
+                if pd.api.types.is_integer_dtype(dtype) and values.notna().all():
+                    agg[f"{name}_{suffix}"] = values.astype(dtype)
+        if self.median:
+            agg[f"median_{stat}"] = self.sketches[stat].quantile(0.5)
+            agg["median_p"] = self.sketches["p-val"].quantile(0.5)
+
+        # Row order of `groupby(by).agg(...).reset_index()`
+        agg = agg.sort_values(self.by, na_position="last", ignore_index=True)
+        return agg.sort_values("proportion_significant", ascending=False)
+
+
+def compute_significance(
+    results: pd.DataFrame,
+    stat: str,
+    by: list[str],
+    alpha: float = 0.05,
+    count_column: str = "n_tests",
+    median: bool = False,
+) -> pd.DataFrame:
+    """
+    Aggregate the results of the repetitions per region (and hemisphere),
+    one repetition at a time.
+
+    Same table as::
+
+        results.assign(significant=results["p-val"] < alpha)
+        .groupby(by, dropna=False)
+        .agg(count/sum/mean of significant, mean/std/min/max of stat and
+             p-val, mean/min/max of n)
+    """
+    if results.empty:
+        return pd.DataFrame()
+    acc = SignificanceAccumulator(
+        stat, by=by, alpha=alpha, count_column=count_column, median=median
+    )
+    if "repetition" in results:
+        for _, repetition in results.groupby("repetition", sort=False):
+            acc.update(repetition)
+    else:
+        acc.update(results)
+    return acc.summary()
@@ -0,0 +1,388 @@
+"""
+Monte Carlo validation of the propagation formulas (`fsfuzzy.propagation`).
+
+The numerical_validation notebooks compare the closed-form spreads of the
+statistics (`std_F`, `std_t`, `std_r`, `std_d`) and of the p-values
+(`std_p`) to the spread over the 26 MCA repetitions, whose sampling noise
+limits the comparison. Here the repetitions are simulated instead:
+- reference: mean over the repetitions of the tested value of every
+  (unit, region[, hemisphere]) of the longitudinal tables (metric at
+  baseline, relative change for the longitudinal study);
+- noise: N(0, (NAVR * sigma_anat)^2) per region, with NAVR from the HC-PD
+  NAVR tables (as in the notebooks) and sigma_anat the standard deviation
+  of the reference over the tested units;
+- statistics: each chunk of simulated repetitions of all regions is one
+  response matrix, tested in one call of the batched engines
+  (`fsfuzzy.ancova.ancova_matrix` for F,
+  `fsfuzzy.partial_correlation.partial_corr_matrix` for r and
+  `fsfuzzy.two_sample.two_sample_matrix` for t and Cohen's d between the
+  groups of the ANCOVA).
+
+Chunks run on a process pool, each with its own stream of
+`SeedSequence([seed, *key_entropy(metric, timepoint, stat)])`, and return
+additive sums of the powers of the statistic and of the p-value (shifted by
+their reference value), so the result of a (metric, timepoint, statistic)
+depends neither on `n_jobs` nor on the other keys of the run. The spread of every region comes with
+its Monte Carlo standard error, sqrt((m4 - s^4) / N) / (2 s), from the
+fourth central moment.
+
+The tables have the columns of the notebooks'
+`empirical_vs_theoretical_differences_<stat>.csv`, with the simulated
+spread in place of the empirical one:
+
+    <output_dir>/<timepoint>/<metric>/empirical_vs_theoretical_differences_<stat>.csv
+
+Usage:
+    python -m fsfuzzy.simulation --cohort cohort/longitudinal_cohort_qced.csv \
+        --stats-dir stats_QCed/sampled --navr-dir navr/csv_all \
+        --output-dir numerical_validation/simulation --n-simulations 10000
+"""
+
+import argparse
+import itertools
+from hashlib import sha1
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from fsfuzzy.ancova import ancova_matrix
+from fsfuzzy.batching import pivot_tests, unit_columns
+from fsfuzzy.longitudinal import (
+    baseline_table,
+    change_table,
+    covariates,
+    factors,
+    load_cohort,
+    metrics,
+    read_fuzzy,
+    scores,
+    timepoints,
+)
+from fsfuzzy.navr import navr_columns, read_navr
+from fsfuzzy.partial_correlation import partial_corr_matrix
+from fsfuzzy.propagation import adaptive_p_moments, std_p, std_statistic
+from fsfuzzy.two_sample import two_sample_matrix
+
+statistics = ("F", "t", "cohen_d", "r")
+
+
+def _statistic_matrix(stat: str, Y: np.ndarray, design: dict) -> pd.DataFrame:
+    if stat == "F":
+        return ancova_matrix(Y, design["groups"], design["covariates"])
+    if stat == "r":
+        return partial_corr_matrix(
+            Y, design["score"], design["covariates"], min_n=design["min_n"]
+        )
+    return two_sample_matrix(Y, design["groups"])
+
+
+def simulation_inputs(
+    wide: pd.DataFrame,
+    cohort: pd.DataFrame,
+    metric: str,
+    timepoint: str,
+    stat: str,
+) -> tuple[np.ndarray, pd.DataFrame, dict]:
+    """
+    Reference values and design of one (metric, timepoint, statistic).
+
+    Returns
+    -------
+    reference : ndarray, shape (n_units, n_regions)
+        Mean over the repetitions; NaN where a unit has no value.
+    tests : DataFrame
+        region[, hemisphere] of the columns of `reference`.
+    design : dict
+        groups, covariates, score (r only) and min_n, aligned on the units.
+    """
+    baseline = timepoint == "baseline"
+    if stat == "r":
+        cohort = cohort[cohort["dx_group"] == "PD-non-MCI"]
+    table = (
+        baseline_table(wide, cohort, metric)
+        if baseline
+        else change_table(wide, cohort, metric)
+    )
+    value = metric if baseline else f"{metric}_change"
+    unit = "subject_visit" if baseline else "PATNO"
+    by = ["region"] + (["hemisphere"] if metrics[metric] else [])
+    mean = table.groupby([unit] + by, sort=False)[value].mean().reset_index()
+    reference, tests, units = pivot_tests(mean, value, by, unit)
+
+    covar = covariates[timepoint]
+    columns = [factors[timepoint], scores[timepoint]] + covar
+    per_unit = unit_columns(
+        table, unit, columns, units, numeric=[scores[timepoint]] + covar
+    )
+    factor = per_unit[factors[timepoint]]
+    design = {
+        "groups": factor.astype(object).where(factor.notna()).to_numpy(),
+        "covariates": per_unit[covar].to_numpy(np.float64),
+        "score": per_unit[scores[timepoint]].to_numpy(np.float64),
+        "min_n": 4 if baseline else 3,
+    }
+    return reference, tests, design
+
+
+def simulate_chunk(
+    stat: str,
+    reference: np.ndarray,
+    scale: np.ndarray,
+    design: dict,
+    shift: np.ndarray,
+    n_simulations: int,
+    seed: np.random.SeedSequence,
+) -> dict[str, np.ndarray]:
+    """
+    Sums of the powers 0..4 of the statistic and of the p-value (minus
+    `shift`, shape (2, n_regions)) over `n_simulations` noisy copies of
+    `reference`.
+
+    Returns
+    -------
+    dict
+        stat, p-val: arrays of shape (5, n_regions), power 0 (count) first.
+    """
+    rng = np.random.default_rng(seed)
+    n_units, n_regions = reference.shape
+    noise = rng.standard_normal((n_units, n_regions, n_simulations))
+    Y = reference[:, :, None] + scale[None, :, None] * noise
+    results = _statistic_matrix(stat, Y.reshape(n_units, -1), design)
+    sums = {}
+    for i, column in enumerate((stat, "p-val")):
+        values = results[column].to_numpy(np.float64).reshape(n_regions, -1)
+        valid = ~np.isnan(values)
+        deviation = np.where(valid, values - shift[i][:, None], 0.0)
+        sums[column] = np.stack(
+            [valid.sum(axis=1)] + [(deviation**k).sum(axis=1) for k in range(1, 5)]
+        ).astype(np.float64)
+    return sums
+
+
+def moments_from_sums(sums: np.ndarray, shift: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Mean, standard deviation and their Monte Carlo standard errors from
+    the sums of `simulate_chunk`.
+    """
+    count, s1, s2, s3, s4 = sums
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d = s1 / count
+        m2 = s2 / count - d**2
+        m4 = s4 / count - 4 * d * s3 / count + 6 * d**2 * s2 / count - 3 * d**4
+        var = np.maximum(m2, 0.0) * count / (count - 1)
+        std = np.sqrt(var)
+        std_se = np.sqrt(np.maximum(m4 - m2**2, 0.0) / count) / (2 * std)
+        return {
+            "mean": shift + d,
+            "mean_se": std / np.sqrt(count),
+            "std": std,
+            "std_se": std_se,
+            "n_simulations": count,
+        }
+
+
+def differences_table(
+    stat: str,
+    tests: pd.DataFrame,
+    moments: dict[str, dict[str, np.ndarray]],
+    reference_stats: pd.DataFrame,
+    navr: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Simulated vs theoretical spreads, with the columns of the notebooks'
+    `empirical_vs_theoretical_differences_<stat>.csv`.
+    """
+    table = tests.copy()
+    for column in (stat, "p-val"):
+        for name, values in moments[column].items():
+            if name == "n_simulations":
+                continue
+            table[f"{column}_{name}"] = values
+        table[f"{column}_reference"] = reference_stats[column].to_numpy()
+    table["n_simulations"] = moments[stat]["n_simulations"].astype(int)
+    table["n"] = reference_stats["n"].to_numpy()
+    table = table.merge(navr, on=list(tests.columns), how="left")
+
+    n = table["n"].to_numpy(np.float64)
+    mean = table[f"{stat}_mean"].to_numpy()
+    navrs = table[navr_columns].to_numpy(np.float64).T
+    spread = std_statistic(stat, mean, n, navrs)
+    p_spread = std_p(stat, mean, n, navrs)
+    for suffix, s, p in zip(("", "_low", "_high"), spread, p_spread):
+        table[f"{stat}_std_theoretical{suffix}"] = s
+        table[f"p-val_std_theoretical{suffix}"] = p
+    if stat != "cohen_d":
+        exact = adaptive_p_moments(mean, np.square(spread[0]), stat, n - 2)
+        table["p-val_std_exact"] = exact["std"]
+
+    for column in (stat, "p-val"):
+        theoretical = table[f"{column}_std_theoretical"].replace(0, np.nan)
+        table[f"{column}_std_diff"] = np.abs(
+            table[f"{column}_std"] - table[f"{column}_std_theoretical"]
+        )
+        table[f"{column}_std_diff_rel"] = table[f"{column}_std_diff"] / theoretical
+        table[f"{column}_std_diff_rel_se"] = table[f"{column}_std_se"] / theoretical
+    return table
+
+
+def key_entropy(*key: str) -> list[int]:
+    """Stable 32-bit words of a (metric, timepoint, stat) key, for `SeedSequence`."""
+    digest = sha1("/".join(key).encode()).digest()
+    return [int.from_bytes(digest[i : i + 4], "little") for i in range(0, 16, 4)]
+
+
+def simulate(
+    inputs: dict,
+    navr_tables: dict,
+    n_simulations: int = 10000,
+    chunk_size: int = 256,
+    seed: int = 0,
+    n_jobs: int = -1,
+    verbose: int = 0,
+) -> dict:
+    """
+    Simulated spreads of every (metric, timepoint, statistic) of `inputs`.
+
+    Parameters
+    ----------
+    inputs : dict
+        (metric, timepoint, stat) -> `simulation_inputs`.
+    navr_tables : dict
+        (metric, timepoint) -> NAVR table (region[, hemisphere], NAVR,
+        NAVR_CI_low, NAVR_CI_high).
+    chunk_size : int
+        Simulated repetitions per task; the memory of a task is about
+        n_units * n_regions * chunk_size doubles.
+
+    Returns
+    -------
+    dict
+        (metric, timepoint, stat) -> `differences_table`.
+    """
+    prepared = {}
+    for key, (reference, tests, design) in inputs.items():
+        metric, timepoint, stat = key
+        navr = navr_tables[(metric, timepoint)]
+        navr = tests.merge(navr, on=list(tests.columns), how="left")
+        with np.errstate(invalid="ignore"):
+            anat = np.nanstd(reference, axis=0, ddof=1)
+        scale = np.nan_to_num(navr["NAVR"].to_numpy(np.float64) * anat)
+        reference_stats = _statistic_matrix(stat, reference, design)
+        shift = np.nan_to_num(reference_stats[[stat, "p-val"]].to_numpy(np.float64).T)
+        prepared[key] = (reference, tests, design, scale, shift, reference_stats)
+
+    sizes = [chunk_size] * (n_simulations // chunk_size)
+    if n_simulations % chunk_size:
+        sizes.append(n_simulations % chunk_size)
+    tasks = [
+        (key, size, chunk_seed)
+        for key in prepared
+        for size, chunk_seed in zip(
+            sizes,
+            np.random.SeedSequence([seed, *key_entropy(*key)]).spawn(len(sizes)),
+        )
+    ]
+    chunks = joblib.Parallel(n_jobs=n_jobs, verbose=verbose)(
+        joblib.delayed(simulate_chunk)(
+            key[2],
+            prepared[key][0],
+            prepared[key][3],
+            prepared[key][2],
+            prepared[key][4],
+            size,
+            chunk_seed,
+        )
+        for key, size, chunk_seed in tasks
+    )
+
+    tables = {}
+    for key, group in itertools.groupby(
+        zip(tasks, chunks), key=lambda task_chunk: task_chunk[0][0]
+    ):
+        stat = key[2]
+        _, tests, _, _, shift, reference_stats = prepared[key]
+        sums = [chunk for _, chunk in group]
+        moments = {
+            column: moments_from_sums(sum(chunk[column] for chunk in sums), shift[i])
+            for i, column in enumerate((stat, "p-val"))
+        }
+        tables[key] = differences_table(
+            stat, tests, moments, reference_stats, navr_tables[key[:2]]
+        )
+    return tables
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Monte Carlo validation of the NAVR propagation formulas"
+    )
+    parser.add_argument(
+        "--cohort",
+        default="cohort/longitudinal_cohort_qced.csv",
+        help="Longitudinal cohort CSV",
+    )
+    parser.add_argument(
+        "--stats-dir", default="stats_QCed/sampled", help="Sampled fuzzy tables"
+    )
+    parser.add_argument("--navr-dir", default="navr/csv_all", help="NAVR tables")
+    parser.add_argument(
+        "--output-dir",
+        default="numerical_validation/simulation",
+        help="Output directory of the difference tables",
+    )
+    parser.add_argument("--metrics", nargs="+", choices=list(metrics))
+    parser.add_argument("--timepoints", nargs="+", choices=timepoints)
+    parser.add_argument("--statistics", nargs="+", choices=statistics)
+    parser.add_argument("--n-simulations", type=int, default=10000)
+    parser.add_argument(
+        "--chunk-size", type=int, default=256, help="Simulations per task"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Number of processes")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cohort = load_cohort(args.cohort)
+    inputs, navr_tables = {}, {}
+    for metric in args.metrics or list(metrics):
+        wide = read_fuzzy(metric, args.stats_dir, cohort)
+        for timepoint in args.timepoints or timepoints:
+            navr_tables[(metric, timepoint)] = read_navr(
+                args.navr_dir, metric, timepoint
+            )
+            for stat in args.statistics or statistics:
+                inputs[(metric, timepoint, stat)] = simulation_inputs(
+                    wide, cohort, metric, timepoint, stat
+                )
+    tables = simulate(
+        inputs,
+        navr_tables,
+        n_simulations=args.n_simulations,
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+        n_jobs=args.n_jobs,
+        verbose=10,
+    )
+    for (metric, timepoint, stat), table in tables.items():
+        output = (
+            Path(args.output_dir)
+            / timepoint
+            / metric
+            / f"empirical_vs_theoretical_differences_{stat}.csv"
+        )
+        output.parent.mkdir(parents=True, exist_ok=True)
+        table.to_csv(output, index=False)
+        print(
+            f"{metric} {timepoint} {stat}: "
+            f"mean {stat}-std relative diff "
+            f"{table[f'{stat}_std_diff_rel'].mean():.3%} "
+            f"(MC error {table[f'{stat}_std_diff_rel_se'].mean():.3%})"
+        )
+
+
+if __name__ == "__main__":
+    main()
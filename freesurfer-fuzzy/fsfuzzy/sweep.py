@@ -0,0 +1,407 @@
+"""
+Sensitivity of NAVR and of the longitudinal significance to the number of
+MCA repetitions k.
+
+Instead of rerunning the npv and ancova notebooks with the first k (or k
+random) repetitions for every k, the curves of all k = 1..K are computed
+from nested subsets: for a seed, the repetitions of every subject-visit are
+put in the order of `fsfuzzy.sampling` (repetition number for `seed=None`,
+stable hash of (subject_visit, repetition, seed) otherwise), and the subset
+of size k is the first k of that order. Cumulative sums along the
+repetition axis then give the statistics of every k in one pass:
+- NAVR: per subject, count/sum/sum of squares of its first k repetitions
+  (numerical variance); per repetition slot, the variance over subjects,
+  averaged over the first k slots (anatomical variance). With a seed, the
+  slots pair the repetitions of the subjects by their rank in the seed
+  order, not by repetition number as a cube of the sample would, so that
+  the subsets stay nested; the numerical variance is the same;
+- significance: the per-repetition test results of `fsfuzzy.longitudinal`
+  (`<data_dir>/<test>/<test>_<timepoint>_<metric>.parquet`) in a random
+  order of the repetitions; proportion of p-values below alpha, mean and
+  spread of the statistic and of the p-value.
+
+Usage:
+    python -m fsfuzzy.sweep --cohort cohort/longitudinal_cohort_qced.csv \
+        --stats-dir stats_QCed/sampled --data-dir data \
+        --output-dir results/sweep --seeds 0 1 2 3 4 --figures
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fsfuzzy.cube import RepetitionCube
+from fsfuzzy.longitudinal import job_matrix
+from fsfuzzy.navr import (
+    load_cohort,
+    read_cube,
+    reference_shift,
+    variance_from_sums,
+)
+from fsfuzzy.sampling import repetition_hash
+from fsfuzzy.scheduler import ci_factor, cohort_populations
+
+_missing = np.iinfo(np.uint64).max
+
+
+def _seed_label(seed: int | None) -> str:
+    return "first" if seed is None else str(seed)
+
+
+def repetition_order(cube: RepetitionCube, seed: int | None) -> np.ndarray:
+    """
+    Order of the repetition slots of every subject-visit and hemisphere,
+    shape (n_repetitions, n_subject_visits, n_hemispheres); missing
+    repetitions come last.
+    """
+    repetitions = cube.repetitions
+    if seed is None:
+        key = repetitions.astype(np.uint64)
+    else:
+        subject_visits = np.broadcast_to(
+            cube.subjects["subject_visit"].to_numpy(dtype=object)[None, :, None],
+            repetitions.shape,
+        )
+        key = repetition_hash(
+            subject_visits.reshape(-1), repetitions.reshape(-1), seed
+        ).reshape(repetitions.shape)
+    key = np.where(repetitions >= 0, key, _missing)
+    return np.argsort(key, axis=0, kind="stable")
+
+
+def _cumulative_variance(count, total, squares) -> np.ndarray:
+    return variance_from_sums(
+        np.cumsum(count, axis=0), np.cumsum(total, axis=0), np.cumsum(squares, axis=0)
+    )
+
+
+def navr_curves(values: np.ndarray, shift: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Numerical and anatomical standard deviations and NAVR of the first k
+    repetitions of `values` [repetition, subject, hemisphere, region], for
+    every k.
+
+    Returns
+    -------
+    dict
+        num, anat, NAVR: arrays of shape (n_repetitions, n_hemispheres,
+        n_regions), row k - 1 for k repetitions.
+    """
+    shifted = values - shift
+    valid = ~np.isnan(shifted)
+    shifted = np.where(valid, shifted, 0.0)
+    squared = shifted * shifted
+
+    # variance of each subject over its first k repetitions
+    num = _cumulative_variance(valid, shifted, squared)
+    num_valid = ~np.isnan(num)
+    # variance over the subjects of each repetition slot
+    anat = variance_from_sums(
+        valid.sum(axis=1), shifted.sum(axis=1), squared.sum(axis=1)
+    )
+    anat_valid = ~np.isnan(anat)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        num = np.sqrt(np.where(num_valid, num, 0.0).sum(axis=1) / num_valid.sum(axis=1))
+        anat = np.sqrt(
+            np.cumsum(np.where(anat_valid, anat, 0.0), axis=0)
+            / np.cumsum(anat_valid, axis=0)
+        )
+        return {"num": num, "anat": anat, "NAVR": num / anat}
+
+
+def navr_sweep(
+    cube: RepetitionCube,
+    populations: dict[str, np.ndarray],
+    seeds: list[int | None] = (None,),
+    alpha: float = 0.05,
+) -> pd.DataFrame:
+    """
+    NAVR of every population, seed and k.
+
+    Returns
+    -------
+    DataFrame
+        metric, population, seed, k, region[, hemisphere], num, anat, NAVR,
+        n and CI_width (width of the F-based CI of `_add_navr_ci`).
+    """
+    n_repetitions = cube.shape[0]
+    regions = cube.regions["region"].to_numpy(dtype=object)
+    hemispheres = np.asarray(cube.hemispheres, dtype=object)
+    index = pd.MultiIndex.from_product(
+        [np.arange(1, n_repetitions + 1), hemispheres, regions],
+        names=["k", "hemisphere", "region"],
+    ).to_frame(index=False)
+    ks = index["k"].to_numpy()
+    if not cube.hemisphere:
+        index = index.drop(columns="hemisphere")
+
+    subject_visits = pd.Index(cube.subjects["subject_visit"])
+    codes = {
+        name: subject_visits.get_indexer(
+            visits[subject_visits.get_indexer(visits) >= 0]
+        )
+        for name, visits in populations.items()
+    }
+    tables = []
+    for seed in seeds:
+        order = repetition_order(cube, seed)
+        ordered = np.take_along_axis(cube.values, order[..., None], axis=0)
+        for name, subjects in codes.items():
+            values = ordered[:, subjects]
+            curves = navr_curves(values, reference_shift(values))
+            table = index.assign(
+                metric=cube.metric, population=name, seed=_seed_label(seed)
+            )
+            for column, curve in curves.items():
+                table[column] = curve.reshape(-1)
+            table["n"] = len(subjects)
+            table["CI_width"] = table["NAVR"] * ci_factor(len(subjects), ks, alpha)
+            tables.append(table)
+    columns = ["metric", "population", "seed", "k"]
+    table = pd.concat(tables, ignore_index=True)
+    return table[columns + [c for c in table.columns if c not in columns]]
+
+
+def significance_curves(
+    results: pd.DataFrame,
+    stat: str,
+    by: list[str],
+    seeds: list[int | None] = (None,),
+    alpha: float = 0.05,
+) -> pd.DataFrame:
+    """
+    Significance summary of the first k repetitions of `results`, for every
+    k and seed.
+
+    Parameters
+    ----------
+    results : DataFrame
+        Per-repetition results (`repetition`, `by`, `stat`, `p-val`).
+    seeds : list of int or None
+        Order of the repetitions: increasing for None, a random
+        permutation of `np.random.default_rng(seed)` otherwise.
+
+    Returns
+    -------
+    DataFrame
+        seed, k, `by`, n_tests, proportion_significant, mean_stat,
+        std_stat, mean_p, std_p, min_p, max_p.
+    """
+    rep_codes, repetitions = pd.factorize(results["repetition"], sort=True)
+    keys = results[by].drop_duplicates().sort_values(by, ignore_index=True)
+    key_codes = pd.MultiIndex.from_frame(keys).get_indexer(
+        pd.MultiIndex.from_frame(results[by])
+    )
+    shape = (len(repetitions), len(keys))
+    rows = np.zeros(shape)
+    np.add.at(rows, (rep_codes, key_codes), 1)
+    arrays = {}
+    for column in (stat, "p-val"):
+        array = np.full(shape, np.nan)
+        array[rep_codes, key_codes] = results[column].to_numpy(np.float64)
+        arrays[column] = array
+
+    tables = []
+    for seed in seeds:
+        order = (
+            np.arange(len(repetitions))
+            if seed is None
+            else np.random.default_rng(seed).permutation(len(repetitions))
+        )
+        table = pd.concat([keys] * len(repetitions), ignore_index=True)
+        table.insert(0, "k", np.repeat(np.arange(1, len(repetitions) + 1), len(keys)))
+        table.insert(0, "seed", _seed_label(seed))
+        n_rows = np.cumsum(rows[order], axis=0)
+        p = arrays["p-val"][order]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            significant = np.cumsum(p < alpha, axis=0) / n_rows
+        table["proportion_significant"] = significant.reshape(-1)
+        for name, column in (("stat", stat), ("p", "p-val")):
+            values = arrays[column][order]
+            valid = ~np.isnan(values)
+            shift = np.nanmean(np.where(valid, values, np.nan), axis=0)
+            shifted = np.where(valid, values - np.nan_to_num(shift), 0.0)
+            count = np.cumsum(valid, axis=0)
+            total = np.cumsum(shifted, axis=0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                mean = total / count + np.nan_to_num(shift)
+            if name == "stat":
+                table["n_tests"] = count.reshape(-1)
+            table[f"mean_{name}"] = np.where(count > 0, mean, np.nan).reshape(-1)
+            table[f"std_{name}"] = np.sqrt(
+                _cumulative_variance(valid, shifted, shifted * shifted)
+            ).reshape(-1)
+        table["min_p"] = np.fmin.accumulate(p, axis=0).reshape(-1)
+        table["max_p"] = np.fmax.accumulate(p, axis=0).reshape(-1)
+        tables.append(table)
+    columns = ["seed", "k"] + by + ["n_tests", "proportion_significant"]
+    table = pd.concat(tables, ignore_index=True)
+    return table[columns + [c for c in table.columns if c not in columns]]
+
+
+def significance_sweep(
+    data_dir: Path,
+    metric_names: list[str] | None = None,
+    seeds: list[int | None] = (None,),
+    alpha: float = 0.05,
+) -> pd.DataFrame:
+    """
+    `significance_curves` of every fuzzy job with results in `data_dir`.
+    """
+    tables = []
+    for job in job_matrix(metric_names, flavor_names=["fuzzy"]):
+        path = Path(data_dir) / job.test / f"{job.name}.parquet"
+        if not path.exists():
+            continue
+        by = ["region"] + (["hemisphere"] if job.hemisphere else [])
+        stat = job.statistic
+        results = pd.read_parquet(path, columns=["repetition"] + by + [stat, "p-val"])
+        curves = significance_curves(results, stat, by, seeds=seeds, alpha=alpha)
+        curves.insert(0, "statistic", stat)
+        curves.insert(0, "metric", job.metric)
+        curves.insert(0, "timepoint", job.timepoint)
+        curves.insert(0, "test", job.test)
+        tables.append(curves)
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+
+def convergence_summary(
+    curves: pd.DataFrame, by: list[str], value: str, quantiles=(0.05, 0.95)
+) -> pd.DataFrame:
+    """
+    Mean and quantiles of `value` over the seeds, per `by` and k.
+    """
+    keys = [c for c in by if c in curves.columns] + ["k"]
+    grouped = curves.groupby(keys, dropna=False)[value]
+    summary = grouped.mean().rename(value).to_frame()
+    for q in quantiles:
+        summary[f"{value}_q{round(q * 100):02d}"] = grouped.quantile(q)
+    return summary.reset_index()
+
+
+def plot_convergence(summary: pd.DataFrame, value: str, title: str):
+    """
+    Line of `value` against k per region (dashed for rh), with the seed
+    quantiles of `convergence_summary` in the hover.
+    """
+    import plotly.express as px
+
+    hemisphere = "hemisphere" in summary.columns and summary["hemisphere"].notna().any()
+    fig = px.line(
+        summary,
+        x="k",
+        y=value,
+        color="region",
+        line_dash="hemisphere" if hemisphere else None,
+        hover_data=[c for c in summary.columns if c.startswith(f"{value}_q")],
+        title=title,
+    )
+    fig.update_layout(
+        xaxis_title="Repetitions (k)",
+        yaxis_title=value,
+        title_x=0.5,
+        height=600,
+        width=1400,
+        plot_bgcolor="white",
+    )
+    fig.update_xaxes(showline=True, linewidth=1, linecolor="black")
+    fig.update_yaxes(showline=True, linewidth=1, linecolor="black")
+    return fig
+
+
+def write_figures(navr: pd.DataFrame, significance: pd.DataFrame, figures_dir: Path):
+    """HTML convergence plots per (metric, population) and per job."""
+    figures_dir = Path(figures_dir)
+    figures_dir.mkdir(parents=True, exist_ok=True)
+    by = ["region", "hemisphere"]
+    for (metric, population), curves in navr.groupby(["metric", "population"]):
+        summary = convergence_summary(curves, by, "NAVR")
+        fig = plot_convergence(summary, "NAVR", f"NAVR vs k: {metric}, {population}")
+        fig.write_html(figures_dir / f"navr_{population}_{metric}.html")
+    if significance.empty:
+        return
+    jobs = significance.groupby(["test", "timepoint", "metric"])
+    for (test, timepoint, metric), curves in jobs:
+        summary = convergence_summary(curves, by, "proportion_significant")
+        fig = plot_convergence(
+            summary,
+            "proportion_significant",
+            f"Proportion significant vs k: {test}, {timepoint}, {metric}",
+        )
+        fig.write_html(figures_dir / f"{test}_{timepoint}_{metric}.html")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="NAVR and significance curves against the number of repetitions"
+    )
+    parser.add_argument(
+        "--cohort",
+        default="cohort/longitudinal_cohort_qced.csv",
+        help="Longitudinal cohort CSV",
+    )
+    parser.add_argument(
+        "--stats-dir", default="stats_QCed/sampled", help="Sampled fuzzy tables"
+    )
+    parser.add_argument(
+        "--cube-dir",
+        default="stats_QCed/cube",
+        help="Cubes of fsfuzzy.cube.build_cubes, memory-mapped when built from "
+        "the --stats-dir tables (default: stats_QCed/cube)",
+    )
+    parser.add_argument(
+        "--data-dir", default="data", help="Per-repetition results of the tests"
+    )
+    parser.add_argument("--output-dir", default="results/sweep")
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        choices=["thickness", "area", "volume", "subcortical_volume"],
+        default=["thickness", "area", "volume", "subcortical_volume"],
+    )
+    parser.add_argument(
+        "--seeds",
+        nargs="+",
+        type=int,
+        default=[],
+        help="Random repetition subsets, in addition to the first k repetitions",
+    )
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument(
+        "--figures", action="store_true", help="Write HTML plots (needs plotly)"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    seeds = [None] + args.seeds
+    populations = cohort_populations(load_cohort(args.cohort))
+    navr = pd.concat(
+        [
+            navr_sweep(
+                read_cube(Path(args.stats_dir) / "partitioned", metric, args.cube_dir),
+                populations,
+                seeds=seeds,
+                alpha=args.alpha,
+            )
+            for metric in args.metrics
+        ],
+        ignore_index=True,
+    )
+    significance = significance_sweep(
+        args.data_dir, args.metrics, seeds=seeds, alpha=args.alpha
+    )
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    navr.to_csv(output_dir / "navr_k.csv", index=False)
+    significance.to_csv(output_dir / "significance_k.csv", index=False)
+    print(f"NAVR curves: {len(navr)} rows, significance curves: {len(significance)}")
+    if args.figures:
+        write_figures(navr, significance, output_dir / "figures")
+
+
+if __name__ == "__main__":
+    main()
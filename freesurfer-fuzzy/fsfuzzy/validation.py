@@ -0,0 +1,243 @@
+"""
+Inputs of the numerical_validation notebooks in one run.
+
+The `numerical_validation/{ancova,t_test,cohen_d,correlation}` notebooks
+read per-repetition results and summarize them per region
+(`prepare_ancova_data` / `prepare_data`) before comparing their spread to
+the propagation formulas. For every metric and timepoint, the fuzzy table
+is read once (`fsfuzzy.longitudinal.read_fuzzy`), turned into the
+baseline or change table once, and tested for every repetition and region
+as array operations:
+- F: `fsfuzzy.ancova` (group + covariates);
+- t, Cohen's d and ICV-adjusted Cohen's d: `fsfuzzy.two_sample`, with the
+  EstimatedTotalIntraCranialVol of the same repetition (of the first visit
+  for the longitudinal change);
+- r: `fsfuzzy.partial_correlation` (PD-non-MCI subjects).
+
+Outputs, in the layout read and written by the notebooks:
+
+    <data_dir>/{ancova,student,cohen_d,partial_correlation}/<prefix>_<timepoint>_<metric>.parquet
+    <csv_dir>/<timepoint>/<metric>/{ancova,cohen_d}_stats_<stat>.csv
+
+where the stats tables have the columns of `summary_table` (`F_mean`,
+`F_std`, ..., `p-val_median`, `n_first`) and the HC-PD NAVR columns.
+
+Usage:
+    python -m fsfuzzy.validation --cohort cohort/longitudinal_cohort_qced.csv \
+        --stats-dir stats_QCed/sampled --navr-dir navr/csv_all \
+        --data-dir data --csv-dir numerical_validation/csv
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from fsfuzzy.longitudinal import (
+    Job,
+    baseline_table,
+    change_table,
+    factors,
+    load_cohort,
+    metrics,
+    read_fuzzy,
+    run_test,
+    timepoints,
+)
+from fsfuzzy.navr import read_navr
+from fsfuzzy.two_sample import batched_two_sample
+
+summary_statistics = ["mean", "std", "min", "max", "median"]
+icv_region = "EstimatedTotalIntraCranialVol"
+
+# statistic -> (directory and file prefix of the results, stats file prefix)
+outputs = {
+    "F": ("ancova", "ancova"),
+    "t": ("student", "ancova"),
+    "cohen_d": ("cohen_d", "cohen_d"),
+    "cohen_d_icv": ("cohen_d", "cohen_d"),
+    "r": ("partial_correlation", "ancova"),
+}
+_result_columns = {
+    "ancova": ["F", "p-val", "np2", "n"],
+    "student": ["t", "dof", "p-val", "n"],
+    "cohen_d": ["cohen_d", "cohen_d_icv", "n"],
+    "partial_correlation": ["r", "p-val", "n"],
+}
+
+
+def summary_table(
+    results: pd.DataFrame, stat: str, by: list[str], p_value: bool = True
+) -> pd.DataFrame:
+    """
+    Per-region summary of the repetitions, with the flattened columns of
+    the notebooks: `<stat>_mean`, ..., `<stat>_median`, then the same for
+    `p-val` (if `p_value`), then `n_first`.
+    """
+    aggregations = {stat: summary_statistics}
+    if p_value:
+        aggregations["p-val"] = summary_statistics
+    aggregations["n"] = "first"
+    summary = results.groupby(by).agg(aggregations).reset_index()
+    summary.columns = ["_".join(col).strip("_") for col in summary.columns.values]
+    return summary
+
+
+def read_icv(stats_dir: Path, cohort: pd.DataFrame) -> pd.DataFrame | None:
+    """
+    ICV of every subject-visit and repetition (`subject_visit`,
+    `repetition`, `ICV`), None if the subcortical table has no ICV.
+    """
+    wide = read_fuzzy("subcortical_volume", stats_dir, cohort)
+    if icv_region not in wide.columns:
+        return None
+    return wide[["subject_visit", "repetition", icv_region]].rename(
+        columns={icv_region: "ICV"}
+    )
+
+
+def _with_icv(
+    table: pd.DataFrame,
+    icv: pd.DataFrame,
+    cohort: pd.DataFrame,
+    timepoint: str,
+) -> pd.DataFrame:
+    if timepoint == "baseline":
+        return table.merge(icv, on=["subject_visit", "repetition"], how="left")
+    first_visit = cohort[["PATNO", "first_visit"]].rename(
+        columns={"first_visit": "subject_visit"}
+    )
+    icv = icv.merge(first_visit, on="subject_visit").drop(columns="subject_visit")
+    return table.merge(icv, on=["PATNO", "repetition"], how="left")
+
+
+def validation_results(
+    wide: pd.DataFrame,
+    cohort: pd.DataFrame,
+    metric: str,
+    timepoint: str,
+    icv: pd.DataFrame | None = None,
+) -> dict[str, pd.DataFrame]:
+    """
+    Per-repetition results of every test of one (metric, timepoint).
+
+    Returns
+    -------
+    dict
+        ancova, student, cohen_d, partial_correlation -> results with
+        repetition, region[, hemisphere] and `_result_columns`.
+    """
+    baseline = timepoint == "baseline"
+    table = (
+        baseline_table(wide, cohort, metric)
+        if baseline
+        else change_table(wide, cohort, metric)
+    )
+    hemi = ["hemisphere"] if metrics[metric] else []
+    by = ["repetition", "region"] + hemi
+    if icv is not None:
+        table = _with_icv(table, icv, cohort, timepoint)
+
+    results = {"ancova": run_test(table, Job("ancova", timepoint, metric, "fuzzy"))}
+    two_sample = batched_two_sample(
+        table,
+        dv=metric if baseline else f"{metric}_change",
+        between=factors[timepoint],
+        by=by,
+        unit="subject_visit" if baseline else "PATNO",
+        icv="ICV" if icv is not None else None,
+    )
+    if icv is None:
+        two_sample["cohen_d_icv"] = float("nan")
+    results["student"] = two_sample
+    results["cohen_d"] = two_sample
+
+    pd_subjects = cohort.loc[cohort["dx_group"] == "PD-non-MCI", "PATNO"]
+    pd_table = table[table["PATNO"].isin(pd_subjects)]
+    results["partial_correlation"] = run_test(
+        pd_table, Job("partial_correlation", timepoint, metric, "fuzzy")
+    )
+    return {
+        name: result[by + _result_columns[name]] for name, result in results.items()
+    }
+
+
+def write_validation(
+    results: dict[str, pd.DataFrame],
+    metric: str,
+    timepoint: str,
+    data_dir: Path,
+    csv_dir: Path,
+    navr: pd.DataFrame | None = None,
+) -> list[Path]:
+    """
+    Write the per-repetition results and the stats table of every
+    statistic; returns the paths of the stats tables.
+    """
+    for name, result in results.items():
+        path = Path(data_dir) / name / f"{name}_{timepoint}_{metric}.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        result.to_parquet(path, index=False)
+
+    by = ["region"] + (["hemisphere"] if metrics[metric] else [])
+    written = []
+    for stat, (name, prefix) in outputs.items():
+        summary = summary_table(results[name], stat, by, p_value=name != "cohen_d")
+        if navr is not None:
+            summary = summary.merge(navr, on=by, how="left")
+        path = Path(csv_dir) / timepoint / metric / f"{prefix}_stats_{stat}.csv"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        summary.to_csv(path, index=False)
+        written.append(path)
+    return written
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Per-repetition results and stats of the numerical validation"
+    )
+    parser.add_argument(
+        "--cohort",
+        default="cohort/longitudinal_cohort_qced.csv",
+        help="Longitudinal cohort CSV",
+    )
+    parser.add_argument(
+        "--stats-dir", default="stats_QCed/sampled", help="Sampled fuzzy tables"
+    )
+    parser.add_argument("--navr-dir", help="NAVR tables merged into the stats tables")
+    parser.add_argument(
+        "--data-dir", default="data", help="Output directory of the results"
+    )
+    parser.add_argument(
+        "--csv-dir",
+        default="numerical_validation/csv",
+        help="Output directory of the stats tables",
+    )
+    parser.add_argument("--metrics", nargs="+", choices=list(metrics))
+    parser.add_argument("--timepoints", nargs="+", choices=timepoints)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cohort = load_cohort(args.cohort)
+    icv = read_icv(args.stats_dir, cohort)
+    if icv is None:
+        print(f"No {icv_region} in the subcortical table: cohen_d_icv is NaN")
+    for metric in args.metrics or list(metrics):
+        start = time.perf_counter()
+        wide = read_fuzzy(metric, args.stats_dir, cohort)
+        for timepoint in args.timepoints or timepoints:
+            results = validation_results(wide, cohort, metric, timepoint, icv)
+            navr = (
+                read_navr(args.navr_dir, metric, timepoint) if args.navr_dir else None
+            )
+            write_validation(
+                results, metric, timepoint, args.data_dir, args.csv_dir, navr
+            )
+        print(f"{metric}: {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Pairing of the visits of longitudinal long-form tables.
+
+`relative_change` joins the first-visit and second-visit tables (one row
+per subject-visit, repetition, region[, hemisphere]) without a merge on
+string columns. Each key column is factorized once per table and the codes
+are mapped to shared uniques, so only the distinct values (a few hundred
+subjects and regions) are hashed as strings. The codes are combined into
+one int64 key per row, the visit-2 row of every visit-1 row is found with
+a single integer lookup, and the change is one vectorized subtraction on
+the aligned metric arrays.
+"""
+
+from collections.abc import Callable
+
+import numpy as np
+import pandas as pd
+
+
+def patno(subject_visits: pd.Index) -> pd.Series:
+    """Subject of each subject-visit: the prefix before '_'."""
+    return pd.Series(subject_visits).astype(str).str.split("_").str[0]
+
+
+def _shared_codes(
+    left: pd.Series,
+    right: pd.Series,
+    transform: Callable[[pd.Index], pd.Series] | None = None,
+) -> tuple[np.ndarray, np.ndarray, pd.Index]:
+    """
+    Codes of two columns on shared uniques; NaN is a value, as in `merge`.
+
+    `transform` maps the distinct values before they are shared, e.g.
+    subject-visits to subjects.
+    """
+    left_codes, left_uniques = pd.factorize(left, use_na_sentinel=False)
+    right_codes, right_uniques = pd.factorize(right, use_na_sentinel=False)
+    values = [pd.Series(left_uniques), pd.Series(right_uniques)]
+    if transform is not None:
+        values = [transform(pd.Index(v)) for v in values]
+    codes, uniques = pd.factorize(
+        pd.concat(values, ignore_index=True), use_na_sentinel=False
+    )
+    n_left = len(left_uniques)
+    return codes[:n_left][left_codes], codes[n_left:][right_codes], pd.Index(uniques)
+
+
+def relative_change(
+    v1: pd.DataFrame, v2: pd.DataFrame, metric: str, keys: list[str]
+) -> pd.DataFrame:
+    """
+    Pair the visit-1 and visit-2 rows with the same `keys` and compute::
+
+        <metric>_change = (<metric>_T2 - <metric>_T1) / <metric>_T1
+
+    Same table as::
+
+        m = v1.merge(v2, on=keys, suffixes=("_baseline", "_next"))
+        m[f"{metric}_change"] = (m[f"{metric}_next"] - m[f"{metric}_baseline"]) / m[
+            f"{metric}_baseline"
+        ]
+        m = m.drop(columns=[c for c in m.columns if c.endswith("_baseline")])
+        m = m.rename(columns=lambda x: x.replace("_next", ""))
+
+    when every column other than `keys` is in both tables: the key columns
+    in the order of `v1`, then the other columns of `v2`, then the change;
+    visit-1 rows without a visit-2 row are dropped.
+
+    Parameters
+    ----------
+    v1, v2 : DataFrame
+        Long-form tables of the first and second visits.
+    metric : str
+        Measurement column.
+    keys : list of str
+        Join columns. `PATNO`, if missing from the tables, is derived from
+        `subject_visit` (see `patno`) and appended to the visit-1 columns.
+
+    Raises
+    ------
+    ValueError
+        If several visit-2 rows share the same keys.
+    """
+    derived = "PATNO" in keys and "PATNO" not in v1.columns
+    codes1, codes2, dims = [], [], []
+    subjects = None
+    for key in keys:
+        if key == "PATNO" and derived:
+            c1, c2, subjects = _shared_codes(
+                v1["subject_visit"], v2["subject_visit"], transform=patno
+            )
+            uniques = subjects
+        else:
+            c1, c2, uniques = _shared_codes(v1[key], v2[key])
+        codes1.append(c1)
+        codes2.append(c2)
+        dims.append(max(len(uniques), 1))
+
+    key1 = np.ravel_multi_index(codes1, dims)
+    key2 = pd.Index(np.ravel_multi_index(codes2, dims))
+    if not key2.is_unique:
+        raise ValueError(f"Several visit-2 rows per ({', '.join(keys)})")
+    match = key2.get_indexer(key1)
+    rows1 = np.flatnonzero(match >= 0)
+    rows2 = match[rows1]
+
+    key_columns = [c for c in v1.columns if c in keys]
+    out = v1[key_columns].take(rows1).reset_index(drop=True)
+    if derived:
+        out["PATNO"] = subjects.take(codes1[keys.index("PATNO")][rows1])
+    others = [c for c in v2.columns if c not in keys]
+    out = pd.concat([out, v2[others].take(rows2).reset_index(drop=True)], axis=1)
+
+    baseline = v1[metric].to_numpy(np.float64)[rows1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[f"{metric}_change"] = (
+            out[metric].to_numpy(np.float64) - baseline
+        ) / baseline
+    return out